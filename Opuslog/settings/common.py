@@ -56,9 +56,11 @@ INSTALLED_APPS = [
     'write_up',
     'engagement',
     'essential',
+    'log',
 ]
 
 MIDDLEWARE_CLASSES = [
+    'essential.profiling.QueryProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -67,6 +69,7 @@ MIDDLEWARE_CLASSES = [
     'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'publication.roles.RoleCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'Opuslog.urls'
@@ -185,3 +188,104 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': ('rest_framework.permissions.IsAdminUser',),
     'PAGE_SIZE': 10
 }
+
+# Notification feed
+NOTIFICATION_FEED_PAGE_SIZE = 20
+NOTIFICATION_UNREAD_CACHE_TIMEOUT = 60 * 60
+
+# Subscriber fan-out (essential.fanout)
+FAN_OUT_CHUNK_SIZE = 5000
+FAN_OUT_INSERT_BATCH_SIZE = 1000
+FAN_OUT_STALE_SECONDS = 5 * 60
+
+# Revision history, a full snapshot is stored at least every N revisions
+REVISION_SNAPSHOT_INTERVAL = 20
+
+# Autosaves of a user within this many seconds of each other are recorded as one revision
+AUTOSAVE_IDLE_WINDOW = 60
+
+# Viewer log write-behind buffer (log.buffer), flushed on whichever threshold is hit first
+VIEW_BUFFER_MAX_SIZE = 1000
+VIEW_BUFFER_FLUSH_INTERVAL = 5
+# heartbeats of views older than this (seconds) are ignored
+VIEW_HEARTBEAT_MAX_AGE = 24 * 60 * 60
+
+# Viewer log rows are rolled up once they are older than this (seconds), see 'rollup_views'. Never less
+# than VIEW_HEARTBEAT_MAX_AGE, the margin covers heartbeat flushes still in flight
+VIEW_ROLLUP_SETTLE_DELAY = VIEW_HEARTBEAT_MAX_AGE + 5 * 60
+
+# Group writing locks, heartbeat lease ('X') and session length before a captcha is needed ('Y')
+GROUP_WRITING_LEASE_SECONDS = 2 * 60
+GROUP_WRITING_SESSION_SECONDS = 30 * 60
+
+# Live writing channel (write_up.live)
+LIVE_WRITING_CHECKPOINT_SECONDS = 10
+LIVE_WRITING_VIEWER_QUEUE = 100
+LIVE_WRITING_KEEPALIVE_SECONDS = 15
+LIVE_WRITING_MAX_PATCH_BYTES = 64 * 1024
+
+# Comment threads, top level comments per page and replies prefetched per comment
+COMMENT_PAGE_SIZE = 20
+COMMENT_REPLY_LIMIT = 3
+
+# Home timeline, authors with more subscribers than TIMELINE_FAN_OUT_LIMIT are merged in at read time
+TIMELINE_PAGE_SIZE = 20
+TIMELINE_MAX_ENTRIES = 500
+TIMELINE_FAN_OUT_LIMIT = 10000
+
+# Full-text search (write_up.search), text beyond SEARCH_TEXT_MAX_LENGTH characters is not indexed
+SEARCH_CONFIG = 'english'
+SEARCH_PAGE_SIZE = 20
+SEARCH_TEXT_MAX_LENGTH = 500000
+
+# Trending score of write ups (write_up.trending), events lose half their weight every half life (seconds)
+TRENDING_HALF_LIFE = 6 * 60 * 60
+TRENDING_WEIGHTS = {
+    'up_vote': 1.0,
+    'down_vote': -1.0,
+    'comment': 2.0,
+    'view': 0.1,
+}
+TRENDING_MIN_SCORE = 1e-3
+TRENDING_RENORMALIZE_BATCH = 10000
+
+# Cover images (write_up.covers), derived widths in pixels, formats by preference
+COVER_SIZES = {'small': 160, 'medium': 480, 'large': 1200}
+COVER_FORMATS = ('webp', 'jpg')
+COVER_QUALITY = 82
+COVER_WORKERS = 2
+
+# Ownership and contributor role lookups (publication.roles), shared cache lifetime in seconds
+ROLE_CACHE_TIMEOUT = 60 * 60
+
+# Results of the 'run_benchmarks' command, one JSON file per run
+BENCHMARK_RESULTS_DIR = os.path.join(BASE_DIR, 'benchmark_results')
+
+# Sampled query profiling (essential.profiling), report with 'profiling_report'
+PROFILING_SAMPLE_RATE = 0.01
+PROFILING_FLUSH_INTERVAL = 60
+PROFILING_N_PLUS_ONE_THRESHOLD = 5
+PROFILING_DB_PATH = os.path.join(BASE_DIR, 'profiling.sqlite3')
+
+# Units of a collection per page of Unit.objects.get_page
+UNIT_PAGE_SIZE = 50
+
+# Rendered html cache of texts (write_up.rendering), bump RENDER_VERSION when the sanitizer changes
+RENDER_VERSION = 1
+RENDER_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+RENDER_LOCK_WAIT = 2.0
+
+# Monthly partitions (essential.partitions), maintained by the 'manage_partitions' command
+PARTITION_PREMAKE_MONTHS = 3
+PARTITION_RETENTION_MONTHS = {
+    'log.AnonymousViewer': 24,
+    'log.RegisteredViewer': 24,
+    'essential.Notification': 12,
+}
+PARTITION_RETENTION_ACTION = 'archive'  # 'detach', 'archive' or 'drop'
+PARTITION_ARCHIVE_DIR = os.path.join(BASE_DIR, 'partition_archive')
+
+# Notifications of the same type and target within the window (seconds) are merged into one
+NOTIFICATION_COALESCE_WINDOW = 24 * 60 * 60
+NOTIFICATION_SAMPLE_ACTORS = 3
+NOTIFICATION_MAX_TRACKED_ACTORS = 1000
@@ -2,3 +2,9 @@ class EngagementError(Exception):
     """ Custom Exception
     Used by models in Engagement app """
     pass
+
+
+class GroupWritingLockError(Exception):
+    """ Custom Exception
+    Raised when a Group writing lock can not be acquired, renewed or released """
+    pass
@@ -6,6 +6,9 @@ from engagement.models import VoteWriteUp, Comment, VoteComment, Subscriber
 class EngagementAdmin(admin.ModelAdmin):
     list_display = ('content_type', 'object_id', 'actor', 'timestamp')
 
+    def get_queryset(self, request):
+        return super(EngagementAdmin, self).get_queryset(request).with_actors()
+
     def get_readonly_fields(self, request, obj=None):
         if request.user.is_superuser:
             self.readonly_fields = ()
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from engagement.models import VoteWriteUp, VoteComment
+from essential.utils import atomic_with_retry
+
+# (vote model, target field) pairs whose counters are rebuilt
+VOTE_MODELS = (
+    (VoteWriteUp, 'write_up'),
+    (VoteComment, 'comment'),
+)
+
+REBUILD_SQL = """
+UPDATE {target} AS t
+SET up_votes = coalesce(v.up_votes, 0), down_votes = coalesce(v.down_votes, 0)
+FROM {target} AS r
+LEFT JOIN (SELECT {fk} AS target_id,
+                  count(*) FILTER (WHERE vote_type) AS up_votes,
+                  count(*) FILTER (WHERE NOT vote_type) AS down_votes
+           FROM {votes}
+           WHERE {fk} >= %s AND {fk} < %s
+           GROUP BY {fk}) AS v ON v.target_id = r.id
+WHERE t.id = r.id AND r.id >= %s AND r.id < %s
+  AND (t.up_votes <> coalesce(v.up_votes, 0) OR t.down_votes <> coalesce(v.down_votes, 0))
+"""
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the denormalized up_votes/down_votes counters from the vote tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Number of target ids recomputed per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for vote_model, target_field in VOTE_MODELS:
+            field = vote_model._meta.get_field(target_field)
+            target_model = field.related_model
+            sql = REBUILD_SQL.format(target=target_model._meta.db_table,
+                                     votes=vote_model._meta.db_table,
+                                     fk=field.column)
+
+            last = target_model.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            fixed = 0
+            start = 0
+            while start <= last:
+                end = start + batch_size
+                fixed += self.rebuild_range(sql, start, end)
+                start = end
+
+            self.stdout.write("%s: %s rows corrected" % (target_model._meta.label, fixed))
+
+    @atomic_with_retry()
+    def rebuild_range(self, sql, start, end):
+        """ A batch conflicting with concurrent votes is recomputed from a fresh snapshot """
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [start, end, start, end])
+            return cursor.rowcount
@@ -1,14 +1,75 @@
 from __future__ import unicode_literals
 
+from collections import defaultdict
+
+from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import models, IntegrityError
+from django.db.models import F
+
+from essential.utils import atomic_with_retry, encode_cursor, decode_cursor
+from publication.models import ContributorList
+from write_up.trending import add_trending, get_weight
+
+
+def resolve_actors(engagements):
+    """
+    Fills the 'actor' of every engagement with one query per actor content type.
+    ContributorList actors come with their publication and contributor.
+    Engagements without an actor content type (e.g. hidden actors) get None.
+    """
+
+    ids = defaultdict(set)
+    for engagement in engagements:
+        if engagement.content_type_id is not None:
+            ids[engagement.content_type_id].add(engagement.object_id)
+
+    actors = {}
+    for content_type_id, object_ids in ids.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        queryset = model._default_manager.filter(pk__in=object_ids)
+        if model is ContributorList:
+            queryset = queryset.select_related('publication', 'contributor')
+        for actor in queryset:
+            actors[(content_type_id, actor.pk)] = actor
+
+    for engagement in engagements:
+        actor_field = [f for f in engagement._meta.virtual_fields if f.name == 'actor'][0]
+        setattr(engagement, actor_field.cache_attr, actors.get((engagement.content_type_id, engagement.object_id)))
+    return engagements
+
+
+class EngagementQuerySet(models.QuerySet):
+    """
+    with_actors -> actors of the fetched engagements are resolved in bulk (see resolve_actors),
+    rendering 'actor' for a page of engagements costs one query per actor type instead of one per row
+    """
+
+    _with_actors = False
+
+    def with_actors(self):
+        return self._clone(_with_actors=True)
+
+    def _clone(self, **kwargs):
+        kwargs.setdefault('_with_actors', self._with_actors)
+        return super(EngagementQuerySet, self)._clone(**kwargs)
+
+    def _fetch_all(self):
+        fetched = self._result_cache is not None
+        super(EngagementQuerySet, self)._fetch_all()
+        if self._with_actors and not fetched:
+            resolve_actors([row for row in self._result_cache if isinstance(row, Engagement)])
+
+
+EngagementManager = models.Manager.from_queryset(EngagementQuerySet)
 
 
 class Engagement(models.Model):
     """
     Everything extending this acts as a log
-    actor -> can be either a user or publication (via contributor list)
+    actor -> can be either a user or publication (via contributor list),
+    use 'objects.with_actors()' when actors of many rows are needed
     """
 
     LIMIT = models.Q(app_label='publication',
@@ -19,10 +80,73 @@ class Engagement(models.Model):
     actor = GenericForeignKey('content_type', 'object_id')
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    objects = EngagementManager()
+
     class Meta:
         abstract = True
 
 
+class VoteManager(EngagementManager):
+    """
+    Manager for vote models, keeps the denormalized 'up_votes'/'down_votes' counters
+    of the voted object in sync with the vote rows.
+
+    target_field -> name of the ForeignKey to the voted object
+    trending -> votes also count towards the trending score of the voted write up
+
+    cast_vote -> creates the vote of an actor or flips its vote_type
+    remove_vote -> deletes the vote of an actor
+
+    Counters are changed with a relative UPDATE in the same transaction as the vote row, so
+    concurrent voters never overwrite each other. Votes should always be changed through these
+    methods, counters can be rebuilt with the 'rebuild_vote_counts' command.
+    """
+
+    def __init__(self, target_field, trending=False):
+        super(VoteManager, self).__init__()
+        self.target_field = target_field
+        self.trending = trending
+
+    def _actor_lookup(self, actor, target):
+        return {'content_type': ContentType.objects.get_for_model(actor),
+                'object_id': actor.pk,
+                self.target_field: target}
+
+    def _update_counters(self, target, vote, up=0, down=0):
+        target.__class__.objects.filter(pk=target.pk).update(up_votes=F('up_votes') + up,
+                                                            down_votes=F('down_votes') + down)
+        if self.trending:
+            # weighted at the time of the vote, so a flip or removal exactly undoes its earlier weight
+            add_trending({target.pk: up * get_weight('up_vote') + down * get_weight('down_vote')}, vote.timestamp)
+
+    @atomic_with_retry(retry_on=(IntegrityError,))
+    def cast_vote(self, actor, target, vote_type=True):
+        """ Returns the vote, an IntegrityError on create means a concurrent first vote of the same actor """
+
+        lookup = self._actor_lookup(actor, target)
+        vote = self.get_queryset().select_for_update().filter(**lookup).first()
+        if vote is None:
+            vote = self.create(vote_type=vote_type, **lookup)
+            self._update_counters(target, vote, up=int(vote_type), down=int(not vote_type))
+        elif vote.vote_type != vote_type:
+            self.get_queryset().filter(pk=vote.pk).update(vote_type=vote_type)
+            vote.vote_type = vote_type
+            change = 1 if vote_type else -1
+            self._update_counters(target, vote, up=change, down=-change)
+        return vote
+
+    @atomic_with_retry()
+    def remove_vote(self, actor, target):
+        """ Returns False if the actor had not voted """
+
+        vote = self.get_queryset().select_for_update().filter(**self._actor_lookup(actor, target)).first()
+        if vote is None:
+            return False
+        vote.delete()
+        self._update_counters(target, vote, up=-int(vote.vote_type), down=-int(not vote.vote_type))
+        return True
+
+
 class VoteWriteUp(Engagement):
     """
     Log for Up Votes on Write ups
@@ -32,22 +156,97 @@ class VoteWriteUp(Engagement):
     vote_type = models.BooleanField(default=True)
     write_up = models.ForeignKey('write_up.WriteUpCollection', on_delete=models.CASCADE)
 
+    objects = VoteManager('write_up', trending=True)
+
     class Meta:
         unique_together = ("content_type", "object_id",
                            "write_up")  # FIXME :PROBLEM unique together will not work with new Engagement model scheme
 
 
+COMMENT_COLUMNS = """
+c.id, c.write_up_id, c.comment_text, c.reply_to_id, c.delete_request, c.timestamp, c.up_votes, c.down_votes,
+CASE WHEN c.delete_request THEN NULL ELSE c.content_type_id END AS content_type_id,
+CASE WHEN c.delete_request THEN NULL ELSE c.object_id END AS object_id
+"""
+
+
+class CommentManager(EngagementManager):
+    """
+    Manager for Comment model
+
+    get_thread_page -> one page of the discussion of a write up, newest top level comments first:
+    {'comments': [<Comment with .reply_count and .replies>, ...], 'next': '<cursor>' or None}
+
+    Top level comments are paged by keyset on (timestamp, id), the first 'reply_limit' replies
+    (oldest first) of the whole page are fetched with one LATERAL query, so a page costs a fixed
+    number of queries (plus one per actor type). Actors of comments with a delete_request are
+    nulled in the queries themselves and resolve to None.
+    """
+
+    def get_thread_page(self, write_up, cursor=None, limit=None, reply_limit=None):
+        limit = limit or getattr(settings, 'COMMENT_PAGE_SIZE', 20)
+        reply_limit = reply_limit if reply_limit is not None else getattr(settings, 'COMMENT_REPLY_LIMIT', 3)
+        table = self.model._meta.db_table
+
+        params = [getattr(write_up, 'pk', write_up)]
+        keyset = ''
+        if cursor:
+            keyset = 'AND (c.timestamp, c.id) < (%s, %s)'
+            params.extend(decode_cursor(cursor))
+        params.append(limit + 1)
+        comments = list(self.raw(
+            "SELECT {columns}, (SELECT count(*) FROM {table} r WHERE r.reply_to_id = c.id) AS reply_count "
+            "FROM {table} c WHERE c.write_up_id = %s AND c.reply_to_id IS NULL {keyset} "
+            "ORDER BY c.timestamp DESC, c.id DESC LIMIT %s".format(columns=COMMENT_COLUMNS, table=table,
+                                                                    keyset=keyset), params))
+
+        next_cursor = None
+        if len(comments) > limit:
+            comments = comments[:limit]
+            next_cursor = encode_cursor(comments[-1].timestamp, comments[-1].id)
+
+        replies = defaultdict(list)
+        if comments and reply_limit:
+            for reply in self.raw(
+                    "SELECT {columns} FROM unnest(%s) AS p (id) CROSS JOIN LATERAL ("
+                    "SELECT * FROM {table} r WHERE r.reply_to_id = p.id ORDER BY r.timestamp, r.id LIMIT %s) c "
+                    "ORDER BY c.reply_to_id, c.timestamp, c.id".format(columns=COMMENT_COLUMNS, table=table),
+                    [[comment.id for comment in comments], reply_limit]):
+                replies[reply.reply_to_id].append(reply)
+
+        for comment in comments:
+            comment.replies = replies[comment.id]
+        resolve_actors(comments + [reply for thread in replies.values() for reply in thread])
+        return {'comments': comments, 'next': next_cursor}
+
+
 class Comment(Engagement):  # TODO: user-tag and reply based notification
     """
     Comments can not be deleted or edited but can be replied on (1 LEVEL).
     Deleting a comment removes the username from display
     users can be tagged using the '@' key-letter
+    up_votes, down_votes -> maintained by VoteComment.objects, never set directly
+    Discussions are read page wise with Comment.objects.get_thread_page
     """
 
     write_up = models.ForeignKey('write_up.WriteUpCollection', on_delete=models.CASCADE)
     comment_text = models.TextField(blank=False, null=False)
     reply_to = models.ForeignKey("self", null=True)
     delete_request = models.BooleanField(default=False)
+    up_votes = models.PositiveIntegerField(default=0)
+    down_votes = models.PositiveIntegerField(default=0)
+
+    objects = CommentManager()
+
+    def save(self, *args, **kwargs):
+        created = self.pk is None
+        super(Comment, self).save(*args, **kwargs)
+        if created:
+            add_trending({self.write_up_id: get_weight('comment')})
+
+    class Meta:
+        index_together = [('write_up', 'reply_to', 'timestamp', 'id'),  # top level keyset (reply_to IS NULL)
+                          ('reply_to', 'timestamp', 'id')]
 
 
 class VoteComment(Engagement):
@@ -59,6 +258,8 @@ class VoteComment(Engagement):
     vote_type = models.BooleanField(default=True)
     comment = models.ForeignKey(Comment, on_delete=models.CASCADE)
 
+    objects = VoteManager('comment')
+
     class Meta:
         unique_together = ("content_type", "object_id", "comment")
 
@@ -82,3 +283,4 @@ class Subscriber(Engagement):
 
     class Meta:
         unique_together = ("content_type", "object_id", "content_type_2", "object_id_2",)
+        index_together = [("content_type_2", "object_id_2", "id")]  # streaming subscribers of an object
@@ -1 +1,77 @@
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+
+from engagement.models import VoteWriteUp, Comment, VoteComment, Subscriber
+from publication.models import Publication, ContributorList
+from write_up.models import WriteUpCollection
+
+
+class ActorResolutionTest(TestCase):
+    """ Actors of a page of engagements are fetched with one query per actor type, whatever the page size """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create(username='reader-%d' % i) for i in range(6)]
+        owner = User.objects.create(username='owner')
+        publication = Publication.objects.create(creator=owner, name='publication')
+        cls.contributors = [ContributorList.objects.create(contributor=user, publication=publication, level='E')
+                            for user in cls.users[:3]]
+        cls.write_ups = [WriteUpCollection.objects.create(user=user, title='write up %d' % i, collection_type='I',
+                                                          description='') for i, user in enumerate(cls.users)]
+        cls.comment = Comment.objects.create(actor=cls.users[0], write_up=cls.write_ups[0], comment_text='first')
+        cls.user_type = ContentType.objects.get_for_model(User)
+        cls.contributor_type = ContentType.objects.get_for_model(ContributorList)
+
+    def actors(self):
+        return [(self.user_type, user) for user in self.users] + \
+               [(self.contributor_type, contributor) for contributor in self.contributors]
+
+    def assertActorQueries(self, model, queries):
+        """ engagement query + users query + contributor lists query (publication is joined) """
+
+        for engagement in model.objects.with_actors():
+            self.assertIsNotNone(engagement.actor)
+
+        with self.assertNumQueries(queries):
+            for engagement in model.objects.with_actors():
+                actor = engagement.actor
+                if isinstance(actor, ContributorList):
+                    actor.publication.name
+                    actor.contributor.username
+
+    def test_vote_write_up(self):
+        for i, (actor_type, actor) in enumerate(self.actors()):
+            VoteWriteUp.objects.create(content_type=actor_type, object_id=actor.pk,
+                                       write_up=self.write_ups[i % len(self.write_ups)])
+        self.assertActorQueries(VoteWriteUp, 3)
+
+    def test_comment(self):
+        for actor_type, actor in self.actors():
+            Comment.objects.create(content_type=actor_type, object_id=actor.pk, write_up=self.write_ups[0],
+                                   comment_text='comment')
+        self.assertActorQueries(Comment, 3)
+
+    def test_vote_comment(self):
+        for actor_type, actor in self.actors():
+            VoteComment.objects.create(content_type=actor_type, object_id=actor.pk, comment=self.comment)
+        self.assertActorQueries(VoteComment, 3)
+
+    def test_subscriber(self):
+        for actor_type, actor in self.actors():
+            Subscriber.objects.create(content_type=actor_type, object_id=actor.pk,
+                                      content_type_2=self.user_type, object_id_2=self.users[-1].pk)
+        self.assertActorQueries(Subscriber, 3)
+
+    def test_query_count_does_not_grow(self):
+        """ N and 10N comments of the same actor types cost the same queries """
+
+        actors = self.actors()
+        for n in (len(actors), 10 * len(actors)):
+            Comment.objects.filter(write_up=self.write_ups[1]).delete()
+            Comment.objects.bulk_create([Comment(content_type=actor_type, object_id=actor.pk,
+                                                 write_up=self.write_ups[1], comment_text='comment')
+                                         for actor_type, actor in (actors * 10)[:n]])
+            with self.assertNumQueries(3):
+                comments = [c.actor for c in Comment.objects.with_actors().filter(write_up=self.write_ups[1])]
+            self.assertEqual(len(comments), n)
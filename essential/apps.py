@@ -5,3 +5,9 @@ from django.apps import AppConfig
 
 class EssentialConfig(AppConfig):
     name = 'essential'
+
+    def ready(self):
+        from essential.signals import create_revision_history
+        from write_up.models import BaseDesign
+        from write_up.signals import revision_saved
+        revision_saved.connect(create_revision_history, sender=BaseDesign)
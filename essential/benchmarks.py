@@ -0,0 +1,125 @@
+"""
+Benchmark suite of the hot ORM paths, run with the 'run_benchmarks' command on data from
+'generate_data'. Every case is timed and its queries are counted per call, writes are rolled back.
+
+A case is a function (rng, targets) -> None, targets holds sampled ids of synthetic rows.
+"""
+
+import json
+import os
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from engagement.models import Comment, VoteWriteUp
+from essential.models import Notification, TimelineEntry
+from essential.synthetic import WORDS
+from log.models import ViewRollup
+from write_up.models import WriteUpCollection
+
+
+def notification_feed(rng, targets):
+    Notification.objects.get_feed(User(pk=rng.choice(targets['users'])))
+
+
+def notification_unread_count(rng, targets):
+    Notification.objects.get_unread_count(User(pk=rng.choice(targets['users'])))
+
+
+def comment_thread(rng, targets):
+    Comment.objects.get_thread_page(WriteUpCollection(pk=rng.choice(targets['write_ups'])))
+
+
+def comment_actors(rng, targets):
+    for comment in Comment.objects.with_actors().filter(write_up_id=rng.choice(targets['write_ups']))[:50]:
+        comment.actor
+
+
+def vote_cast(rng, targets):
+    write_up = WriteUpCollection(pk=rng.choice(targets['write_ups']))
+    user = User(pk=rng.choice(targets['users']))
+    VoteWriteUp.objects.cast_vote(user, write_up, rng.random() < 0.8)
+
+
+def vote_remove(rng, targets):
+    write_up = WriteUpCollection(pk=rng.choice(targets['write_ups']))
+    VoteWriteUp.objects.remove_vote(User(pk=rng.choice(targets['users'])), write_up)
+
+
+def home_timeline(rng, targets):
+    TimelineEntry.objects.get_timeline(User(pk=rng.choice(targets['users'])))
+
+
+def search(rng, targets):
+    WriteUpCollection.objects.search('%s %s' % (rng.choice(WORDS), rng.choice(WORDS)[:3]))
+
+
+def trending(rng, targets):
+    list(WriteUpCollection.objects.trending(rng.choice((None, 'I', 'B', 'M')))[:20])
+
+
+def view_totals(rng, targets):
+    end = timezone.now()
+    ViewRollup.objects.totals(WriteUpCollection(pk=rng.choice(targets['write_ups'])), end - timedelta(days=30), end)
+
+
+CASES = (
+    notification_feed,
+    notification_unread_count,
+    comment_thread,
+    comment_actors,
+    vote_cast,
+    vote_remove,
+    home_timeline,
+    search,
+    trending,
+    view_totals,
+)
+
+
+def get_targets(rng, sample=1000):
+    users = list(User.objects.filter(username__startswith='synthetic-').values_list('id', flat=True))
+    write_ups = list(WriteUpCollection.objects.values_list('id', flat=True))
+    return {'users': rng.sample(users, min(sample, len(users))),
+            'write_ups': rng.sample(write_ups, min(sample, len(write_ups)))}
+
+
+def percentile(values, fraction):
+    return values[int(fraction * (len(values) - 1))]
+
+
+def run_case(case, rng, targets, iterations):
+    times, queries = [], []
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.time()
+            case(rng, targets)
+            times.append((time.time() - start) * 1000)
+        queries.append(len(captured.captured_queries))
+    times.sort()
+    return {'iterations': iterations, 'p50_ms': percentile(times, 0.5), 'p95_ms': percentile(times, 0.95),
+            'max_ms': times[-1], 'mean_queries': float(sum(queries)) / len(queries), 'max_queries': max(queries)}
+
+
+def save_results(results, directory):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, 'benchmark-%s.json' % timezone.now().strftime('%Y%m%d-%H%M%S'))
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    return path
+
+
+def load_latest(directory):
+    """ the most recent saved results, None if there are none """
+
+    names = sorted(name for name in os.listdir(directory) if name.startswith('benchmark-')) \
+        if os.path.isdir(directory) else []
+    if not names:
+        return None
+    with open(os.path.join(directory, names[-1])) as f:
+        return json.load(f)
@@ -0,0 +1,143 @@
+"""
+Fan-out of work to every subscriber of a user or publication.
+
+Requests only enqueue a FanOutJob (in their own transaction, so a rolled back request never
+notifies anyone), the 'run_fan_out_worker' command streams the subscribers in chunks and
+writes the rows with bulk inserts.
+"""
+
+import logging
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction, connection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from engagement.models import Subscriber
+from essential.models import FanOutJob, Notification, TimelineEntry, HighFollowerAccount
+from essential.utils import atomic_with_retry
+from publication.models import Publication, ContributorList
+
+logger = logging.getLogger(__name__)
+
+
+def fan_out_notification(subscribed, data):
+    """ subscribed -> User or Publication whose subscribers get a Notification with 'data' """
+
+    return FanOutJob.objects.create(content_type=ContentType.objects.get_for_model(subscribed),
+                                    object_id=subscribed.pk, kind='N', data=data)
+
+
+def fan_out_write_up(write_up):
+    """
+    Adds a new write up to the timelines of the subscribers of its user and publication.
+    Authors with TIMELINE_FAN_OUT_LIMIT or more subscribers are skipped (fan-out on read).
+    """
+
+    limit = getattr(settings, 'TIMELINE_FAN_OUT_LIMIT', 10000)
+    data = {'write_up': write_up.pk, 'timestamp': write_up.create_time.isoformat()}
+    for model, object_id in ((User, write_up.user_id), (Publication, write_up.publication_id)):
+        if object_id is None:
+            continue
+        content_type = ContentType.objects.get_for_model(model)
+        followers = Subscriber.objects.filter(content_type_2=content_type, object_id_2=object_id)[:limit].count()
+        if followers >= limit:
+            HighFollowerAccount.objects.update_or_create(content_type=content_type, object_id=object_id,
+                                                         defaults={'follower_count': followers})
+        elif followers:
+            FanOutJob.objects.create(content_type=content_type, object_id=object_id, kind='T', data=data)
+
+
+def get_subscriber_chunk(content_type_id, object_id, after, chunk_size):
+    """
+    Returns (last subscriber id, user ids) for the next chunk of subscribers after 'after',
+    user ids are empty when all subscribers are done.
+
+    A subscriber is either a user or a publication (via its contributor list entry), the
+    latter resolves to the contributor. Users reachable twice in a chunk are returned once.
+    """
+
+    rows = list(Subscriber.objects.filter(content_type_2_id=content_type_id, object_id_2=object_id, id__gt=after)
+                .order_by('id').values_list('id', 'content_type_id', 'object_id')[:chunk_size])
+    if not rows:
+        return after, []
+
+    user_type = ContentType.objects.get_for_model(User).pk
+    user_ids = set(object_id for _, actor_type, object_id in rows if actor_type == user_type)
+    contributors = [object_id for _, actor_type, object_id in rows if actor_type != user_type]
+    if contributors:
+        user_ids.update(ContributorList.objects.filter(id__in=contributors).values_list('contributor_id', flat=True))
+    return rows[-1][0], sorted(user_ids)
+
+
+def write_notifications(job, user_ids):
+    Notification.objects.bulk_create([Notification(user_id=user_id, data=job.data) for user_id in user_ids],
+                                     batch_size=getattr(settings, 'FAN_OUT_INSERT_BATCH_SIZE', 1000))
+    transaction.on_commit(lambda: Notification.objects.reset_unread_count(user_ids))
+
+
+# entries past TIMELINE_MAX_ENTRIES of the given users, read backwards on the (user, timestamp, write_up) index
+TRIM_TIMELINES_SQL = """
+DELETE FROM {table} t USING (
+    SELECT e.id FROM unnest(%(users)s::integer[]) AS u (user_id)
+    CROSS JOIN LATERAL (
+        SELECT id FROM {table} WHERE user_id = u.user_id ORDER BY timestamp DESC, write_up_id DESC OFFSET %(cap)s
+    ) e
+) old WHERE t.id = old.id
+"""
+
+
+def write_timeline_entries(job, user_ids):
+    """ inserts the write up and trims the timelines of the chunk back to TIMELINE_MAX_ENTRIES """
+
+    if not user_ids:
+        return
+    table = TimelineEntry._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute("INSERT INTO {table} (user_id, write_up_id, timestamp) SELECT user_id, %s, %s "
+                       "FROM unnest(%s) AS u (user_id) ON CONFLICT (user_id, write_up_id) DO NOTHING"
+                       .format(table=table),
+                       [job.data['write_up'], parse_datetime(job.data['timestamp']), list(user_ids)])
+        cursor.execute(TRIM_TIMELINES_SQL.format(table=table),
+                       {'users': list(user_ids), 'cap': getattr(settings, 'TIMELINE_MAX_ENTRIES', 500)})
+
+
+WRITERS = {
+    'N': write_notifications,
+    'T': write_timeline_entries,
+}
+
+
+@atomic_with_retry()
+def process_chunk(job, chunk_size):
+    """
+    Writes one chunk, returns False once the job is complete.
+    Progress is moved with a conditional UPDATE, if another worker has moved it meanwhile
+    the chunk is rolled back and the job is left to that worker.
+    """
+
+    last, user_ids = get_subscriber_chunk(job.content_type_id, job.object_id, job.last_subscriber, chunk_size)
+    if not user_ids and last == job.last_subscriber:
+        FanOutJob.objects.filter(pk=job.pk).update(status='D', update_time=timezone.now())
+        return False
+
+    WRITERS[job.kind](job, user_ids)
+    if not FanOutJob.objects.filter(pk=job.pk, last_subscriber=job.last_subscriber).update(
+            last_subscriber=last, update_time=timezone.now()):
+        transaction.set_rollback(True)
+        return False
+    job.last_subscriber = last
+    return True
+
+
+def process_job(job, chunk_size=None):
+    chunk_size = chunk_size or getattr(settings, 'FAN_OUT_CHUNK_SIZE', 5000)
+    try:
+        while process_chunk(job, chunk_size):
+            pass
+    except Exception:
+        logger.exception("Fan-out job %s failed", job.pk)
+        FanOutJob.objects.filter(pk=job.pk).update(status='F', update_time=timezone.now())
+        raise
@@ -0,0 +1,41 @@
+import time
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from engagement.models import Subscriber
+from essential.fanout import fan_out_notification, process_job
+from essential.models import Notification
+
+
+class Command(BaseCommand):
+    help = 'Measures notification fan-out throughput on synthetic subscribers, all rows are rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=100000)
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        count = options['subscribers']
+        with transaction.atomic():
+            author = User.objects.create(username='fan-out-benchmark-author')
+            User.objects.bulk_create([User(username='fan-out-benchmark-%d' % i) for i in range(count)],
+                                     batch_size=5000)
+            user_type = ContentType.objects.get_for_model(User)
+            follower_ids = User.objects.filter(username__startswith='fan-out-benchmark-') \
+                .exclude(pk=author.pk).values_list('id', flat=True).iterator()
+            Subscriber.objects.bulk_create([Subscriber(content_type=user_type, object_id=user_id,
+                                                       content_type_2=user_type, object_id_2=author.pk)
+                                            for user_id in follower_ids], batch_size=5000)
+
+            job = fan_out_notification(author, {'type': 'benchmark', 'actor': author.username})
+            start = time.time()
+            process_job(job, options['chunk_size'])
+            elapsed = time.time() - start
+
+            written = Notification.objects.filter(user__username__startswith='fan-out-benchmark-').count()
+            transaction.set_rollback(True)
+
+        self.stdout.write("%d notifications in %.2fs (%.0f rows/s)" % (written, elapsed, written / elapsed))
@@ -0,0 +1,63 @@
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from engagement.models import Subscriber
+from essential.fanout import process_job
+from essential.models import FanOutJob, TimelineEntry, HighFollowerAccount
+from write_up.models import WriteUpCollection
+
+
+class Command(BaseCommand):
+    help = 'Measures home timeline read latency for growing follower counts on synthetic data, all rows are rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--followers', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+        parser.add_argument('--write-ups', type=int, default=30, help='Write ups posted by the author')
+        parser.add_argument('--samples', type=int, default=200, help='Timeline reads per follower count')
+
+    def handle(self, *args, **options):
+        self.stdout.write("TIMELINE_FAN_OUT_LIMIT = %s" % getattr(settings, 'TIMELINE_FAN_OUT_LIMIT', 10000))
+        for count in options['followers']:
+            with transaction.atomic():
+                self.run(count, options['write_ups'], options['samples'])
+                transaction.set_rollback(True)
+
+    def run(self, count, write_ups, samples):
+        prefix = 'timeline-benchmark-%d-' % count
+        author = User.objects.create(username=prefix + 'author')
+        User.objects.bulk_create([User(username='%s%d' % (prefix, i)) for i in range(count)], batch_size=5000)
+        follower_ids = list(User.objects.filter(username__startswith=prefix).exclude(pk=author.pk)
+                            .values_list('id', flat=True))
+        user_type = ContentType.objects.get_for_model(User)
+        Subscriber.objects.bulk_create([Subscriber(content_type=user_type, object_id=user_id,
+                                                   content_type_2=user_type, object_id_2=author.pk)
+                                        for user_id in follower_ids], batch_size=5000)
+
+        start = time.time()
+        for i in range(write_ups):
+            WriteUpCollection.objects.create(user=author, title='benchmark %d' % i, collection_type='I',
+                                             description='')
+        for job in FanOutJob.objects.filter(kind='T', content_type=user_type, object_id=author.pk):
+            process_job(job)
+        write_time = time.time() - start
+
+        mode = 'read' if HighFollowerAccount.objects.filter(content_type=user_type, object_id=author.pk).exists() \
+            else 'write'
+        latencies = []
+        for user_id in random.sample(follower_ids, min(samples, len(follower_ids))):
+            user = User(pk=user_id)
+            start = time.time()
+            page = TimelineEntry.objects.get_timeline(user)
+            latencies.append((time.time() - start) * 1000)
+            assert page['write_ups'], "empty timeline for follower %s" % user_id
+        latencies.sort()
+
+        self.stdout.write("%d followers (fan-out on %s): posting %.2fs, read p50 %.1fms, p95 %.1fms, p99 %.1fms" % (
+            count, mode, write_time, latencies[len(latencies) // 2], latencies[int(0.95 * (len(latencies) - 1))],
+            latencies[int(0.99 * (len(latencies) - 1))]))
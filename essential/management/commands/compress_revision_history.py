@@ -0,0 +1,78 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from essential.models import RevisionHistory
+from essential.revision import make_delta, apply_delta, delta_size
+
+
+class Command(BaseCommand):
+    help = 'Rewrites stored revisions as deltas with periodic snapshots and reports the space saved, ' \
+           'raises the revision counters of texts revised before they existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the space that would be saved')
+        parser.add_argument('--sample', type=int, default=200,
+                            help='Number of random revisions rebuilt to measure reconstruction latency')
+
+    def handle(self, *args, **options):
+        if not options['dry_run']:
+            backfilled = RevisionHistory.objects.backfill_last_revision_num()
+            self.stdout.write("Revision counters raised on %d texts" % backfilled)
+
+        interval = RevisionHistory.objects.snapshot_interval()
+        before = after = 0
+
+        parents = RevisionHistory.objects.order_by('parent_id').values_list('parent_id', flat=True).distinct()
+        for parent_id in parents.iterator():
+            with transaction.atomic():
+                revisions = RevisionHistory.objects.select_for_update().filter(parent_id=parent_id) \
+                    .order_by('revision_num').only('revision_num', 'text', 'delta')
+                previous_text, last_snapshot = None, None
+                for revision in revisions.iterator():
+                    if revision.is_snapshot:
+                        text = revision.text
+                    elif previous_text is not None:
+                        text = apply_delta(previous_text, revision.delta)
+                    else:
+                        text = RevisionHistory.objects.get_text(parent_id, revision.revision_num)
+                    before += len(text)
+
+                    delta = None
+                    if last_snapshot is not None and revision.revision_num - last_snapshot < interval:
+                        delta = make_delta(previous_text, text)
+                        if delta_size(delta) >= len(text):
+                            delta = None
+
+                    if delta is None:
+                        after += len(text)
+                        last_snapshot = revision.revision_num
+                        if not revision.is_snapshot and not options['dry_run']:
+                            RevisionHistory.objects.filter(pk=revision.pk).update(text=text, delta=None)
+                    else:
+                        after += delta_size(delta)
+                        if not options['dry_run']:
+                            RevisionHistory.objects.filter(pk=revision.pk).update(text=None, delta=delta)
+                    previous_text = text
+
+        saved = before - after
+        self.stdout.write("Revision text: %d chars before, %d after, %d saved (%.1f%%)" % (
+            before, after, saved, 100.0 * saved / before if before else 0))
+        self.report_latency(options['sample'])
+
+    def report_latency(self, sample):
+        count = RevisionHistory.objects.count()
+        if not count or not sample:
+            return
+        timings = []
+        for _ in range(min(sample, count)):
+            revision = RevisionHistory.objects.order_by('id').values('parent_id', 'revision_num')[
+                random.randrange(count)]
+            start = time.time()
+            RevisionHistory.objects.get_text(revision['parent_id'], revision['revision_num'])
+            timings.append((time.time() - start) * 1000)
+        timings.sort()
+        self.stdout.write("Reconstruction latency over %d revisions: avg %.2fms, p95 %.2fms, max %.2fms" % (
+            len(timings), sum(timings) / len(timings), timings[int(0.95 * (len(timings) - 1))], timings[-1]))
@@ -0,0 +1,29 @@
+import random
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from essential.synthetic import SyntheticData, DERIVED_COMMANDS
+
+
+class Command(BaseCommand):
+    help = 'Generates reproducible synthetic users, publications, write ups and engagement (Postgres only)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--scale', type=float, default=1.0, help='1.0 -> 1000 users and everything relative')
+        parser.add_argument('--skip-derived', action='store_true',
+                            help='Do not run %s afterwards' % ', '.join(DERIVED_COMMANDS))
+
+    def handle(self, *args, **options):
+        start = time.time()
+        with transaction.atomic():
+            SyntheticData(random.Random(options['seed']), options['scale'], self.stdout.write).generate()
+        self.stdout.write("Generated in %.1fs" % (time.time() - start))
+
+        if not options['skip_derived']:
+            for command in DERIVED_COMMANDS:
+                self.stdout.write("Running %s" % command)
+                call_command(command, stdout=self.stdout)
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from essential.partitions import (RETENTION_ACTIONS, convert_table, create_partitions, expire_partitions,
+                                  get_partitioned_models, get_retention, is_partitioned)
+
+
+class Command(BaseCommand):
+    help = 'Creates the monthly partitions of the coming months and applies the retention policies (Postgres 11+)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true',
+                            help='Convert tables which are not partitioned yet, locks each table while copying it')
+        parser.add_argument('--months-ahead', type=int, help='Default PARTITION_PREMAKE_MONTHS')
+        parser.add_argument('--action', choices=RETENTION_ACTIONS, help='Default PARTITION_RETENTION_ACTION')
+        parser.add_argument('--no-expire', action='store_true', help='Only create partitions')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Partitioning needs Postgres")
+
+        for model, column in get_partitioned_models():
+            label = model._meta.label
+            with connection.cursor() as cursor:
+                partitioned = is_partitioned(cursor, model._meta.db_table)
+            if not partitioned:
+                if not options['convert']:
+                    self.stdout.write("%s: not partitioned, run with --convert" % label)
+                    continue
+                months = convert_table(model, column, options['months_ahead'])
+                self.stdout.write("%s: converted, %d monthly partitions" % (label, months))
+
+            for name in create_partitions(model, options['months_ahead']):
+                self.stdout.write("%s: created %s" % (label, name))
+
+            retention = get_retention(model)
+            if retention is None or options['no_expire']:
+                continue
+            for name in expire_partitions(model, retention, options['action']):
+                self.stdout.write("%s: expired %s" % (label, name))
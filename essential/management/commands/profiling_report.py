@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from essential.profiling import LATENCY_BUCKETS
+
+ORDERS = {
+    'p95': lambda row: row['p95'],
+    'db': lambda row: row['db_ms'] / row['requests'],
+    'queries': lambda row: float(row['queries']) / row['requests'],
+    'total': lambda row: row['view_ms'],
+}
+
+
+def get_percentile(histogram, fraction):
+    """ upper bound of the bucket holding the percentile, None for the open bucket """
+
+    total = sum(histogram.values())
+    seen = 0
+    for bucket in LATENCY_BUCKETS + (0,):
+        seen += histogram.get(bucket, 0)
+        if seen >= fraction * total:
+            return bucket or None
+    return None
+
+
+class Command(BaseCommand):
+    help = 'Reports the slowest endpoints and repeated query (N+1) patterns recorded by QueryProfilingMiddleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24)
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--order', choices=sorted(ORDERS), default='p95')
+
+    def handle(self, *args, **options):
+        path = settings.PROFILING_DB_PATH
+        if not os.path.exists(path):
+            raise CommandError("No profile at %s yet" % path)
+        since = int(time.time() // 3600) - options['hours']
+        db = sqlite3.connect(path)
+        db.row_factory = sqlite3.Row
+
+        histograms = {}
+        for row in db.execute("SELECT name, bucket, sum(requests) AS requests FROM latency WHERE hour > ? "
+                              "GROUP BY name, bucket", (since,)):
+            histograms.setdefault(row['name'], {})[row['bucket']] = row['requests']
+        endpoints = []
+        for row in db.execute("SELECT name, sum(requests) AS requests, sum(queries) AS queries, "
+                              "max(max_queries) AS max_queries, sum(db_ms) AS db_ms, sum(view_ms) AS view_ms, "
+                              "sum(repeated) AS repeated FROM endpoint WHERE hour > ? GROUP BY name", (since,)):
+            endpoint = dict(row)
+            endpoint['p50'] = get_percentile(histograms.get(row['name'], {}), 0.5)
+            endpoint['p95'] = get_percentile(histograms.get(row['name'], {}), 0.95)
+            endpoints.append(endpoint)
+        endpoints.sort(key=lambda row: ORDERS[options['order']](row) or float('inf'), reverse=True)
+
+        self.stdout.write("%-50s %8s %8s %8s %9s %8s %9s" % (
+            'endpoint', 'requests', 'p50 ms', 'p95 ms', 'queries', 'max q', 'db ms'))
+        for row in endpoints[:options['limit']]:
+            self.stdout.write("%-50s %8d %8s %8s %9.1f %8d %9.1f" % (
+                row['name'][:50], row['requests'], row['p50'] or '>%d' % LATENCY_BUCKETS[-1],
+                row['p95'] or '>%d' % LATENCY_BUCKETS[-1], float(row['queries']) / row['requests'],
+                row['max_queries'], row['db_ms'] / row['requests']))
+
+        self.stdout.write("\nRepeated queries (N+1 candidates)")
+        for row in db.execute("SELECT name, sql, sum(requests) AS requests, sum(queries) AS queries FROM pattern "
+                              "WHERE hour > ? GROUP BY name, sql ORDER BY sum(queries) DESC LIMIT ?",
+                              (since, options['limit'])):
+            self.stdout.write("%s: %d requests, %.1f executions per request\n    %s" % (
+                row['name'], row['requests'], float(row['queries']) / row['requests'], row['sql'][:300]))
+        db.close()
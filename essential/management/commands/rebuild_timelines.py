@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from engagement.models import Subscriber
+from essential.models import TimelineEntry, HighFollowerAccount
+from publication.models import Publication, ContributorList
+from write_up.models import WriteUpCollection
+
+HIGH_FOLLOWER_SQL = """
+INSERT INTO {high} (content_type_id, object_id, follower_count, update_time)
+SELECT content_type_2_id, object_id_2, count(*), now() FROM {subscriber}
+GROUP BY content_type_2_id, object_id_2 HAVING count(*) >= %(limit)s
+"""
+
+# subscriptions of the users in [low, high), directly or through a publication they contribute to
+FOLLOWS_SQL = """
+follows AS (
+    SELECT s.object_id AS user_id, s.content_type_2_id AS target_type, s.object_id_2 AS target_id
+    FROM {subscriber} s
+    WHERE s.content_type_id = %(user_type)s AND s.object_id >= %(low)s AND s.object_id < %(high)s
+    UNION
+    SELECT c.contributor_id, s.content_type_2_id, s.object_id_2
+    FROM {contributor} c JOIN {subscriber} s ON s.content_type_id = %(contributor_type)s AND s.object_id = c.id
+    WHERE c.contributor_id >= %(low)s AND c.contributor_id < %(high)s
+)
+"""
+
+REBUILD_SQL = """
+WITH """ + FOLLOWS_SQL + """,
+pushed AS (
+    SELECT f.* FROM follows f LEFT JOIN {high} h ON h.content_type_id = f.target_type AND h.object_id = f.target_id
+    WHERE h.id IS NULL
+),
+candidates AS (
+    SELECT p.user_id, w.id AS write_up_id, w.create_time
+    FROM pushed p JOIN {write_up} w ON p.target_type = %(user_type)s AND w.user_id = p.target_id
+    UNION
+    SELECT p.user_id, w.id, w.create_time
+    FROM pushed p JOIN {write_up} w ON p.target_type = %(publication_type)s AND w.publication_id = p.target_id
+)
+INSERT INTO {timeline} (user_id, write_up_id, timestamp)
+SELECT user_id, write_up_id, create_time FROM (
+    SELECT *, row_number() OVER (PARTITION BY user_id ORDER BY create_time DESC, write_up_id DESC) AS rank
+    FROM candidates
+) ranked WHERE rank <= %(cap)s
+"""
+
+TRIM_SQL = """
+DELETE FROM {timeline} t USING (
+    SELECT id, row_number() OVER (PARTITION BY user_id ORDER BY timestamp DESC, write_up_id DESC) AS rank
+    FROM {timeline} WHERE user_id >= %(low)s AND user_id < %(high)s
+) r WHERE t.id = r.id AND r.rank > %(cap)s
+"""
+
+
+class Command(BaseCommand):
+    help = 'Recomputes high follower accounts and rebuilds (or only trims) the materialized home timelines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trim-only', action='store_true',
+                            help='Only cut timelines down to TIMELINE_MAX_ENTRIES')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Users per transaction')
+
+    def handle(self, *args, **options):
+        tables = {
+            'high': HighFollowerAccount._meta.db_table,
+            'subscriber': Subscriber._meta.db_table,
+            'contributor': ContributorList._meta.db_table,
+            'write_up': WriteUpCollection._meta.db_table,
+            'timeline': TimelineEntry._meta.db_table,
+        }
+        params = {
+            'limit': getattr(settings, 'TIMELINE_FAN_OUT_LIMIT', 10000),
+            'cap': getattr(settings, 'TIMELINE_MAX_ENTRIES', 500),
+            'user_type': ContentType.objects.get_for_model(User).pk,
+            'contributor_type': ContentType.objects.get_for_model(ContributorList).pk,
+            'publication_type': ContentType.objects.get_for_model(Publication).pk,
+        }
+
+        if not options['trim_only']:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute("DELETE FROM %s" % tables['high'])
+                cursor.execute(HIGH_FOLLOWER_SQL.format(**tables), params)
+            self.stdout.write("%d high follower accounts" % HighFollowerAccount.objects.count())
+
+        last = User.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        low = 0
+        while low <= last:
+            params.update(low=low, high=low + options['batch_size'])
+            with transaction.atomic(), connection.cursor() as cursor:
+                if options['trim_only']:
+                    cursor.execute(TRIM_SQL.format(**tables), params)
+                else:
+                    cursor.execute("DELETE FROM {timeline} WHERE user_id >= %(low)s AND user_id < %(high)s"
+                                   .format(**tables), params)
+                    cursor.execute(REBUILD_SQL.format(**tables), params)
+            low += options['batch_size']
+        self.stdout.write("Timelines %s up to user %d" % ('trimmed' if options['trim_only'] else 'rebuilt', last))
@@ -0,0 +1,52 @@
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from essential.benchmarks import CASES, get_targets, run_case, save_results, load_latest
+
+
+class Command(BaseCommand):
+    help = 'Times the hot ORM paths and counts their queries on generated data, results are saved for comparison'
+
+    def add_arguments(self, parser):
+        parser.add_argument('cases', nargs='*', help='Case names, all by default')
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default=getattr(settings, 'BENCHMARK_RESULTS_DIR', 'benchmark_results'))
+        parser.add_argument('--no-save', action='store_true')
+
+    def handle(self, *args, **options):
+        cases = [case for case in CASES if not options['cases'] or case.__name__ in options['cases']]
+        if not cases:
+            raise CommandError("Unknown cases, choose from: %s" % ', '.join(case.__name__ for case in CASES))
+
+        rng = random.Random(options['seed'])
+        targets = get_targets(rng)
+        if not targets['users'] or not targets['write_ups']:
+            raise CommandError("No synthetic data, run 'generate_data' first")
+
+        previous = load_latest(options['output'])
+        results = {'seed': options['seed'], 'cases': {}}
+        with transaction.atomic():
+            for case in cases:
+                cache.clear()
+                results['cases'][case.__name__] = stats = run_case(case, rng, targets, options['iterations'])
+                self.stdout.write(self.format(case.__name__, stats, (previous or {}).get('cases', {}).get(
+                    case.__name__)))
+            transaction.set_rollback(True)
+
+        if not options['no_save']:
+            self.stdout.write("Saved to %s" % save_results(results, options['output']))
+
+    @staticmethod
+    def format(name, stats, previous):
+        line = "%-28s p50 %7.2fms  p95 %7.2fms  max %7.2fms  queries %5.1f (max %d)" % (
+            name, stats['p50_ms'], stats['p95_ms'], stats['max_ms'], stats['mean_queries'], stats['max_queries'])
+        if previous:
+            line += "  | p50 %+.0f%%, queries %+.1f" % (
+                (stats['p50_ms'] / previous['p50_ms'] - 1) * 100 if previous['p50_ms'] else 0,
+                stats['mean_queries'] - previous['mean_queries'])
+        return line
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from essential.fanout import process_job
+from essential.models import FanOutJob
+
+
+class Command(BaseCommand):
+    help = 'Processes queued fan-out jobs (notifications to every subscriber of a user/publication)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait on an empty queue')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Subscribers written per transaction')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            job = FanOutJob.objects.claim()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['sleep'])
+                continue
+            try:
+                process_job(job, options['chunk_size'])
+            except Exception:
+                continue  # logged and marked as failed, keep serving the queue
+            self.stdout.write("Fan-out job %s done" % job.pk)
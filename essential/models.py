@@ -1,34 +1,171 @@
 from __future__ import unicode_literals
+import json
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.fields import ArrayField
 from django.contrib.postgres.fields.jsonb import JSONField
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction, connection
+from django.db.models import F
+from django.utils import timezone
+
+from engagement.models import Subscriber
+from essential.revision import make_delta, apply_delta, delta_size
+from essential.utils import atomic_with_retry, encode_cursor, decode_cursor
+from publication.models import Publication, ContributorList
 
 
 class NotificationManager(models.Manager):
     """
     Manager for Notification model
 
-    get_notification ->  returns in format
+    get_feed -> returns one page of the notification feed, newest first, in format
+    {'notifications': [{'id': .., 'data': {...}, 'notified': .., 'timestamp': ..}, ...],
+    'next': '<cursor of the next page>' or None}
+    Pages are fetched by keyset on (timestamp, id) and use the (user, timestamp) index,
+    so every page costs a single bounded query irrespective of its depth. The (timestamp, id) of a
+    row never changes: a merged notification is replaced by a new row, so it shows up again at the
+    top of the feed like a new notification and never twice in the pages of one cursor.
+
+    get_notification ->  returns first page of the feed in format
     {'notification-new': [{...}, {...}, {...}, ...],
     'notification-old': [{...}, {...}, {...}, ...]}
 
     get_all_notification -> returns all the notifications in format
     [{...}, {...}, {...}, ...]
     which are ordered by timestamp (descending)
+
+    get_unread_count -> unread notifications of a user, served from cache
+    mark_all_notified -> marks every unread notification of the user as notified in one UPDATE
+    notify -> notifies a user, notifications of the same 'type' on the same target within
+    NOTIFICATION_COALESCE_WINDOW seconds are merged into one row (see coalesce)
     """
 
+    UNREAD_CACHE_KEY = 'notification-unread-%s'
+
     def get_queryset(self):
         return super(NotificationManager, self).get_queryset()
 
-    def get_notification(self, user):  # TODO: can this be optimized?
-        """ only 5 'latest' 'already notified' notifications are fetched from db """
-        notified = self.get_queryset().filter(user=user, notified=True)[:5].values_list('data', flat=True)
-        not_notified = self.get_queryset().filter(user=user, notified=False).values_list('data', flat=True)
-        return {'notification-new': not_notified, 'notification-old': notified}
+    def get_feed(self, user, cursor=None, limit=None):
+        limit = limit or getattr(settings, 'NOTIFICATION_FEED_PAGE_SIZE', 20)
+        queryset = self.get_queryset().filter(user=user)
+        if cursor:
+            timestamp, pk = decode_cursor(cursor)
+            queryset = queryset.filter(models.Q(timestamp__lt=timestamp) | models.Q(timestamp=timestamp, id__lt=pk))
+        rows = list(queryset.order_by('-timestamp', '-id').values('id', 'data', 'notified', 'timestamp')[:limit + 1])
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['timestamp'], rows[-1]['id'])
+        return {'notifications': rows, 'next': next_cursor}
+
+    def get_notification(self, user):
+        """ single query, unread and 'already notified' notifications are split from the first feed page """
+
+        feed = self.get_feed(user)['notifications']
+        return {'notification-new': [row['data'] for row in feed if not row['notified']],
+                'notification-old': [row['data'] for row in feed if row['notified']]}
 
     def get_all_notification(self, user):
         return self.get_queryset().filter(user=user).values_list('data', flat=True)
 
+    def get_unread_count(self, user):
+        key = self.UNREAD_CACHE_KEY % user.pk
+        count = cache.get(key)
+        if count is None:
+            count = self.get_queryset().filter(user=user, notified=False).count()
+            cache.set(key, count, getattr(settings, 'NOTIFICATION_UNREAD_CACHE_TIMEOUT', 3600))
+        return count
+
+    def incr_unread_count(self, user_id, delta=1):
+        """ A missing key is left missing, it is recounted on next read """
+
+        try:
+            cache.incr(self.UNREAD_CACHE_KEY % user_id, delta)
+        except ValueError:
+            pass
+
+    def reset_unread_count(self, user_ids):
+        """ Drops cached counters, used when notifications are written without save() """
+
+        cache.delete_many([self.UNREAD_CACHE_KEY % user_id for user_id in user_ids])
+
+    def mark_all_notified(self, user):
+        updated = self.get_queryset().filter(user=user, notified=False).update(notified=True)
+        transaction.on_commit(lambda: cache.set(self.UNREAD_CACHE_KEY % user.pk, 0,
+                                                getattr(settings, 'NOTIFICATION_UNREAD_CACHE_TIMEOUT', 3600)))
+        return updated
+
+    def notify(self, user_id, data, target=None):
+        """
+        target -> what was acted on, e.g. 'write_up-<id>', notifications without a target are never merged.
+        Inside a transaction the notification is written once it commits, so a rolled back
+        like or comment notifies nobody, and None is returned.
+        """
+
+        if target is None:
+            return self.create(user_id=user_id, data=data)
+        group_key = '%s:%s' % (data.get('type'), target)
+        if connection.in_atomic_block:
+            transaction.on_commit(lambda: self.coalesce(user_id, group_key, data))
+            return None
+        return self.coalesce(user_id, group_key, data)
+
+    def coalesce(self, user_id, group_key, data):
+        """
+        Replaces the latest notification of the group within the window by one with 'data' merged in,
+        or creates one.
+        Writers of one group are serialized by a session advisory lock taken before the transaction
+        starts, so its snapshot always sees the row written by the previous writer.
+        """
+
+        lock = 'notification:%s:%s' % (user_id, group_key)
+        locked = connection.vendor == 'postgresql'
+        if locked:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_lock(hashtext(%s))", [lock])
+        try:
+            return self.merge(user_id, group_key, data)
+        finally:
+            if locked:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", [lock])
+
+    def get_actor_key(self, actor):
+        return zlib.crc32(json.dumps(actor, sort_keys=True).encode('utf-8')) & 0xffffffff
+
+    @atomic_with_retry()
+    def merge(self, user_id, group_key, data):
+        since = timezone.now() - timedelta(seconds=getattr(settings, 'NOTIFICATION_COALESCE_WINDOW', 24 * 60 * 60))
+        notification = self.get_queryset().select_for_update().filter(
+            user_id=user_id, group_key=group_key, timestamp__gte=since).order_by('-timestamp').first()
+        actor = dict((key, data[key]) for key in ('actor', 'actor-image') if key in data)
+        actor_key = self.get_actor_key(actor)
+        if notification is None:
+            return self.create(user_id=user_id, group_key=group_key, actor_keys=[actor_key],
+                               data=dict(data, **{'actors': [actor], 'actor-count': 1}))
+
+        if actor_key in notification.actor_keys:  # same actor again (e.g. unlike and like), nothing new to tell
+            return notification
+        if len(notification.actor_keys) < getattr(settings, 'NOTIFICATION_MAX_TRACKED_ACTORS', 1000):
+            notification.actor_keys.append(actor_key)
+        actors = [actor] + [a for a in notification.data.get('actors', []) if a != actor]
+        actor_count = notification.actor_count + 1
+        self.get_queryset().filter(pk=notification.pk).delete()
+        merged = self.create(user_id=user_id, group_key=group_key, actor_count=actor_count,
+                             actor_keys=notification.actor_keys, data=dict(data, **{
+                                 'actors': actors[:getattr(settings, 'NOTIFICATION_SAMPLE_ACTORS', 3)],
+                                 'actor-count': actor_count}))
+        if not notification.notified:  # replaces an unread row, already counted
+            transaction.on_commit(lambda: self.incr_unread_count(user_id, -1))
+        return merged
+
 
 class Notification(models.Model):
     """
@@ -47,6 +184,13 @@ class Notification(models.Model):
     actor, actor-image -> can be publisher or user
     all other details belong to the object acted on.
 
+    Merged notifications (NotificationManager.notify) also have
+    'actors': [{'actor': .., 'actor-image': ..}, ...] -> latest NOTIFICATION_SAMPLE_ACTORS actors, newest first
+    'actor-count': <number of actors> -> "<actor> and <actor-count - 1> others"
+    group_key -> '<type>:<target>' of merged notifications, empty for others
+    actor_keys -> hashes of the actors counted in actor_count, an actor is only counted once. Up to
+    NOTIFICATION_MAX_TRACKED_ACTORS are kept, actors past them are counted on every action
+
     type -> predefined and synchronised between front end and backend -
     'comment-like'
     'comment-dislike'
@@ -66,37 +210,306 @@ class Notification(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     data = JSONField()
     notified = models.BooleanField(default=False)
+    group_key = models.CharField(max_length=255, blank=True)
+    actor_count = models.PositiveIntegerField(default=1)
+    actor_keys = ArrayField(models.BigIntegerField(), default=list)
     timestamp = models.DateTimeField(auto_now_add=True)
 
     objects = NotificationManager()
 
     class Meta:
         ordering = ['-timestamp']
+        index_together = [('user', 'timestamp'), ('user', 'group_key', 'timestamp')]
+
+    def save(self, *args, **kwargs):
+        created = self.pk is None
+        super(Notification, self).save(*args, **kwargs)
+        if created and not self.notified:
+            transaction.on_commit(lambda: Notification.objects.incr_unread_count(self.user_id))
+
+
+class FanOutJobManager(models.Manager):
+    """
+    Manager for FanOutJob model
+
+    claim -> marks the oldest pending job (or a running job whose worker stopped reporting
+    progress) as running and returns it, returns None if there is nothing to do.
+    Claiming is a conditional UPDATE, so concurrent workers never get the same job.
+    """
+
+    def claim(self):
+        stale = timezone.now() - timedelta(seconds=getattr(settings, 'FAN_OUT_STALE_SECONDS', 300))
+        claimable = models.Q(status='P') | models.Q(status='R', update_time__lt=stale)
+        for pk in self.get_queryset().filter(claimable).order_by('id').values_list('id', flat=True)[:10]:
+            if self.get_queryset().filter(claimable, pk=pk).update(status='R', update_time=timezone.now()):
+                return self.get_queryset().get(pk=pk)
+        return None
+
+
+class FanOutJob(models.Model):
+    """
+    Queue of work to be written for every subscriber of a user/publication (subscribed).
+    Jobs are processed by the 'run_fan_out_worker' command, subscribers are streamed in chunks
+    and 'last_subscriber' (id of engagement.Subscriber) stores the progress. A chunk and its
+    progress are committed together, so an interrupted job resumes without duplicates.
+
+    kind -> 'N': a Notification with 'data' is created for every subscriber
+            'T': the write up in 'data' is added to the TimelineEntry of every subscriber
+    """
+
+    LIMIT = models.Q(app_label='publication', model='publication') | models.Q(app_label='auth', model='user')
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, limit_choices_to=LIMIT)
+    object_id = models.PositiveIntegerField()
+    subscribed = GenericForeignKey('content_type', 'object_id')
+    KIND = (('N', 'Notification'),
+            ('T', 'Timeline'),
+            )
+    kind = models.CharField(max_length=1, choices=KIND)
+    data = JSONField(null=True, blank=True)
+    STATUS = (('P', 'Pending'),
+              ('R', 'Running'),
+              ('D', 'Done'),
+              ('F', 'Failed'),
+              )
+    status = models.CharField(max_length=1, choices=STATUS, default='P', db_index=True)
+    last_subscriber = models.PositiveIntegerField(default=0)
+    create_time = models.DateTimeField(auto_now_add=True)
+    update_time = models.DateTimeField(auto_now=True)
+
+    objects = FanOutJobManager()
+
+    def __unicode__(self):
+        return "'%s' for '%s'" % (self.get_kind_display(), self.subscribed)
+
+
+class TimelineManager(models.Manager):
+    """
+    Manager for TimelineEntry model
+
+    get_timeline -> one page of the home timeline of a user, newest first:
+    {'write_ups': [<WriteUpCollection>, ...], 'next': '<cursor>' or None}
+
+    Write ups of normal authors are read from the materialized entries (fan-out on write),
+    those of authors with at least TIMELINE_FAN_OUT_LIMIT subscribers (HighFollowerAccount) are
+    merged in at read time (fan-out on read). A page costs a fixed number of queries.
+    """
+
+    def get_subscriptions(self, user):
+        """ (content type id, object id) of everything the user follows, directly or via a publication """
+
+        contributor_ids = ContributorList.objects.filter(contributor=user).values_list('id', flat=True)
+        return Subscriber.objects.filter(
+            models.Q(content_type=ContentType.objects.get_for_model(User), object_id=user.pk) |
+            models.Q(content_type=ContentType.objects.get_for_model(ContributorList), object_id__in=contributor_ids)
+        ).values_list('content_type_2_id', 'object_id_2')
+
+    def get_timeline(self, user, cursor=None, limit=None):
+        from write_up.models import WriteUpCollection  # write_up.models imports this module
+
+        limit = limit or getattr(settings, 'TIMELINE_PAGE_SIZE', 20)
+        keyset = {}
+        if cursor:
+            keyset = dict(zip(('timestamp', 'id'), decode_cursor(cursor)))
+
+        entries = self.get_queryset().filter(user=user)
+        if keyset:
+            entries = entries.filter(models.Q(timestamp__lt=keyset['timestamp']) |
+                                     models.Q(timestamp=keyset['timestamp'], write_up_id__lt=keyset['id']))
+        candidates = dict((write_up_id, timestamp) for write_up_id, timestamp in entries.order_by(
+            '-timestamp', '-write_up_id').values_list('write_up_id', 'timestamp')[:limit + 1])
+
+        subscriptions = set(self.get_subscriptions(user))
+        pulled = [(content_type_id, object_id) for content_type_id, object_id in HighFollowerAccount.objects.filter(
+            content_type_id__in=set(c for c, _ in subscriptions)).values_list('content_type_id', 'object_id')
+            if (content_type_id, object_id) in subscriptions]
+        if pulled:
+            user_type = ContentType.objects.get_for_model(User).pk
+            publication_type = ContentType.objects.get_for_model(Publication).pk
+            authors = models.Q(user_id__in=[o for c, o in pulled if c == user_type]) | \
+                models.Q(publication_id__in=[o for c, o in pulled if c == publication_type])
+            recent = WriteUpCollection.objects.filter(authors)
+            if keyset:
+                recent = recent.filter(models.Q(create_time__lt=keyset['timestamp']) |
+                                       models.Q(create_time=keyset['timestamp'], id__lt=keyset['id']))
+            candidates.update(recent.order_by('-create_time', '-id').values_list('id', 'create_time')[:limit + 1])
+
+        page = sorted(candidates.items(), key=lambda item: (item[1], item[0]), reverse=True)
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor(page[-1][1], page[-1][0])
+        write_ups = WriteUpCollection.objects.select_related('user', 'publication').in_bulk([pk for pk, _ in page])
+        return {'write_ups': [write_ups[pk] for pk, _ in page if pk in write_ups], 'next': next_cursor}
+
+
+class TimelineEntry(models.Model):
+    """
+    Materialized home timeline, a write up of a followed user/publication per row.
+    Written by FanOutJob ('T'), which keeps every timeline it writes to at TIMELINE_MAX_ENTRIES,
+    'rebuild_timelines' recomputes them. Read through TimelineEntry.objects.get_timeline.
+    timestamp -> create_time of the write up
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    write_up = models.ForeignKey('write_up.WriteUpCollection', on_delete=models.CASCADE)
+    timestamp = models.DateTimeField()
+
+    objects = TimelineManager()
+
+    class Meta:
+        unique_together = ('user', 'write_up')
+        index_together = [('user', 'timestamp', 'write_up')]
+
+
+class HighFollowerAccount(models.Model):
+    """
+    Users/publications with at least TIMELINE_FAN_OUT_LIMIT subscribers, their write ups are not
+    fanned out to timelines but merged in when a timeline is read.
+    """
+
+    LIMIT = models.Q(app_label='publication', model='publication') | models.Q(app_label='auth', model='user')
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, limit_choices_to=LIMIT)
+    object_id = models.PositiveIntegerField()
+    account = GenericForeignKey('content_type', 'object_id')
+    follower_count = models.PositiveIntegerField(default=0)
+    update_time = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('content_type', 'object_id')
+
+
+BACKFILL_REVISION_NUM_SQL = """
+UPDATE {base_design} b SET last_revision_num = r.last
+FROM (SELECT parent_id, max(revision_num) AS last FROM {revision} GROUP BY parent_id) r
+WHERE b.id = r.parent_id AND b.last_revision_num < r.last
+"""
+
+
+class RevisionHistoryManager(models.Manager):
+    """
+    Manager for RevisionHistory model
+
+    Revisions are stored as deltas against the previous revision, with a full snapshot at
+    least every REVISION_SNAPSHOT_INTERVAL revisions. Any revision is therefore rebuilt from
+    one bounded query: the last REVISION_SNAPSHOT_INTERVAL rows up to it.
+
+    add_revision -> stores 'text' as the next revision of parent
+    get_text -> returns the text of a revision, raises RevisionHistory.DoesNotExist
+    backfill_last_revision_num -> raises the revision counter of every text to its last stored
+    revision, run once by 'compress_revision_history' for texts revised before the counter existed
+    """
+
+    @staticmethod
+    def snapshot_interval():
+        return max(getattr(settings, 'REVISION_SNAPSHOT_INTERVAL', 20), 1)
+
+    def get_chain(self, parent, revision_num):
+        """ rows needed to rebuild revision_num, ascending """
+
+        return list(self.get_queryset().filter(parent=parent, revision_num__lte=revision_num,
+                                               revision_num__gt=revision_num - self.snapshot_interval())
+                    .order_by('revision_num').only('revision_num', 'text', 'delta'))
+
+    @staticmethod
+    def rebuild(chain):
+        text = None
+        for revision in chain:
+            if revision.is_snapshot:
+                text = revision.text
+            elif text is not None:
+                text = apply_delta(text, revision.delta)
+        if text is None:
+            raise RevisionHistory.DoesNotExist("No snapshot found in revision chain")
+        return text
+
+    def get_text(self, parent, revision_num):
+        chain = self.get_chain(parent, revision_num)
+        if not chain or chain[-1].revision_num != revision_num:
+            raise RevisionHistory.DoesNotExist("Revision %s not found" % revision_num)
+        return self.rebuild(chain)
+
+    def allocate_revision_num(self, parent):
+        """ Increments the counter on the parent row, which stays locked until the transaction ends """
+
+        parent_model = self.model._meta.get_field('parent').related_model
+        parent_model.objects.filter(pk=parent.pk).update(last_revision_num=F('last_revision_num') + 1)
+        return parent_model.objects.filter(pk=parent.pk).values_list('last_revision_num', flat=True).get()
+
+    def backfill_last_revision_num(self):
+        """ returns the number of texts whose counter was raised """
+
+        base_design = self.model._meta.get_field('parent').related_model
+        with connection.cursor() as cursor:
+            cursor.execute(BACKFILL_REVISION_NUM_SQL.format(base_design=base_design._meta.db_table,
+                                                            revision=self.model._meta.db_table))
+            return cursor.rowcount
+
+    @atomic_with_retry()
+    def add_revision(self, parent, user, text, title=None):
+        revision = RevisionHistory(parent=parent, user=user, title=title,
+                                   revision_num=self.allocate_revision_num(parent))
+
+        last = revision.revision_num - 1
+        chain = self.get_chain(parent, last) if last else []
+        snapshots = [r.revision_num for r in chain if r.is_snapshot]
+        if snapshots and revision.revision_num - snapshots[-1] < self.snapshot_interval():
+            delta = make_delta(self.rebuild(chain), text)
+            if delta_size(delta) < len(text):
+                revision.delta = delta
+        if revision.delta is None:
+            revision.text = text
+        revision.save()
+        return revision
 
 
 class RevisionHistory(models.Model):
-    """ Stores textual revision history for BaseDesign model"""
+    """
+    Stores textual revision history for BaseDesign model
+    Snapshot revisions store the full 'text', all others store the 'delta' (see essential.revision)
+    against the previous revision. Use RevisionHistory.objects.get_text to read a revision.
+    """
 
     parent = models.ForeignKey('write_up.BaseDesign')
     user = models.ForeignKey(User)
     title = models.CharField(max_length=250, null=True, blank=True)
-    text = models.TextField()
-    revision_num = models.PositiveSmallIntegerField()
+    text = models.TextField(null=True, blank=True)
+    delta = JSONField(null=True, blank=True)
+    revision_num = models.PositiveIntegerField()
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    objects = RevisionHistoryManager()
+
+    class Meta:
+        unique_together = ('parent', 'revision_num')
+
     def __unicode__(self):
         return "'%s', revision: '%s'" % (self.parent, self.revision_num)
 
+    @property
+    def is_snapshot(self):
+        return self.delta is None
+
 
 class GroupWritingLockHistory(models.Model):
-    """ Stores request history made by a user to extend a Group writing Article """
+    """
+    Stores request history made by a user to extend a Group writing Article
+    One row per lock session (lease), heartbeats do not touch it.
+
+    token -> fencing token of the lease (GroupWriting.lock_token)
+    release_time -> null while the lease is held, void -> lease expired instead of being released
+    """
 
     article = models.ForeignKey('write_up.GroupWriting')
     lock_request_user = models.ForeignKey(User)
+    token = models.BigIntegerField(default=0)
     lock_start_time = models.DateTimeField()
     lock_last_request = models.DateTimeField()
+    release_time = models.DateTimeField(null=True, blank=True)
     void = models.BooleanField(default=False)
     create_time = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        index_together = [('article', 'token')]
+
     def __unicode__(self):
         return "'%s' for '%s'" % (self.lock_request_user, self.article)
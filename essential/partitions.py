@@ -0,0 +1,198 @@
+"""
+Monthly range partitions of the append heavy tables (Postgres 11 or later), maintained by the
+'manage_partitions' command.
+
+PARTITIONED lists the tables and their partition column. convert_table turns an existing table
+into a partitioned one in one transaction: a partition per month of its data, a DEFAULT partition
+for rows outside of them, primary key and unique constraints extended by the partition column
+(Postgres requires it, Django keeps using 'id'). create_partitions adds the partitions of the
+coming PARTITION_PREMAKE_MONTHS months ahead of time, so rows never land in the DEFAULT partition
+which would block the creation of their month. expire_partitions handles months older than
+PARTITION_RETENTION_MONTHS with PARTITION_RETENTION_ACTION:
+
+    detach -> the partition is detached and kept as a standalone table
+    archive -> the partition is detached, written to PARTITION_ARCHIVE_DIR as gzip CSV and dropped
+    drop -> the partition is dropped
+
+Queries filtering on the partition column (feeds by timestamp, heartbeats of recent views) only
+read the matching months.
+
+Vote tables are not partitioned: their unique (voter, target) constraints can not include a
+time column without allowing duplicate votes.
+"""
+
+import gzip
+import os
+import re
+from datetime import date
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+# model label, partition column
+PARTITIONED = (
+    ('log.AnonymousViewer', 'create_time'),
+    ('log.RegisteredViewer', 'create_time'),
+    ('essential.Notification', 'timestamp'),
+)
+
+RETENTION_ACTIONS = ('detach', 'archive', 'drop')
+
+
+def add_months(month, n):
+    months = month.year * 12 + month.month - 1 + n
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def get_partition_name(table, month):
+    return '%s_p%04d%02d' % (table, month.year, month.month)
+
+
+def get_partition_re(table):
+    return re.compile(r'^%s_p(\d{4})(\d{2})$' % re.escape(table))
+
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+    row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def get_partitions(cursor, table):
+    """ {first day of month: partition name} of the monthly partitions of a table """
+
+    cursor.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                   "WHERE i.inhparent = to_regclass(%s)", [table])
+    pattern = get_partition_re(table)
+    partitions = {}
+    for (name,) in cursor.fetchall():
+        match = pattern.match(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def create_partition(cursor, table, month):
+    qn = connection.ops.quote_name
+    cursor.execute("CREATE TABLE IF NOT EXISTS %s PARTITION OF %s FOR VALUES FROM (%%s) TO (%%s)" % (
+        qn(get_partition_name(table, month)), qn(table)), [month, add_months(month, 1)])
+
+
+def get_current_month():
+    today = timezone.localtime(timezone.now(), timezone.utc).date()
+    return date(today.year, today.month, 1)
+
+
+def create_partitions(model, months_ahead=None):
+    """ partitions from the current month up to 'months_ahead' months, returns the names of new ones """
+
+    months_ahead = getattr(settings, 'PARTITION_PREMAKE_MONTHS', 3) if months_ahead is None else months_ahead
+    table = model._meta.db_table
+    current = get_current_month()
+    created = []
+    with connection.cursor() as cursor:
+        existing = get_partitions(cursor, table)
+        for n in range(months_ahead + 1):
+            month = add_months(current, n)
+            if month not in existing:
+                create_partition(cursor, table, month)
+                created.append(get_partition_name(table, month))
+    return created
+
+
+@transaction.atomic
+def convert_table(model, column, months_ahead=None):
+    """ replaces a regular table by a partitioned one with the same rows, returns the number of partitions """
+
+    months_ahead = getattr(settings, 'PARTITION_PREMAKE_MONTHS', 3) if months_ahead is None else months_ahead
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    new = '%s_partitioned' % table
+    with connection.cursor() as cursor:
+        cursor.execute("LOCK TABLE %s IN ACCESS EXCLUSIVE MODE" % qn(table))
+        cursor.execute("CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE) "
+                       "PARTITION BY RANGE (%s)" % (qn(new), qn(table), qn(column)))
+        cursor.execute("SELECT min(%s), max(%s) FROM %s" % (qn(column), qn(column), qn(table)))
+        first, last = cursor.fetchone()
+        current = get_current_month()
+        first = date(first.year, first.month, 1) if first else current
+        last = max(add_months(current, months_ahead), date(last.year, last.month, 1) if last else current)
+
+        months = 0
+        month = first
+        while month <= last:
+            cursor.execute("CREATE TABLE %s PARTITION OF %s FOR VALUES FROM (%%s) TO (%%s)" % (
+                qn(get_partition_name(table, month)), qn(new)), [month, add_months(month, 1)])
+            month = add_months(month, 1)
+            months += 1
+        cursor.execute("CREATE TABLE %s PARTITION OF %s DEFAULT" % (qn('%s_default' % table), qn(new)))
+        cursor.execute("INSERT INTO %s SELECT * FROM %s" % (qn(new), qn(table)))
+
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        sequence = cursor.fetchone()[0]
+        cursor.execute("ALTER SEQUENCE %s OWNED BY NONE" % sequence)
+        cursor.execute("DROP TABLE %s" % qn(table))
+        cursor.execute("ALTER TABLE %s RENAME TO %s" % (qn(new), qn(table)))
+        cursor.execute("ALTER SEQUENCE %s OWNED BY %s.id" % (sequence, qn(table)))
+
+        cursor.execute("ALTER TABLE %s ADD PRIMARY KEY (id, %s)" % (qn(table), qn(column)))
+        unique = [[model._meta.get_field(name).column for name in fields] for fields in model._meta.unique_together]
+        unique += [[f.column] for f in model._meta.local_concrete_fields if f.unique and not f.primary_key]
+        for columns in unique:
+            cursor.execute("CREATE UNIQUE INDEX %s ON %s (%s)" % (
+                qn('%s_%s_uniq' % (table, '_'.join(columns))), qn(table),
+                ', '.join(qn(c) for c in columns + [column])))
+
+    with connection.schema_editor() as editor:
+        for sql in editor._model_indexes_sql(model):
+            editor.execute(sql)
+        for field in model._meta.local_fields:
+            if field.remote_field and field.db_constraint:
+                editor.execute(editor._create_fk_sql(model, field, "_fk_%(to_table)s_%(to_column)s"))
+    return months
+
+
+def archive_partition(cursor, name):
+    directory = settings.PARTITION_ARCHIVE_DIR
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with gzip.open(os.path.join(directory, '%s.csv.gz' % name), 'wb') as out:
+        cursor.copy_expert("COPY %s TO STDOUT WITH (FORMAT csv, HEADER)" % connection.ops.quote_name(name), out)
+
+
+def expire_partitions(model, retention_months, action=None):
+    """ applies the retention action to the partitions older than 'retention_months', returns their names """
+
+    action = action or getattr(settings, 'PARTITION_RETENTION_ACTION', 'detach')
+    if action not in RETENTION_ACTIONS:
+        raise ValueError("Unknown retention action '%s'" % action)
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    cutoff = add_months(get_current_month(), -retention_months)
+    expired = []
+    with connection.cursor() as cursor:
+        for month, name in sorted(get_partitions(cursor, table).items()):
+            if month >= cutoff:
+                break
+            with transaction.atomic():
+                if action == 'drop':
+                    cursor.execute("DROP TABLE %s" % qn(name))
+                else:
+                    cursor.execute("ALTER TABLE %s DETACH PARTITION %s" % (qn(table), qn(name)))
+                    if action == 'archive':
+                        archive_partition(cursor, name)
+                        cursor.execute("DROP TABLE %s" % qn(name))
+            expired.append(name)
+    return expired
+
+
+def get_partitioned_models():
+    return [(apps.get_model(label), column) for label, column in PARTITIONED]
+
+
+def get_retention(model):
+    """ months to keep, None to keep everything """
+
+    return getattr(settings, 'PARTITION_RETENTION_MONTHS', {}).get(model._meta.label)
@@ -0,0 +1,150 @@
+"""
+Sampled per-request query profiling, light enough to stay enabled in production.
+
+QueryProfilingMiddleware picks PROFILING_SAMPLE_RATE of the requests and only for those turns
+on query logging of the database connections. Per URL name it aggregates in memory the number
+of requests, queries, database and view time, a latency histogram and repeated queries (the
+same statement with different parameters, N+1 candidates). Every PROFILING_FLUSH_INTERVAL
+seconds the aggregates are added to a local sqlite file (PROFILING_DB_PATH), which can be shared
+by all worker processes of a host. Unsampled requests cost one random() call.
+
+The 'profiling_report' command reads the file.
+"""
+
+import logging
+import random
+import re
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (ms) of the latency histogram buckets, the last bucket is open
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS endpoint (name TEXT, hour INTEGER, requests INTEGER, queries INTEGER, "
+    "max_queries INTEGER, db_ms REAL, view_ms REAL, repeated INTEGER, PRIMARY KEY (name, hour))",
+    "CREATE TABLE IF NOT EXISTS latency (name TEXT, hour INTEGER, bucket INTEGER, requests INTEGER, "
+    "PRIMARY KEY (name, hour, bucket))",
+    "CREATE TABLE IF NOT EXISTS pattern (name TEXT, hour INTEGER, sql TEXT, requests INTEGER, queries INTEGER, "
+    "PRIMARY KEY (name, hour, sql))",
+)
+
+
+def normalize(sql):
+    """ statement without its parameters, 'IN (1, 2, 3)' and 'IN (4)' are the same pattern """
+
+    return IN_LIST_RE.sub('(...)', LITERAL_RE.sub('?', sql))
+
+
+def get_bucket(ms):
+    for bound in LATENCY_BUCKETS:
+        if ms <= bound:
+            return bound
+    return 0  # open bucket
+
+
+class Profile(object):
+    """ in memory aggregates of one process since the last flush """
+
+    def __init__(self):
+        self.endpoints = {}  # name -> [requests, queries, max_queries, db_ms, view_ms, repeated]
+        self.latency = {}  # (name, bucket) -> requests
+        self.patterns = {}  # (name, sql) -> [requests, queries]
+
+    def add(self, name, view_ms, queries):
+        db_ms = sum(float(query['time']) for query in queries) * 1000
+        counts = {}
+        for query in queries:
+            pattern = normalize(query['sql'])
+            counts[pattern] = counts.get(pattern, 0) + 1
+        threshold = getattr(settings, 'PROFILING_N_PLUS_ONE_THRESHOLD', 5)
+        repeated = dict((sql, count) for sql, count in counts.items() if count >= threshold)
+
+        stats = self.endpoints.setdefault(name, [0, 0, 0, 0.0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += len(queries)
+        stats[2] = max(stats[2], len(queries))
+        stats[3] += db_ms
+        stats[4] += view_ms
+        stats[5] += sum(repeated.values())
+        key = (name, get_bucket(view_ms))
+        self.latency[key] = self.latency.get(key, 0) + 1
+        for sql, count in repeated.items():
+            pattern = self.patterns.setdefault((name, sql), [0, 0])
+            pattern[0] += 1
+            pattern[1] += count
+
+    def write(self, path):
+        hour = int(time.time() // 3600)
+        db = sqlite3.connect(path, timeout=10)
+        try:
+            with db:
+                for statement in SCHEMA:
+                    db.execute(statement)
+                for name, (requests, queries, max_queries, db_ms, view_ms, repeated) in self.endpoints.items():
+                    db.execute("INSERT OR IGNORE INTO endpoint VALUES (?, ?, 0, 0, 0, 0, 0, 0)", (name, hour))
+                    db.execute("UPDATE endpoint SET requests = requests + ?, queries = queries + ?, "
+                               "max_queries = max(max_queries, ?), db_ms = db_ms + ?, view_ms = view_ms + ?, "
+                               "repeated = repeated + ? WHERE name = ? AND hour = ?",
+                               (requests, queries, max_queries, db_ms, view_ms, repeated, name, hour))
+                for (name, bucket), requests in self.latency.items():
+                    db.execute("INSERT OR IGNORE INTO latency VALUES (?, ?, ?, 0)", (name, hour, bucket))
+                    db.execute("UPDATE latency SET requests = requests + ? WHERE name = ? AND hour = ? AND bucket = ?",
+                               (requests, name, hour, bucket))
+                for (name, sql), (requests, queries) in self.patterns.items():
+                    db.execute("INSERT OR IGNORE INTO pattern VALUES (?, ?, ?, 0, 0)", (name, hour, sql))
+                    db.execute("UPDATE pattern SET requests = requests + ?, queries = queries + ? "
+                               "WHERE name = ? AND hour = ? AND sql = ?", (requests, queries, name, hour, sql))
+        finally:
+            db.close()
+
+
+class QueryProfilingMiddleware(object):
+    """ Should be the first middleware, so the whole request is measured """
+
+    profile = Profile()
+    lock = threading.Lock()
+    last_flush = time.time()
+
+    def process_request(self, request):
+        if random.random() >= getattr(settings, 'PROFILING_SAMPLE_RATE', 0.01):
+            return
+        request._profiling_start = time.time()
+        for connection in connections.all():
+            connection.queries_log.clear()
+            connection.force_debug_cursor = True
+
+    def process_response(self, request, response):
+        start = getattr(request, '_profiling_start', None)
+        if start is None:
+            return response
+        view_ms = (time.time() - start) * 1000
+        queries = []
+        for connection in connections.all():
+            queries.extend(connection.queries_log)
+            connection.force_debug_cursor = False
+            connection.queries_log.clear()
+
+        match = getattr(request, 'resolver_match', None)
+        name = '%s %s' % (request.method, (match.view_name if match else None) or 'unresolved')
+        cls = QueryProfilingMiddleware
+        with cls.lock:
+            cls.profile.add(name, view_ms, queries)
+            flush = time.time() - cls.last_flush >= getattr(settings, 'PROFILING_FLUSH_INTERVAL', 60)
+            if flush:
+                profile, cls.profile, cls.last_flush = cls.profile, Profile(), time.time()
+        if flush:
+            try:
+                profile.write(settings.PROFILING_DB_PATH)
+            except Exception:
+                logger.exception("Query profile not written")
+        return response
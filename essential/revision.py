@@ -0,0 +1,39 @@
+"""
+Line based deltas between two revisions of a text.
+
+A delta is a list of operations applied in order to build the new text:
+[start, end] -> copy old_text[start:end]
+'text'       -> insert text
+"""
+
+import json
+from difflib import SequenceMatcher
+
+
+def make_delta(old_text, new_text):
+    old_lines = old_text.splitlines(True)
+    new_lines = new_text.splitlines(True)
+
+    offsets = [0]
+    for line in old_lines:
+        offsets.append(offsets[-1] + len(line))
+
+    delta = []
+    matcher = SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            if delta and isinstance(delta[-1], list) and delta[-1][1] == offsets[i1]:
+                delta[-1][1] = offsets[i2]
+            else:
+                delta.append([offsets[i1], offsets[i2]])
+        elif tag in ('replace', 'insert'):
+            delta.append(''.join(new_lines[j1:j2]))
+    return delta
+
+
+def apply_delta(old_text, delta):
+    return ''.join(old_text[op[0]:op[1]] if isinstance(op, list) else op for op in delta)
+
+
+def delta_size(delta):
+    return len(json.dumps(delta))
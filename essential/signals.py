@@ -1,11 +1,18 @@
-from django.dispatch import receiver
 from django.db.models.signals import post_save
+from django.dispatch import receiver
 
+from essential.fanout import fan_out_write_up
 from essential.models import RevisionHistory
 
 
-@receiver(post_save, sender='write_up.BaseDesign')
 def create_revision_history(sender, **kwargs):
-    base_design = kwargs.get('instance')  # TODO: send user
-    user = kwargs.get('user')
-    RevisionHistory.objects.create(parent=base_design, user=user, text=base_design.text)
+    """ revision_saved receiver, connected in EssentialConfig.ready: a plain Signal can not resolve a lazy sender """
+
+    base_design = kwargs.get('instance')
+    RevisionHistory.objects.add_revision(base_design, kwargs.get('user'), kwargs.get('text'), kwargs.get('title'))
+
+
+@receiver(post_save, sender='write_up.WriteUpCollection')
+def add_to_timelines(sender, **kwargs):
+    if kwargs.get('created'):
+        fan_out_write_up(kwargs.get('instance'))
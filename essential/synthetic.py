@@ -0,0 +1,311 @@
+"""
+Synthetic data for benchmarks, see the 'generate_data' and 'run_benchmarks' commands.
+
+Rows are generated from a seeded random.Random, so a seed always produces the same data
+(ids aside), and are written with COPY in chunks. Primary keys are taken from the table
+sequences up front so rows can reference each other without reading them back. Popularity
+(votes, comments, views, subscribers) follows a Zipf like distribution over write ups and
+authors. No signals are sent, derived data is rebuilt by the commands listed in DERIVED_COMMANDS.
+"""
+
+import bisect
+import json
+import random
+import uuid
+from datetime import datetime, timedelta
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.utils import six
+from django.utils.timezone import utc
+
+from engagement.models import VoteWriteUp, Comment, VoteComment, Subscriber
+from essential.models import Notification, RevisionHistory
+from log.models import AnonymousViewer, RegisteredViewer
+from publication.models import Publication, ContributorList
+from write_up.models import WriteUpCollection, BaseDesign, Unit, get_text_hash
+
+# counts per unit of --scale
+BASE_COUNTS = {
+    'users': 1000,
+    'publications': 100,
+    'editors_per_publication': 2,
+    'write_ups_per_user': 2,
+    'write_ups_per_publication': 5,
+    'units_per_write_up': 3,
+    'revisions_per_text': 4,
+    'votes_per_write_up': 20,
+    'comments_per_write_up': 8,
+    'votes_per_comment': 2,
+    'subscriptions_per_user': 25,
+    'views_per_write_up': 60,
+    'notifications_per_user': 30,
+}
+
+# commands run after generation to fill counters, timelines, rollups and search vectors
+DERIVED_COMMANDS = ('rebuild_vote_counts', 'rebuild_timelines', 'rollup_views', 'backfill_search_vectors')
+
+START = datetime(2016, 1, 1, tzinfo=utc)
+
+WORDS = ('the a of and to in is was for on that with as by it from at his her story night city river light '
+         'music history letter winter summer road house garden memory dream war peace love time world sea '
+         'mountain voice silence fire paper window morning evening rain stone bird forest market train song '
+         'machine empire village border island harbor kitchen mother father child friend stranger teacher').split()
+
+COPY_ESCAPES = {'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'}
+
+CHUNK_SIZE = 10000
+
+
+def copy_value(field, obj):
+    value = getattr(obj, field.attname)
+    if value is None and (getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)):
+        value = field.pre_save(obj, True)
+    if value is None:
+        return r'\N'
+    if field.get_internal_type() == 'JSONField':
+        value = json.dumps(value)
+    else:
+        value = field.get_db_prep_save(value, connection)
+    if isinstance(value, bool):
+        value = 't' if value else 'f'
+    return ''.join(COPY_ESCAPES.get(c, c) for c in six.text_type(value))
+
+
+def copy_objects(model, objects):
+    """ COPY model instances in chunks, returns the number of rows. The primary key is copied if set """
+
+    count = 0
+    chunk = []
+    for obj in objects:
+        chunk.append(obj)
+        if len(chunk) >= CHUNK_SIZE:
+            count += _copy_chunk(model, chunk)
+            chunk = []
+    if chunk:
+        count += _copy_chunk(model, chunk)
+    return count
+
+
+def _copy_chunk(model, chunk):
+    fields = [f for f in model._meta.concrete_fields if not f.primary_key or chunk[0].pk is not None]
+    columns = ', '.join(connection.ops.quote_name(f.column) for f in fields)
+    stream = six.StringIO()
+    for obj in chunk:
+        stream.write('\t'.join(copy_value(f, obj) for f in fields))
+        stream.write('\n')
+    stream.seek(0)
+    with connection.cursor() as cursor:
+        cursor.copy_expert('COPY %s (%s) FROM STDIN' % (model._meta.db_table, columns), stream)
+    return len(chunk)
+
+
+def allocate_ids(model, count):
+    if not count:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                       [model._meta.db_table, count])
+        return [row[0] for row in cursor.fetchall()]
+
+
+class Popularity(object):
+    """ weighted choice over items, the item at rank r has weight 1 / r ** exponent """
+
+    def __init__(self, items, rng, exponent=1.1):
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.rng = rng
+        self.cumulative = []
+        total = 0.0
+        for rank in range(1, len(self.items) + 1):
+            total += 1.0 / rank ** exponent
+            self.cumulative.append(total)
+
+    def pick(self):
+        return self.items[bisect.bisect(self.cumulative, self.rng.random() * self.cumulative[-1])
+                          if self.cumulative else 0]
+
+    def share(self, index, total):
+        """ part of 'total' falling on the item at 'index' of items """
+
+        weight = self.cumulative[index] - (self.cumulative[index - 1] if index else 0)
+        return int(round(total * weight / self.cumulative[-1]))
+
+    def sample(self, count):
+        """ up to count distinct items """
+
+        picked = set()
+        for _ in range(count * 3):
+            if len(picked) >= min(count, len(self.items)):
+                break
+            picked.add(self.pick())
+        return picked
+
+
+class SyntheticData(object):
+    def __init__(self, rng, scale=1.0, log=None):
+        self.rng = rng
+        self.counts = dict((name, int(round(count * scale)) if name in ('users', 'publications') else count)
+                           for name, count in BASE_COUNTS.items())
+        self.log = log or (lambda message: None)
+        self.user_type = ContentType.objects.get_for_model(User)
+        self.publication_type = ContentType.objects.get_for_model(Publication)
+
+    def words(self, count):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(count))
+
+    def time(self, after=START, days=365):
+        return after + timedelta(seconds=self.rng.randint(0, days * 86400))
+
+    def uuid(self):
+        return uuid.UUID(int=self.rng.getrandbits(128))
+
+    def write(self, model, objects):
+        self.log("%s: %d rows" % (model.__name__, copy_objects(model, objects)))
+
+    def generate(self):
+        rng, counts = self.rng, self.counts
+        user_ids = allocate_ids(User, counts['users'])
+        self.write(User, (User(id=pk, username='synthetic-%d' % pk, password='!',
+                               email='synthetic-%d@example.com' % pk, date_joined=self.time()) for pk in user_ids))
+
+        owners = user_ids[:counts['publications']]
+        publication_ids = allocate_ids(Publication, len(owners))
+        self.write(Publication, (Publication(id=pk, creator_id=owner, name=self.words(2).title(),
+                                             create_time=self.time(), update_time=self.time())
+                                 for pk, owner in zip(publication_ids, owners)))
+        self.write(ContributorList, self.contributors(publication_ids, owners, user_ids))
+
+        write_ups = self.write_ups(user_ids, publication_ids)  # [(id, create_time)]
+        self.texts(write_ups, user_ids)
+
+        users = Popularity(user_ids, rng)
+        popular = Popularity(write_ups, rng)
+        votes = len(write_ups) * counts['votes_per_write_up']
+        self.write(VoteWriteUp, (VoteWriteUp(content_type=self.user_type, object_id=voter, write_up_id=pk,
+                                             vote_type=rng.random() < 0.85, timestamp=self.time(created, 60))
+                                 for i, (pk, created) in enumerate(popular.items)
+                                 for voter in rng.sample(user_ids, min(len(user_ids), popular.share(i, votes)))))
+
+        comments = self.comments(popular, users, len(write_ups) * counts['comments_per_write_up'])
+        self.write(VoteComment, (VoteComment(content_type=self.user_type, object_id=voter, comment_id=pk,
+                                             vote_type=rng.random() < 0.9, timestamp=self.time(created, 30))
+                                 for pk, created in comments
+                                 for voter in users.sample(rng.randint(0, 2 * counts['votes_per_comment']))))
+
+        authors = Popularity([(self.user_type.pk, pk) for pk in user_ids] +
+                             [(self.publication_type.pk, pk) for pk in publication_ids], rng)
+        self.write(Subscriber, (Subscriber(content_type=self.user_type, object_id=follower, content_type_2_id=ct,
+                                           object_id_2=target, timestamp=self.time())
+                                for follower in user_ids
+                                for ct, target in authors.sample(rng.randint(0, 2 * counts['subscriptions_per_user']))
+                                if (ct, target) != (self.user_type.pk, follower)))
+
+        views = len(write_ups) * counts['views_per_write_up']
+        self.write(RegisteredViewer, (RegisteredViewer(view_id=self.uuid(), user_id=users.pick(), write_up_id=pk,
+                                                       duration=rng.randint(0, 900), create_time=self.time(created, 90))
+                                      for pk, created in (popular.pick() for _ in range(views // 3))))
+        visitors = [self.uuid() for _ in range(counts['users'] * 5)]
+        self.write(AnonymousViewer, (AnonymousViewer(view_id=self.uuid(), visitor=rng.choice(visitors),
+                                                     write_up_id=pk, duration=rng.randint(0, 600),
+                                                     create_time=self.time(created, 90))
+                                     for pk, created in (popular.pick() for _ in range(views - views // 3))))
+
+        self.write(Notification, (Notification(user_id=user, notified=rng.random() < 0.7, timestamp=self.time(),
+                                               data={'type': rng.choice(('comment', 'vote', 'subscribe')),
+                                                     'write_up': popular.pick()[0], 'actor': users.pick()})
+                                  for user in user_ids
+                                  for _ in range(rng.randint(0, 2 * counts['notifications_per_user']))))
+
+    def contributors(self, publication_ids, owners, user_ids):
+        editors = self.counts['editors_per_publication']
+        for pk, owner in zip(publication_ids, owners):
+            share = 100 - 20 * editors
+            yield ContributorList(publication_id=pk, contributor_id=owner, share_XP=share, share_money=share,
+                                  level='O')
+            for user in self.rng.sample([u for u in user_ids if u != owner], min(editors, len(user_ids) - 1)):
+                yield ContributorList(publication_id=pk, contributor_id=user, share_XP=20, share_money=20,
+                                      level=self.rng.choice('AEN'))
+
+    def write_ups(self, user_ids, publication_ids):
+        rng, counts = self.rng, self.counts
+        owners = [(user, None, 'I') for user in user_ids
+                  for _ in range(rng.randint(0, 2 * counts['write_ups_per_user']))]
+        owners += [(None, pk, rng.choice('BM')) for pk in publication_ids
+                   for _ in range(rng.randint(1, 2 * counts['write_ups_per_publication']))]
+        ids = allocate_ids(WriteUpCollection, len(owners))
+        write_ups = [(pk, self.time()) for pk in ids]
+        self.write(WriteUpCollection, (
+            WriteUpCollection(id=pk, user_id=user, publication_id=publication, collection_type=collection_type,
+                              title=self.words(rng.randint(2, 6)).title(), uuid=self.uuid(),
+                              description=self.words(rng.randint(10, 40)), create_time=created, update_time=created)
+            for (pk, created), (user, publication, collection_type) in zip(write_ups, owners)))
+        return write_ups
+
+    def texts(self, write_ups, user_ids):
+        rng, counts = self.rng, self.counts
+        units = [(pk, created) for pk, created in write_ups
+                 for _ in range(rng.randint(1, 2 * counts['units_per_write_up']))]
+        text_ids = allocate_ids(BaseDesign, len(units))
+        revisions = dict((pk, rng.randint(1, 2 * counts['revisions_per_text'])) for pk in text_ids)
+        texts = {}  # id -> (title, seed of the paragraphs, editor, create time), texts are regenerated from the seed
+
+        def base_designs():
+            for pk, (_, created) in zip(text_ids, units):
+                texts[pk] = (self.words(rng.randint(5, 12)).capitalize(), rng.getrandbits(32), rng.choice(user_ids),
+                             created)
+                title, seed, editor, _ = texts[pk]
+                text = '\n'.join(self.paragraphs(seed))
+                yield BaseDesign(id=pk, title=title, text=text, text_hash=get_text_hash(text), last_editor_id=editor,
+                                 last_revision_num=revisions[pk], create_time=created, update_time=created)
+
+        def revision_history():
+            """ revision n of N holds the first n/N of the paragraphs """
+
+            for pk in text_ids:
+                title, seed, editor, created = texts[pk]
+                paragraphs = self.paragraphs(seed)
+                for num in range(1, revisions[pk] + 1):
+                    yield RevisionHistory(parent_id=pk, user_id=editor, title=title, revision_num=num,
+                                          text='\n'.join(paragraphs[:-(-len(paragraphs) * num // revisions[pk])]),
+                                          timestamp=created + timedelta(hours=num))
+
+        def positioned_units():
+            position, last = 0, None
+            for pk, (write_up, _) in zip(text_ids, units):
+                position = position + Unit.objects.POSITION_GAP if write_up == last else Unit.objects.POSITION_GAP
+                last = write_up
+                yield Unit(write_up_id=write_up, text_id=pk, position=position)
+
+        self.write(BaseDesign, base_designs())
+        self.write(Unit, positioned_units())
+        self.write(RevisionHistory, revision_history())
+
+    @staticmethod
+    def paragraphs(seed):
+        rng = random.Random(seed)
+        return ['<p>%s.</p>' % ' '.join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))).capitalize()
+                for _ in range(rng.randint(2, 15))]
+
+    def comments(self, popular, users, count):
+        """ 30% are replies to an earlier comment on the same write up, returns [(id, timestamp)] """
+
+        ids = allocate_ids(Comment, count)
+        result, rows, top_level, timestamps = [], [], {}, {}
+        for pk in ids:
+            write_up, created = popular.pick()
+            reply_to = None
+            if top_level.get(write_up) and self.rng.random() < 0.3:
+                reply_to = self.rng.choice(top_level[write_up])
+                timestamp = self.time(timestamps[reply_to], 7)
+            else:
+                top_level.setdefault(write_up, []).append(pk)
+                timestamp = timestamps[pk] = self.time(created, 60)
+            rows.append(Comment(id=pk, content_type=self.user_type, object_id=users.pick(), write_up_id=write_up,
+                                comment_text=self.words(self.rng.randint(3, 60)), reply_to_id=reply_to,
+                                delete_request=self.rng.random() < 0.02, timestamp=timestamp))
+            result.append((pk, timestamp))
+        self.write(Comment, rows)
+        return result
@@ -1 +1,36 @@
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from essential.models import RevisionHistory
+from write_up.models import BaseDesign
+
+
+class RevisionHistoryTest(TestCase):
+    """ Saved texts are recorded through the revision_saved signal """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='writer')
+
+    def test_save_text_creates_revision(self):
+        text = BaseDesign(title='title', text='first')
+        text.save_with_rev(user=self.user)
+        text.text = 'second'
+        self.assertTrue(BaseDesign.objects.save_text(text, self.user, autosave=False))
+
+        self.assertEqual(list(RevisionHistory.objects.filter(parent=text).order_by('revision_num')
+                              .values_list('revision_num', flat=True)), [1, 2])
+        self.assertEqual(RevisionHistory.objects.get_text(text, 2), 'second')
+
+    def test_revision_num_continues_after_existing_revisions(self):
+        """ rows written before last_revision_num existed still have it at 0 until backfilled """
+
+        text = BaseDesign.objects.create(title='title', text='old')
+        for num in (1, 2, 3):
+            RevisionHistory.objects.create(parent=text, user=self.user, text='old %d' % num, revision_num=num)
+        self.assertEqual(RevisionHistory.objects.backfill_last_revision_num(), 1)
+        text.text = 'new'
+        BaseDesign.objects.save_text(text, self.user, autosave=False)
+
+        self.assertEqual(RevisionHistory.objects.filter(parent=text).latest('revision_num').revision_num, 4)
+        self.assertEqual(BaseDesign.objects.get(pk=text.pk).last_revision_num, 4)
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+from functools import wraps
+
+from django.db import transaction, connection, OperationalError
+from django.utils.timezone import utc
+
+EPOCH = datetime(1970, 1, 1, tzinfo=utc)
+
+# Postgres SQLSTATE codes which only mean "try again": serialization_failure and deadlock_detected.
+# The default connection runs with REPEATABLE READ, so concurrent UPDATEs of one row end up here.
+RETRYABLE_PGCODES = ('40001', '40P01')
+
+
+def is_serialization_failure(error):
+    """ True if a wrapped database error was raised for a conflicting concurrent transaction """
+
+    return getattr(getattr(error, '__cause__', None), 'pgcode', None) in RETRYABLE_PGCODES
+
+
+def atomic_with_retry(retries=3, retry_on=()):
+    """
+    Decorator -> runs the function in its own transaction and re-runs it when the transaction
+    loses a race against a concurrent one.
+
+    retry_on -> extra exception classes that should also be treated as a lost race
+    (e.g. IntegrityError on a unique_together insert).
+
+    When called inside an already open atomic block the function is run only once, as only the
+    outermost transaction can be retried.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if connection.in_atomic_block:
+                return func(*args, **kwargs)
+
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    with transaction.atomic():
+                        return func(*args, **kwargs)
+                except OperationalError as e:
+                    if attempt >= retries or not is_serialization_failure(e):
+                        raise
+                except retry_on:
+                    if attempt >= retries:
+                        raise
+
+        return wrapper
+
+    return decorator
+
+
+def encode_cursor(timestamp, pk):
+    """ Opaque keyset pagination cursor for (timestamp, id) ordered rows """
+
+    delta = timestamp - EPOCH
+    micro = (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+    return "%d-%d" % (micro, pk)
+
+
+def decode_cursor(cursor):
+    """ Returns (timestamp, id), raises ValueError for a malformed cursor """
+
+    micro, pk = cursor.split('-')
+    return EPOCH + timedelta(microseconds=int(micro)), int(pk)
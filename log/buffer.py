@@ -0,0 +1,196 @@
+"""
+Write-behind buffer for viewer logs.
+
+Views are queued in process memory and written in batches, with COPY on Postgres and
+bulk_create otherwise, once VIEW_BUFFER_MAX_SIZE views are queued or every
+VIEW_BUFFER_FLUSH_INTERVAL seconds. Reading time heartbeats only keep the latest duration of a
+view: a view still in the buffer is inserted with it, for an already written view all pending
+durations are applied with one UPDATE per table on the next flush.
+
+New views count towards the trending score of their write up once the flush commits, unique
+reader sketches (UniqueReaderSketch) are updated after every flush.
+
+The buffer is flushed on interpreter exit, a hard kill loses at most one interval of views.
+"""
+
+import atexit
+import logging
+import threading
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction, close_old_connections
+from django.utils import six, timezone
+
+from log.models import AnonymousViewer, RegisteredViewer, UniqueReaderSketch
+from write_up.trending import add_trending, get_weight
+
+logger = logging.getLogger(__name__)
+
+MAX_DURATION = 32767  # PositiveSmallIntegerField
+
+
+class ViewBuffer(object):
+    """
+    record_view -> queues a view and returns its view_id, which the client sends with heartbeats
+    heartbeat -> sets the reading time (seconds) of a view
+    flush -> writes everything queued so far, called by the flusher thread
+    """
+
+    def __init__(self, max_size=None, interval=None):
+        self.max_size = max_size or getattr(settings, 'VIEW_BUFFER_MAX_SIZE', 1000)
+        self.interval = interval or getattr(settings, 'VIEW_BUFFER_FLUSH_INTERVAL', 5)
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.views = {}  # view_id -> unsaved model instance
+        self.durations = {}  # (model, view_id) -> duration, for views already written
+        self.thread = None
+        self.stopped = False
+
+    def record_view(self, write_up_id, user_id=None, visitor=None):
+        model = RegisteredViewer if user_id else AnonymousViewer
+        view = model(view_id=uuid.uuid4(), write_up_id=write_up_id, create_time=timezone.now())
+        if user_id:
+            view.user_id = user_id
+        else:
+            view.visitor = visitor
+        with self.lock:
+            self.views[view.view_id] = view
+            full = len(self.views) >= self.max_size
+        self.start()
+        if full:
+            self.wake.set()
+        return view.view_id
+
+    def heartbeat(self, view_id, duration, user_id=None):
+        if not isinstance(view_id, uuid.UUID):
+            view_id = uuid.UUID(str(view_id))
+        duration = min(int(duration), MAX_DURATION)
+        model = RegisteredViewer if user_id else AnonymousViewer
+        with self.lock:
+            view = self.views.get(view_id)
+            if view is not None:
+                view.duration = max(view.duration, duration)
+            else:
+                key = (model, view_id)
+                self.durations[key] = max(self.durations.get(key, 0), duration)
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.stopped = False
+                    self.thread = threading.Thread(target=self.run, name='view-buffer-flusher')
+                    self.thread.daemon = True
+                    self.thread.start()
+
+    def run(self):
+        while not self.stopped:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Viewer log flush failed, events kept for the next flush")
+
+    def stop(self):
+        self.stopped = True
+        self.wake.set()
+        self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                views, self.views = self.views, {}
+                durations, self.durations = self.durations, {}
+            if not views and not durations:
+                return
+            try:
+                with transaction.atomic():
+                    for model in (AnonymousViewer, RegisteredViewer):
+                        batch = [view for view in views.values() if isinstance(view, model)]
+                        if batch:
+                            insert_views(model, batch)
+                        updates = [(view_id, duration) for (m, view_id), duration in durations.items() if m is model]
+                        if updates:
+                            update_durations(model, updates)
+                    add_trending(get_view_weights(views.values()))
+            except Exception:
+                self.requeue(views, durations)
+                raise
+            if views:
+                try:
+                    UniqueReaderSketch.objects.add_readers(get_readers(views.values()))
+                except Exception:
+                    logger.exception("Unique reader sketches not updated")
+
+    def requeue(self, views, durations):
+        with self.lock:
+            for view_id, view in views.items():
+                self.views.setdefault(view_id, view)
+            for key, duration in durations.items():
+                self.durations[key] = max(self.durations.get(key, 0), duration)
+
+
+def get_view_weights(views):
+    weights = {}
+    for view in views:
+        weights[view.write_up_id] = weights.get(view.write_up_id, 0) + get_weight('view')
+    return weights
+
+
+def get_readers(views):
+    """ {(write_up_id, day): set of reader keys}, see UniqueReaderSketchManager """
+
+    readers = {}
+    for view in views:
+        if isinstance(view, RegisteredViewer):
+            key = 'u%s' % view.user_id
+        else:
+            key = 'a%s' % (view.visitor or view.view_id)
+        readers.setdefault((view.write_up_id, timezone.localtime(view.create_time, timezone.utc).date()),
+                           set()).add(key)
+    return readers
+
+
+def insert_views(model, views):
+    if connection.vendor != 'postgresql':
+        model.objects.bulk_create(views)
+        return
+
+    fields = [f for f in model._meta.concrete_fields if not f.primary_key]
+    stream = six.StringIO()
+    for view in views:
+        stream.write('\t'.join(r'\N' if value is None else six.text_type(value)
+                               for value in (f.get_db_prep_save(getattr(view, f.attname), connection)
+                                             for f in fields)))
+        stream.write('\n')
+    stream.seek(0)
+    with connection.cursor() as cursor:
+        cursor.copy_expert('COPY %s (%s) FROM STDIN' % (model._meta.db_table, ', '.join(f.column for f in fields)),
+                           stream)
+
+
+def update_durations(model, updates):
+    """ one UPDATE for all heartbeats of a table, durations never go backwards """
+
+    table = model._meta.db_table
+    values = ', '.join(['(%s::uuid, %s)'] * len(updates))
+    params = []
+    for view_id, duration in updates:
+        params.extend([str(view_id), duration])
+    # heartbeats only arrive for recent views, the bound limits the UPDATE to the latest partitions
+    params.append(timezone.now() - timedelta(seconds=getattr(settings, 'VIEW_HEARTBEAT_MAX_AGE', 24 * 60 * 60)))
+    with connection.cursor() as cursor:
+        cursor.execute('UPDATE %s AS t SET duration = v.duration FROM (VALUES %s) AS v (view_id, duration) '
+                       'WHERE t.view_id = v.view_id AND t.duration < v.duration AND t.create_time >= %%s'
+                       % (table, values), params)
+
+
+view_buffer = ViewBuffer()
+record_view = view_buffer.record_view
+heartbeat = view_buffer.heartbeat
+atexit.register(view_buffer.stop)
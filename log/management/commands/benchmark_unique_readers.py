@@ -0,0 +1,68 @@
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from log.buffer import get_readers
+from log.models import AnonymousViewer, UniqueReaderSketch
+from write_up.models import WriteUpCollection
+
+
+class Command(BaseCommand):
+    help = 'Compares HyperLogLog unique reader estimates with COUNT(DISTINCT) on synthetic views, rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--views', type=int, default=500000)
+        parser.add_argument('--readers', type=int, default=100000)
+        parser.add_argument('--days', type=int, default=60)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rand = random.Random(options['seed'])
+        visitors = [uuid.UUID(int=rand.getrandbits(128)) for _ in range(options['readers'])]
+        first_day = (timezone.now() - timedelta(days=options['days'])).replace(hour=0, minute=0, second=0,
+                                                                              microsecond=0)
+
+        with transaction.atomic():
+            user = User.objects.create(username='unique-readers-benchmark')
+            write_up = WriteUpCollection.objects.create(user=user, title='benchmark', collection_type='I',
+                                                        description='')
+            batch = []
+            for _ in range(options['views']):
+                create_time = first_day + timedelta(seconds=rand.randrange(options['days'] * 86400))
+                batch.append(AnonymousViewer(write_up=write_up, visitor=rand.choice(visitors),
+                                             create_time=create_time))
+                if len(batch) == 10000:
+                    self.ingest(batch)
+                    batch = []
+            self.ingest(batch)
+
+            self.stdout.write("%-10s %10s %10s %8s %12s %12s" % ('range', 'exact', 'estimate', 'error',
+                                                                  'exact ms', 'sketch ms'))
+            for label, days in (('1 day', 1), ('7 days', 7), ('30 days', 30), ('all', options['days'])):
+                start = (first_day + timedelta(days=options['days'] - days)).date()
+                end = (first_day + timedelta(days=options['days'] - 1)).date()
+
+                began = time.time()
+                exact = AnonymousViewer.objects.filter(
+                    write_up=write_up, create_time__gte=datetime.combine(start, datetime.min.time()).replace(
+                        tzinfo=timezone.utc)).values('visitor').distinct().count()
+                exact_ms = (time.time() - began) * 1000
+
+                began = time.time()
+                estimate = UniqueReaderSketch.objects.unique_readers(write_up, start, end)
+                sketch_ms = (time.time() - began) * 1000
+
+                error = 100.0 * abs(estimate - exact) / exact if exact else 0
+                self.stdout.write("%-10s %10d %10d %7.2f%% %12.2f %12.2f" % (label, exact, estimate, error,
+                                                                             exact_ms, sketch_ms))
+            transaction.set_rollback(True)
+
+    def ingest(self, views):
+        AnonymousViewer.objects.bulk_create(views)
+        UniqueReaderSketch.objects.add_readers(get_readers(views))
@@ -0,0 +1,76 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from essential.utils import atomic_with_retry
+from log.models import AnonymousViewer, RegisteredViewer, ViewRollup, RollupCheckpoint
+
+# viewer log -> rollup counter it feeds
+SOURCES = (
+    (AnonymousViewer, 'anonymous_views'),
+    (RegisteredViewer, 'registered_views'),
+)
+
+GRANULARITIES = (
+    ('H', 'hour'),
+    ('D', 'day'),
+)
+
+ROLLUP_SQL = """
+INSERT INTO {rollup} (write_up_id, granularity, bucket, {counter}, {other}, duration)
+SELECT write_up_id, %s, date_trunc(%s, create_time), count(*), 0, coalesce(sum(duration), 0)
+FROM {source}
+WHERE id > %s AND id <= %s
+GROUP BY 1, 3
+ON CONFLICT (write_up_id, granularity, bucket) DO UPDATE
+SET {counter} = {rollup}.{counter} + EXCLUDED.{counter}, duration = {rollup}.duration + EXCLUDED.duration
+"""
+
+
+class Command(BaseCommand):
+    help = 'Adds viewer log rows past the high-water mark to the hourly and daily view rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100000, help='Log rows rolled up per transaction')
+
+    def handle(self, *args, **options):
+        # rows are only rolled up once heartbeats can no longer raise their duration (log.buffer), the
+        # high-water mark never revisits them
+        max_age = getattr(settings, 'VIEW_HEARTBEAT_MAX_AGE', 24 * 60 * 60)
+        delay = max(getattr(settings, 'VIEW_ROLLUP_SETTLE_DELAY', max_age + 5 * 60), max_age)
+        cutoff = timezone.now() - timedelta(seconds=delay)
+        for model, counter in SOURCES:
+            upper = model.objects.filter(create_time__lt=cutoff).order_by('-id').values_list('id', flat=True).first()
+            if upper is None:
+                continue
+            other = [c for _, c in SOURCES if c != counter][0]
+            sql = ROLLUP_SQL.format(rollup=ViewRollup._meta.db_table, source=model._meta.db_table,
+                                    counter=counter, other=other)
+            covered = 0
+            while True:
+                done = self.rollup_batch(model._meta.db_table, sql, upper, options['batch_size'])
+                if done is None:
+                    break
+                covered += done
+            self.stdout.write("%s: rolled up to id %d (%d ids)" % (model._meta.db_table, upper, covered))
+
+    @atomic_with_retry()
+    def rollup_batch(self, source, sql, upper, batch_size):
+        """ returns the number of log ids covered, None once the high-water mark reaches 'upper' """
+
+        checkpoint, _ = RollupCheckpoint.objects.get_or_create(source=source)
+        checkpoint = RollupCheckpoint.objects.select_for_update().get(pk=checkpoint.pk)
+        if checkpoint.last_id >= upper:
+            return None
+
+        end = min(checkpoint.last_id + batch_size, upper)
+        with connection.cursor() as cursor:
+            for granularity, precision in GRANULARITIES:
+                cursor.execute(sql, [granularity, precision, checkpoint.last_id, end])
+        covered = end - checkpoint.last_id
+        checkpoint.last_id = end
+        checkpoint.save()
+        return covered
@@ -1,17 +1,183 @@
 from __future__ import unicode_literals
 
+import uuid
+from datetime import date, timedelta
+
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, IntegrityError
+from django.db.models import Sum
+from django.utils import timezone
+
+from essential.utils import atomic_with_retry
+from log.hll import HyperLogLog
 
 
 class AnonymousViewer(models.Model):
+    """
+    Written in batches by log.buffer, create_time is the time of the view and not of the insert.
+    view_id -> identifies the view for reading time (duration) heartbeats
+    visitor -> id of the anonymous visitor (cookie), counted as one reader across views
+    """
+
+    view_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    visitor = models.UUIDField(null=True, blank=True)
     write_up = models.ForeignKey('write_up.WriteUpCollection')
     duration = models.PositiveSmallIntegerField(default=0)
-    create_time = models.DateTimeField(auto_now_add=True)
+    create_time = models.DateTimeField(default=timezone.now)
 
 
 class RegisteredViewer(models.Model):
+    """ Same as AnonymousViewer, for logged in users """
+
+    view_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     user = models.ForeignKey(User)
     write_up = models.ForeignKey('write_up.WriteUpCollection')
     duration = models.PositiveSmallIntegerField(default=0)
-    create_time = models.DateTimeField(auto_now_add=True)
+    create_time = models.DateTimeField(default=timezone.now)
+
+
+class ViewRollupManager(models.Manager):
+    """
+    Manager for ViewRollup model, reads view statistics without touching the viewer logs.
+    Time ranges are [start, end) and are resolved to whole hours.
+
+    series -> [{'bucket': .., 'anonymous_views': .., 'registered_views': .., 'duration': ..}, ...]
+    totals -> {'anonymous_views': .., 'registered_views': .., 'duration': ..}, whole days of the range
+    are read from daily rows and only the edges from hourly rows
+    """
+
+    def series(self, write_up, start, end, granularity='D'):
+        return list(self.get_queryset().filter(write_up=write_up, granularity=granularity, bucket__gte=start,
+                                               bucket__lt=end).order_by('bucket')
+                    .values('bucket', 'anonymous_views', 'registered_views', 'duration'))
+
+    def totals(self, write_up, start, end):
+        first_day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        if first_day < start:
+            first_day += timedelta(days=1)
+        last_day = end.replace(hour=0, minute=0, second=0, microsecond=0)
+
+        if first_day < last_day:
+            buckets = (models.Q(granularity='D', bucket__gte=first_day, bucket__lt=last_day) |
+                       models.Q(granularity='H', bucket__gte=start, bucket__lt=first_day) |
+                       models.Q(granularity='H', bucket__gte=last_day, bucket__lt=end))
+        else:
+            buckets = models.Q(granularity='H', bucket__gte=start, bucket__lt=end)
+
+        totals = self.get_queryset().filter(buckets, write_up=write_up).aggregate(
+            anonymous_views=Sum('anonymous_views'), registered_views=Sum('registered_views'),
+            duration=Sum('duration'))
+        return dict((key, value or 0) for key, value in totals.items())
+
+
+class ViewRollup(models.Model):
+    """
+    View counts and reading time (seconds) per write up and UTC hour/day.
+    Filled incrementally from the viewer logs by the 'rollup_views' command, views are added once their
+    reading time is final (VIEW_ROLLUP_SETTLE_DELAY, at least VIEW_HEARTBEAT_MAX_AGE after the view).
+    """
+
+    write_up = models.ForeignKey('write_up.WriteUpCollection')
+    GRANULARITY = (('H', 'Hour'),
+                   ('D', 'Day'),
+                   )
+    granularity = models.CharField(max_length=1, choices=GRANULARITY)
+    bucket = models.DateTimeField()
+    anonymous_views = models.PositiveIntegerField(default=0)
+    registered_views = models.PositiveIntegerField(default=0)
+    duration = models.BigIntegerField(default=0)
+
+    objects = ViewRollupManager()
+
+    class Meta:
+        unique_together = ('write_up', 'granularity', 'bucket')
+
+
+class RollupCheckpoint(models.Model):
+    """ High-water mark (last rolled up id) of each viewer log table """
+
+    source = models.CharField(max_length=100, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    update_time = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return "'%s' up to %s" % (self.source, self.last_id)
+
+
+class UniqueReaderSketchManager(models.Manager):
+    """
+    Manager for UniqueReaderSketch model
+
+    add_readers -> merges readers into the sketches, {(write_up_id, day): set of reader keys}
+    unique_readers -> estimated unique readers of a write up between two dates (inclusive)
+    unique_readers_all_time -> estimated unique readers of a write up
+
+    reader keys are 'u<user id>' for registered readers and 'a<visitor>' for anonymous ones
+    """
+
+    @atomic_with_retry(retry_on=(IntegrityError,))
+    def add_readers(self, readers):
+        """ IntegrityError means a concurrent flush created one of the sketches first """
+
+        sketches = {}
+        for (write_up_id, day), keys in readers.items():
+            for granularity, bucket in (('D', day), ('A', ALL_TIME)):
+                sketch = sketches.setdefault((write_up_id, granularity, bucket), HyperLogLog())
+                sketch.update(keys)
+        if not sketches:
+            return
+
+        lookup = models.Q()
+        for write_up_id, granularity, bucket in sketches:
+            lookup |= models.Q(write_up_id=write_up_id, granularity=granularity, bucket=bucket)
+        existing = dict(((s.write_up_id, s.granularity, s.bucket), s)
+                        for s in self.get_queryset().select_for_update().filter(lookup))
+
+        missing = []
+        for key, sketch in sketches.items():
+            if key in existing:
+                row = existing[key]
+                merged = HyperLogLog(row.registers).merge(sketch).to_bytes()
+                if merged != bytes(bytearray(row.registers)):
+                    self.get_queryset().filter(pk=row.pk).update(registers=merged)
+            else:
+                missing.append(UniqueReaderSketch(write_up_id=key[0], granularity=key[1], bucket=key[2],
+                                                  registers=sketch.to_bytes()))
+        self.bulk_create(missing)
+
+    def merged(self, queryset):
+        sketch = HyperLogLog()
+        for registers in queryset.values_list('registers', flat=True):
+            sketch.merge(HyperLogLog(registers))
+        return sketch
+
+    def unique_readers(self, write_up, start, end):
+        return self.merged(self.get_queryset().filter(write_up=write_up, granularity='D',
+                                                      bucket__gte=start, bucket__lte=end)).count()
+
+    def unique_readers_all_time(self, write_up):
+        return self.merged(self.get_queryset().filter(write_up=write_up, granularity='A')).count()
+
+
+ALL_TIME = date(1970, 1, 1)
+
+
+class UniqueReaderSketch(models.Model):
+    """
+    HyperLogLog sketch (log.hll) of the readers of a write up per UTC day ('D'),
+    and for all time ('A', bucket is always 1970-01-01). Weeks and other ranges are answered by
+    merging daily sketches. Updated by log.buffer as views are written.
+    """
+
+    write_up = models.ForeignKey('write_up.WriteUpCollection')
+    GRANULARITY = (('D', 'Day'),
+                   ('A', 'All time'),
+                   )
+    granularity = models.CharField(max_length=1, choices=GRANULARITY)
+    bucket = models.DateField()
+    registers = models.BinaryField()
+
+    objects = UniqueReaderSketchManager()
+
+    class Meta:
+        unique_together = ('write_up', 'granularity', 'bucket')
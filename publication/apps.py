@@ -7,4 +7,8 @@ class PublicationConfig(AppConfig):
     name = 'publication'
 
     def ready(self):
-        pass
+        from django.db.models.signals import m2m_changed
+        from publication.signals import invalidate_event_members
+        from write_up.models import LiveWriting, GroupWriting
+        for model in (LiveWriting, GroupWriting):
+            m2m_changed.connect(invalidate_event_members, sender=model.closed_group_users.through)
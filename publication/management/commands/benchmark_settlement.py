@@ -0,0 +1,79 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from publication.models import Publication, ContributorList, EarningEvent, LedgerEntry
+from publication.settlement import TABLES, settle_all
+from write_up.models import WriteUpCollection, ContributorList as WriteUpContributorList
+
+EVENTS_SQL = """
+INSERT INTO {event} (event_key, write_up_id, publication_id, "XP", money, create_time)
+SELECT 'benchmark-' || i, w.id, w.publication_id, 1 + mod(i, 50), 1 + mod(i, 997), now()
+FROM generate_series(1, %(count)s) AS i
+JOIN {write_up} w ON w.id = (%(write_ups)s::integer[])[1 + mod(i, %(write_up_count)s)]
+"""
+
+
+class Command(BaseCommand):
+    help = 'Measures settlement throughput on synthetic earning events, all rows are rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=1000000)
+        parser.add_argument('--batch-size', type=int, default=50000)
+        parser.add_argument('--write-ups', type=int, default=3000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            write_up_ids = self.create_write_ups(options['write_ups'])
+            start = time.time()
+            with connection.cursor() as cursor:
+                cursor.execute(EVENTS_SQL.format(**TABLES), {'count': options['events'], 'write_ups': write_up_ids,
+                                                              'write_up_count': len(write_up_ids)})
+            recorded = time.time() - start
+
+            start = time.time()
+            batches = settle_all(options['batch_size'])
+            elapsed = time.time() - start
+
+            events = sum(b.event_count for b in batches)
+            pending = EarningEvent.objects.filter(event_key__startswith='benchmark-', batch__isnull=True).count()
+            entries = LedgerEntry.objects.filter(batch__in=batches).count()
+            transaction.set_rollback(True)
+
+        self.stdout.write("%d events recorded in %.2fs" % (options['events'], recorded))
+        self.stdout.write("%d events settled in %d batches in %.2fs (%.0f events/s), %d ledger entries, %d pending" % (
+            events, len(batches), elapsed, events / elapsed, entries, pending))
+
+    def create_write_ups(self, count):
+        """ a third each: independent, of a publication, with their own contributor list """
+
+        User.objects.bulk_create([User(username='settlement-benchmark-%d' % i) for i in range(count)])
+        users = list(User.objects.filter(username__startswith='settlement-benchmark-').order_by('id'))
+        owners = users[:count // 3]
+        Publication.objects.bulk_create([Publication(creator=user, name=user.username) for user in owners])
+        publications = list(Publication.objects.filter(creator__in=owners).order_by('id'))
+        ContributorList.objects.bulk_create(
+            [ContributorList(publication=p, contributor=p.creator, share_XP=60, share_money=70, level='O')
+             for p in publications] +
+            [ContributorList(publication=p, contributor=users[-1 - i], share_XP=40, share_money=30, level='E')
+             for i, p in enumerate(publications)])
+
+        WriteUpCollection.objects.bulk_create(
+            [WriteUpCollection(user=user, collection_type='I', description='', title='independent')
+             for user in users[count // 3:2 * count // 3]] +
+            [WriteUpCollection(publication=p, collection_type='M', description='', title='publication')
+             for p in publications] +
+            [WriteUpCollection(user=user, collection_type='B', description='', title='contributors')
+             for user in users[2 * count // 3:]])
+        write_ups = list(WriteUpCollection.objects.filter(Q(user__in=users) | Q(publication__in=publications))
+                         .order_by('id').values_list('id', 'title', 'user_id'))
+        shared = [(pk, user_id) for pk, title, user_id in write_ups if title == 'contributors']
+        WriteUpContributorList.objects.bulk_create(
+            [WriteUpContributorList(write_up_id=pk, contributor_id=user_id, share_XP=50, share_money=50)
+             for pk, user_id in shared] +
+            [WriteUpContributorList(write_up_id=pk, contributor=owners[i % len(owners)], share_XP=50, share_money=50)
+             for i, (pk, _) in enumerate(shared)])
+        return [pk for pk, _, _ in write_ups]
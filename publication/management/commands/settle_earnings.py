@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from publication.settlement import settle_all
+
+
+class Command(BaseCommand):
+    help = 'Distributes all unsettled earning events over contributors, safe to run concurrently'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help='Events per transaction')
+
+    def handle(self, *args, **options):
+        batches = settle_all(options['batch_size'])
+        self.stdout.write("%d events settled in %d batches, %d ledger entries" % (
+            sum(b.event_count for b in batches), len(batches), sum(b.entry_count for b in batches)))
@@ -5,7 +5,10 @@ from django.contrib.auth.models import User
 
 
 class Publication(models.Model):
-    """ creator is the sole owner of a Publication """
+    """
+    creator is the sole owner of a Publication
+    XP, money -> settled earnings of the publication and its write ups, see publication.settlement
+    """
 
     creator = models.OneToOneField(User)
     name = models.CharField(max_length=150)
@@ -22,11 +25,14 @@ class ContributorList(models.Model):
     """
     Every activity of publication is attached via this list and not to Publication model.
     On every new Publication creation, an entry will be created with owner set as the user.
+    earned_XP, earned_money -> settled earnings of the contributor here, see publication.settlement
     """
 
     contributor = models.ForeignKey(User, related_name='publication_contributors')
     share_XP = models.PositiveSmallIntegerField(default=0)
     share_money = models.PositiveSmallIntegerField(default=0)
+    earned_XP = models.BigIntegerField(default=0)
+    earned_money = models.BigIntegerField(default=0)
     publication = models.ForeignKey(Publication, null=True)
     LEVEL = (('A', 'Administrator'),
              ('E', 'Editor'),
@@ -42,3 +48,61 @@ class ContributorList(models.Model):
 
     def __unicode__(self):
         return "'%s' of '%s'" % (self.contributor, self.publication)
+
+
+class SettlementBatch(models.Model):
+    """ One settlement run over a set of EarningEvents, written in the same transaction as its ledger entries """
+
+    event_count = models.PositiveIntegerField(default=0)
+    entry_count = models.PositiveIntegerField(default=0)
+    create_time = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return "%s (%s events)" % (self.id, self.event_count)
+
+
+class EarningEvent(models.Model):
+    """
+    XP and money earned by a write up or a publication, recorded with publication.settlement.record_earnings
+    and distributed to contributors by settle_batch.
+
+    event_key -> idempotency key of the source event, recording the same key again is a no-op
+    publication -> publication of the write up if not given
+    batch -> None until settled
+    """
+
+    event_key = models.CharField(max_length=100, unique=True)
+    write_up = models.ForeignKey('write_up.WriteUpCollection', null=True)
+    publication = models.ForeignKey(Publication, null=True)
+    XP = models.BigIntegerField(default=0)
+    money = models.BigIntegerField(default=0)
+    batch = models.ForeignKey(SettlementBatch, null=True)
+    create_time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        index_together = [('batch', 'id')]
+
+    def __unicode__(self):
+        return self.event_key
+
+
+class LedgerEntry(models.Model):
+    """
+    Share of one contributor in one EarningEvent, the audit trail of every balance change.
+    Exactly one of publication_contributor / write_up_contributor is set, neither for the author
+    of an independent write up.
+    """
+
+    batch = models.ForeignKey(SettlementBatch)
+    event = models.ForeignKey(EarningEvent)
+    user = models.ForeignKey(User)
+    publication_contributor = models.ForeignKey(ContributorList, null=True)
+    write_up_contributor = models.ForeignKey('write_up.ContributorList', null=True)
+    XP = models.BigIntegerField(default=0)
+    money = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('event', 'user')
+
+    def __unicode__(self):
+        return "%s of %s" % (self.user_id, self.event_id)
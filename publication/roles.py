@@ -0,0 +1,119 @@
+"""
+Ownership and contributor role lookups, the single entry point for write permission checks.
+
+Lookups are cached for the duration of a request (RoleCacheMiddleware) and in the shared cache
+for ROLE_CACHE_TIMEOUT seconds, missing relations are cached as well. Receivers in
+publication.signals delete the entries of a changed Publication or ContributorList, once right
+away and once more after the transaction commits.
+"""
+
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from publication.models import Publication, ContributorList
+
+OWNED_KEY = 'role-owned-publication-%s'  # user id -> publication id, 0 for none
+LEVEL_KEY = 'role-level-%s-%s'  # user id, publication id -> ContributorList.level, '' for none
+WRITE_UP_KEY = 'role-write-up-%s-%s'  # user id, write up id -> 1 if in write_up.ContributorList, else 0
+EVENT_KEY = 'role-event-%s'  # write up id -> {'closed': .., 'members': [user ids]} of its event, {} for none
+
+# levels of publication.ContributorList which may write to the publication's write ups
+WRITER_LEVELS = ('O', 'A', 'E')
+
+_local = threading.local()
+
+
+class RoleCacheMiddleware(object):
+    """ Keeps the lookups of one request in memory, outside of requests only the shared cache is used """
+
+    def process_request(self, request):
+        _local.roles = {}
+
+    def process_response(self, request, response):
+        _local.roles = None
+        return response
+
+
+def _lookup(key, load):
+    local = getattr(_local, 'roles', None)
+    if local is not None and key in local:
+        return local[key]
+    value = cache.get(key)
+    if value is None:
+        value = load()
+        cache.set(key, value, getattr(settings, 'ROLE_CACHE_TIMEOUT', 60 * 60))
+    if local is not None:
+        local[key] = value
+    return value
+
+
+def invalidate(*keys):
+    local = getattr(_local, 'roles', None)
+    for key in keys:
+        if local is not None:
+            local.pop(key, None)
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_owned_publication_id(user_id):
+    """ id of the publication created by the user, None if there is none """
+
+    return _lookup(OWNED_KEY % user_id, lambda: Publication.objects.filter(
+        creator_id=user_id).values_list('id', flat=True).first() or 0) or None
+
+
+def get_publication_level(user_id, publication_id):
+    """ ContributorList.level of the user in the publication, None if not a contributor """
+
+    return _lookup(LEVEL_KEY % (user_id, publication_id), lambda: ContributorList.objects.filter(
+        contributor_id=user_id, publication_id=publication_id).values_list('level', flat=True).first() or '') or None
+
+
+def is_write_up_contributor(user_id, write_up_id):
+    from write_up.models import ContributorList as WriteUpContributorList  # write_up.models imports this module
+
+    return bool(_lookup(WRITE_UP_KEY % (user_id, write_up_id), lambda: int(WriteUpContributorList.objects.filter(
+        contributor_id=user_id, write_up_id=write_up_id).exists())))
+
+
+def get_event(write_up_id, collection_type):
+    """ closed group and its members of the LiveWriting / GroupWriting of a write up, {} if it has none """
+
+    from write_up.models import LiveWriting, GroupWriting
+
+    model = {'L': LiveWriting, 'G': GroupWriting}.get(collection_type)
+    if model is None:
+        return {}
+
+    def load():
+        event = model.objects.filter(write_up_id=write_up_id).values_list('id', 'closed_group').first()
+        if event is None:
+            return {}
+        members = model.closed_group_users.through.objects.filter(**{
+            '%s_id' % model._meta.model_name: event[0]}).values_list('user_id', flat=True) if event[1] else []
+        return {'closed': event[1], 'members': list(members)}
+
+    return _lookup(EVENT_KEY % write_up_id, load)
+
+
+def can_write(user, write_up):
+    """
+    True if the user may write to the collection: its author, an Owner, Administrator or Editor
+    of its publication, one of its own contributors, or for LiveWriting / GroupWriting events
+    any user of an open event and the closed_group_users of a closed one.
+    """
+
+    if not getattr(user, 'is_authenticated', lambda: False)():
+        return False
+    if write_up.user_id == user.pk:
+        return True
+    event = get_event(write_up.pk, write_up.collection_type)
+    if event and (not event['closed'] or user.pk in event['members']):
+        return True
+    if write_up.publication_id and get_publication_level(user.pk, write_up.publication_id) in WRITER_LEVELS:
+        return True
+    return is_write_up_contributor(user.pk, write_up.pk)
@@ -0,0 +1,159 @@
+"""
+Settlement of XP and money earnings over contributors.
+
+Earnings are recorded as EarningEvents (idempotent on event_key). settle_batch claims a batch of
+unsettled events and, in one transaction, writes one LedgerEntry per receiving user and applies
+the sums of the batch to every balance with one set-based statement per table:
+
+    write up with a write_up.ContributorList -> split by its share_XP / share_money
+    otherwise, write up of a publication or publication itself -> split by publication.ContributorList
+    otherwise (independent write up) -> everything to the author
+
+Shares are percents of the event. When the shares of an event add up to more than 100 (the owner
+keeps 100 when contributors are added) they are scaled down to split exactly the full amount.
+Parts are rounded down, the rounding remainder goes to the largest share. Publication.XP/money
+get the full amount of the events of the publication and its write ups.
+
+An event is claimed by exactly one committed batch and LedgerEntry is unique per (event, user),
+so re-running or concurrently running settlements never applies an earning twice.
+"""
+
+from django.db import connection
+
+from essential.utils import atomic_with_retry
+from publication.models import Publication, ContributorList, EarningEvent, LedgerEntry, SettlementBatch
+from user_custom.models import UserProfile
+from write_up.models import WriteUpCollection, ContributorList as WriteUpContributorList
+
+TABLES = dict((name, model._meta.db_table) for name, model in (
+    ('event', EarningEvent), ('ledger', LedgerEntry), ('publication', Publication),
+    ('publication_contributor', ContributorList), ('write_up', WriteUpCollection),
+    ('write_up_contributor', WriteUpContributorList), ('profile', UserProfile)))
+
+RECORD_SQL = """
+INSERT INTO {event} (event_key, write_up_id, publication_id, "XP", money, create_time)
+SELECT e.event_key, e.write_up_id, coalesce(e.publication_id, w.publication_id), e.xp, e.money, now()
+FROM unnest(%(keys)s::varchar[], %(write_ups)s::integer[], %(publications)s::integer[], %(xp)s::bigint[],
+            %(money)s::bigint[]) AS e (event_key, write_up_id, publication_id, xp, money)
+LEFT JOIN {write_up} w ON w.id = e.write_up_id
+ON CONFLICT (event_key) DO NOTHING
+"""
+
+CLAIM_SQL = """
+UPDATE {event} SET batch_id = %(batch)s WHERE id IN (
+    SELECT id FROM {event} WHERE batch_id IS NULL ORDER BY id LIMIT %(limit)s FOR UPDATE SKIP LOCKED
+)
+"""
+
+LEDGER_SQL = """
+WITH events AS (
+    SELECT id, write_up_id, publication_id, "XP" AS xp, money FROM {event} WHERE batch_id = %(batch)s
+),
+shares AS (
+    SELECT e.id AS event_id, c.contributor_id AS user_id, NULL::integer AS publication_contributor_id,
+           c.id AS write_up_contributor_id, c."share_XP" AS share_xp, c.share_money, e.xp, e.money
+    FROM events e JOIN {write_up_contributor} c ON c.write_up_id = e.write_up_id
+    UNION ALL
+    SELECT e.id, c.contributor_id, c.id, NULL, c."share_XP", c.share_money, e.xp, e.money
+    FROM events e JOIN {publication_contributor} c ON c.publication_id = e.publication_id
+    WHERE NOT EXISTS (SELECT 1 FROM {write_up_contributor} l WHERE l.write_up_id = e.write_up_id)
+    UNION ALL
+    SELECT e.id, w.user_id, NULL, NULL, 100, 100, e.xp, e.money
+    FROM events e JOIN {write_up} w ON w.id = e.write_up_id
+    WHERE e.publication_id IS NULL AND w.user_id IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM {write_up_contributor} l WHERE l.write_up_id = e.write_up_id)
+),
+split AS (
+    SELECT *,
+           floor(xp * share_xp / greatest(sum(share_xp) OVER per_event, 100)::numeric)::bigint AS xp_part,
+           floor(money * share_money / greatest(sum(share_money) OVER per_event, 100)::numeric)::bigint
+               AS money_part,
+           floor(xp * least(sum(share_xp) OVER per_event, 100) / 100.0)::bigint AS xp_total,
+           floor(money * least(sum(share_money) OVER per_event, 100) / 100.0)::bigint AS money_total,
+           row_number() OVER (PARTITION BY event_id ORDER BY share_xp DESC, user_id) AS xp_rank,
+           row_number() OVER (PARTITION BY event_id ORDER BY share_money DESC, user_id) AS money_rank
+    FROM shares WINDOW per_event AS (PARTITION BY event_id)
+)
+INSERT INTO {ledger} (batch_id, event_id, user_id, publication_contributor_id, write_up_contributor_id, "XP", money)
+SELECT %(batch)s, event_id, user_id, publication_contributor_id, write_up_contributor_id,
+       xp_part + CASE WHEN xp_rank = 1 THEN xp_total - sum(xp_part) OVER per_event ELSE 0 END,
+       money_part + CASE WHEN money_rank = 1 THEN money_total - sum(money_part) OVER per_event ELSE 0 END
+FROM split WINDOW per_event AS (PARTITION BY event_id)
+ON CONFLICT (event_id, user_id) DO NOTHING
+"""
+
+CONTRIBUTOR_BALANCE_SQL = """
+UPDATE {table} c SET "earned_XP" = c."earned_XP" + s.xp, earned_money = c.earned_money + s.money
+FROM (SELECT {column} AS id, sum("XP") AS xp, sum(money) AS money FROM {ledger}
+      WHERE batch_id = %(batch)s AND {column} IS NOT NULL GROUP BY 1) s
+WHERE c.id = s.id
+"""
+
+PROFILE_BALANCE_SQL = """
+INSERT INTO {profile} (user_id, "XP", money, update_time)
+SELECT user_id, sum("XP"), sum(money), now() FROM {ledger} WHERE batch_id = %(batch)s GROUP BY user_id
+ON CONFLICT (user_id) DO UPDATE SET "XP" = {profile}."XP" + EXCLUDED."XP", money = {profile}.money + EXCLUDED.money
+"""
+
+PUBLICATION_BALANCE_SQL = """
+UPDATE {publication} p SET "XP" = p."XP" + s.xp, money = p.money + s.money
+FROM (SELECT publication_id, sum("XP") AS xp, sum(money) AS money FROM {event}
+      WHERE batch_id = %(batch)s AND publication_id IS NOT NULL GROUP BY 1) s
+WHERE p.id = s.publication_id
+"""
+
+
+def record_earnings(events):
+    """
+    events -> iterable of dicts with 'event_key', 'XP', 'money' and 'write_up_id' and/or 'publication_id'
+    Returns the number of new events, keys recorded before are skipped.
+    """
+
+    events = list(events)
+    if not events:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(RECORD_SQL.format(**TABLES), {
+            'keys': [e['event_key'] for e in events],
+            'write_ups': [e.get('write_up_id') for e in events],
+            'publications': [e.get('publication_id') for e in events],
+            'xp': [e.get('XP', 0) for e in events],
+            'money': [e.get('money', 0) for e in events],
+        })
+        return cursor.rowcount
+
+
+@atomic_with_retry()
+def settle_batch(limit=10000):
+    """ Settles up to 'limit' unsettled events, returns the SettlementBatch or None if nothing was pending """
+
+    batch = SettlementBatch.objects.create()
+    params = {'batch': batch.pk, 'limit': limit}
+    with connection.cursor() as cursor:
+        cursor.execute(CLAIM_SQL.format(**TABLES), params)
+        batch.event_count = cursor.rowcount
+        if not batch.event_count:
+            batch.delete()
+            return None
+
+        cursor.execute(LEDGER_SQL.format(**TABLES), params)
+        batch.entry_count = cursor.rowcount
+        for table, column in (('publication_contributor', 'publication_contributor_id'),
+                              ('write_up_contributor', 'write_up_contributor_id')):
+            cursor.execute(CONTRIBUTOR_BALANCE_SQL.format(table=TABLES[table], column=column, **TABLES), params)
+        cursor.execute(PROFILE_BALANCE_SQL.format(**TABLES), params)
+        cursor.execute(PUBLICATION_BALANCE_SQL.format(**TABLES), params)
+
+    SettlementBatch.objects.filter(pk=batch.pk).update(event_count=batch.event_count, entry_count=batch.entry_count)
+    return batch
+
+
+def settle_all(limit=10000):
+    """ Settles batches until no event is pending, returns the list of batches """
+
+    batches = []
+    while True:
+        batch = settle_batch(limit)
+        if batch is None:
+            return batches
+        batches.append(batch)
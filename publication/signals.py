@@ -1,7 +1,8 @@
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 
 from publication.models import Publication, ContributorList
+from publication.roles import invalidate, OWNED_KEY, LEVEL_KEY, WRITE_UP_KEY, EVENT_KEY
 
 
 @receiver(post_save, sender=Publication)
@@ -12,3 +13,44 @@ def create_owner_in_contributor_list(sender, **kwargs):
         publication = kwargs.get('instance')
         ContributorList.objects.create(contributor=publication.creator, share_XP=100, share_money=100,
                                        publication=publication, level='O')
+
+
+@receiver(post_save, sender=Publication)
+@receiver(post_delete, sender=Publication)
+def invalidate_owner(sender, **kwargs):
+    invalidate(OWNED_KEY % kwargs.get('instance').creator_id)
+
+
+@receiver(post_save, sender=ContributorList)
+@receiver(post_delete, sender=ContributorList)
+def invalidate_publication_level(sender, **kwargs):
+    contributor = kwargs.get('instance')
+    invalidate(LEVEL_KEY % (contributor.contributor_id, contributor.publication_id))
+
+
+@receiver(post_save, sender='write_up.ContributorList')
+@receiver(post_delete, sender='write_up.ContributorList')
+def invalidate_write_up_contributor(sender, **kwargs):
+    contributor = kwargs.get('instance')
+    invalidate(WRITE_UP_KEY % (contributor.contributor_id, contributor.write_up_id))
+
+
+@receiver(post_save, sender='write_up.LiveWriting')
+@receiver(post_delete, sender='write_up.LiveWriting')
+@receiver(post_save, sender='write_up.GroupWriting')
+@receiver(post_delete, sender='write_up.GroupWriting')
+def invalidate_event(sender, **kwargs):
+    invalidate(EVENT_KEY % kwargs.get('instance').write_up_id)
+
+
+def invalidate_event_members(sender, **kwargs):
+    """ m2m_changed receiver of closed_group_users, connected in PublicationConfig.ready """
+
+    if kwargs.get('action') not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not kwargs.get('reverse'):
+        invalidate(EVENT_KEY % kwargs.get('instance').write_up_id)
+    elif kwargs.get('pk_set'):  # user.livewriting_set.add(..), a reverse clear expires with ROLE_CACHE_TIMEOUT
+        write_up_ids = kwargs.get('model').objects.filter(pk__in=kwargs.get('pk_set')) \
+            .values_list('write_up_id', flat=True)
+        invalidate(*[EVENT_KEY % write_up_id for write_up_id in write_up_ids])
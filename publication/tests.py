@@ -1 +1,28 @@
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from publication.models import Publication, ContributorList, LedgerEntry
+from publication.settlement import record_earnings, settle_batch
+
+
+class SettlementTest(TestCase):
+    """ Ledger entries of an event never add up to more than the event, whatever the shares """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner')
+        cls.publication = Publication.objects.create(creator=cls.owner, name='publication')  # owner share 100
+        cls.editors = [User.objects.create(username='editor-%d' % i) for i in range(2)]
+        for editor in cls.editors:
+            ContributorList.objects.create(contributor=editor, publication=cls.publication, share_XP=60,
+                                           share_money=60, level='E')
+
+    def test_shares_above_100_are_scaled_down(self):
+        record_earnings([{'event_key': 'event', 'publication_id': self.publication.pk, 'XP': 100, 'money': 100}])
+        settle_batch()
+
+        entries = dict((entry.user_id, (entry.XP, entry.money)) for entry in LedgerEntry.objects.all())
+        # 100 / 220 -> 45 + rounding remainder, 60 / 220 -> 27
+        self.assertEqual(entries, {self.owner.pk: (46, 46), self.editors[0].pk: (27, 27),
+                                   self.editors[1].pk: (27, 27)})
+        self.assertEqual(Publication.objects.get(pk=self.publication.pk).XP, 100)
@@ -9,6 +9,8 @@ from cities_light.models import Region, Country, City
 
 
 class UserProfile(models.Model):
+    """ XP, money -> settled earnings of the user over all contributions, see publication.settlement """
+
     user = models.OneToOneField(User)
     dob = models.DateField(blank=True, null=True)
     GENDER = (
@@ -19,6 +21,8 @@ class UserProfile(models.Model):
     area_city = models.ForeignKey(City, blank=True, null=True)  # TODO: test if all cities data is available/needed
     area_state = models.ForeignKey(Region, blank=True, null=True)
     area_country = models.ForeignKey(Country, blank=True, null=True)
+    XP = models.BigIntegerField(default=0)
+    money = models.BigIntegerField(default=0)
     update_time = models.DateTimeField(auto_now=True)
 
     def __unicode__(self):
@@ -0,0 +1 @@
+default_app_config = 'write_up.apps.WriteupConfig'
@@ -1,7 +1,16 @@
 from __future__ import unicode_literals
 
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class WriteupConfig(AppConfig):
     name = 'write_up'
+
+    def ready(self):
+        from write_up.models import set_text_storage
+        from write_up.search import create_search_indexes
+        from write_up.trending import create_epoch
+        post_migrate.connect(create_search_indexes, sender=self)
+        post_migrate.connect(create_epoch, sender=self)
+        post_migrate.connect(set_text_storage, sender=self)
@@ -0,0 +1,176 @@
+"""
+Cover images of write ups.
+
+Covers are stored under the sha256 of their content (Covers/ab/cd/abcd...ef.jpg), so uploading
+the same image again reuses the stored file. After a new cover is committed its derived sizes
+(COVER_SIZES) are written next to it in every available COVER_FORMATS by a process pool, off the
+request thread, and the write up is marked 'cover_ready'. Templates get the derived URLs with the
+'cover_url' and 'cover_srcset' tags of the 'covers' library, the original is served until then.
+"""
+
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import threading
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import connection
+from django.utils.deconstruct import deconstructible
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# extension -> Pillow format name
+FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG', 'png': 'PNG'}
+
+CONTENT_NAME_RE = re.compile(r'^Covers/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.\w+$')
+
+_pool = None
+
+
+_saving = threading.local()
+
+
+class CoverExists(Exception):
+    pass
+
+
+@deconstructible
+class CoverStorage(FileSystemStorage):
+    """ Names are content hashes, a name that already exists holds the same bytes and is not written again """
+
+    def get_available_name(self, name, max_length=None):
+        if getattr(_saving, 'name', None) == name:
+            # FileSystemStorage._save got EEXIST from a concurrent upload of the same image and asks for
+            # another name, the same name again would loop forever
+            raise CoverExists(name)
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return name
+        _saving.name = name
+        try:
+            return super(CoverStorage, self)._save(name, content)
+        except CoverExists:
+            return name
+        finally:
+            _saving.name = None
+
+
+cover_storage = CoverStorage()
+
+
+def get_content_hash(content):
+    sha = hashlib.sha256()
+    for chunk in content.chunks():
+        sha.update(chunk)
+    content.seek(0)
+    return sha.hexdigest()
+
+
+def get_cover_name(content_hash, ext):
+    return 'Covers/%s/%s/%s.%s' % (content_hash[:2], content_hash[2:4], content_hash, ext.lower())
+
+
+def get_sizes():
+    return getattr(settings, 'COVER_SIZES', {'small': 160, 'medium': 480, 'large': 1200})
+
+
+def get_formats():
+    """ COVER_FORMATS which the installed Pillow can write """
+
+    Image.init()
+    return [ext for ext in getattr(settings, 'COVER_FORMATS', ('webp', 'jpg')) if FORMATS.get(ext) in Image.SAVE]
+
+
+def get_derived_name(name, width, ext):
+    return '%s-%d.%s' % (os.path.splitext(name)[0], width, ext)
+
+
+def make_derivatives(path, widths, formats, quality):
+    """
+    Runs in a pool worker (no database access), writes every width/format of the image at 'path'
+    which does not exist yet. Returns False if the image could not be processed.
+    """
+
+    try:
+        image = Image.open(path)
+        image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if image.mode in ('LA', 'P') else 'RGB')
+        for width in widths:
+            resized = image
+            if image.size[0] > width:
+                resized = image.resize((width, int(round(image.size[1] * width / float(image.size[0])))),
+                                       Image.LANCZOS)
+            for ext in formats:
+                target = get_derived_name(path, width, ext)
+                if os.path.exists(target):
+                    continue
+                out = resized.convert('RGB') if FORMATS[ext] == 'JPEG' and resized.mode != 'RGB' else resized
+                out.save(target + '.tmp', FORMATS[ext], quality=quality)
+                os.rename(target + '.tmp', target)
+        return True
+    except Exception:
+        logger.exception("Cover derivatives of %s failed", path)
+        return False
+
+
+def get_task(name):
+    """ arguments of make_derivatives for a stored cover """
+
+    return (cover_storage.path(name), sorted(set(get_sizes().values())), get_formats(),
+            getattr(settings, 'COVER_QUALITY', 82))
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = multiprocessing.Pool(getattr(settings, 'COVER_WORKERS', 2), maxtasksperchild=100)
+    return _pool
+
+
+def mark_ready(write_up_id, name):
+    """ only if the cover was not replaced meanwhile """
+
+    from write_up.models import WriteUpCollection  # write_up.models imports this module
+
+    try:
+        WriteUpCollection.objects.filter(pk=write_up_id, cover=name).update(cover_ready=True)
+    finally:
+        connection.close()  # called from the pool's result thread
+
+
+def schedule_derivatives(write_up_id, name):
+    """ queues the derived sizes of a committed cover, returns immediately """
+
+    def done(success):
+        if success:
+            mark_ready(write_up_id, name)
+
+    get_pool().apply_async(make_derivatives, get_task(name), callback=done)
+
+
+def get_cover_url(write_up, size='medium', ext=None):
+    """ URL of a derived size of the cover, the original until it is processed, '' without a cover """
+
+    if not write_up.cover:
+        return ''
+    formats = get_formats()
+    width = get_sizes().get(size)
+    if not write_up.cover_ready or width is None or not formats:
+        return write_up.cover.url
+    return cover_storage.url(get_derived_name(write_up.cover.name, width, ext if ext in formats else formats[0]))
+
+
+def get_cover_srcset(write_up, ext=None):
+    formats = get_formats()
+    if not write_up.cover or not write_up.cover_ready or not formats:
+        return ''
+    ext = ext if ext in formats else formats[0]
+    return ', '.join('%s %dw' % (cover_storage.url(get_derived_name(write_up.cover.name, width, ext)), width)
+                     for width in sorted(set(get_sizes().values())))
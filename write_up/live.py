@@ -0,0 +1,293 @@
+"""
+Real-time channel for LiveWriting, served by the 'run_live_writing' command.
+
+The working copy of every open LiveWriting text is kept in memory and changed by patches,
+viewers receive the patches as Server-Sent Events and the text is checkpointed to BaseDesign
+every LIVE_WRITING_CHECKPOINT_SECONDS instead of on every keystroke batch. The search vector of
+the text is only rebuilt when its session ends (no viewer left) or the server stops.
+
+GET  /live/<write up uuid>/stream -> text/event-stream, a 'snapshot' event {'version': .., 'text': ..}
+                                     followed by 'patch' events {'version': .., 'ops': [..]}
+POST /live/<write up uuid>/patch  -> JSON {'version': <version the ops apply to>, 'ops': [..]}
+                                     replies 409 with the current version if the writer is behind
+
+ops -> [[position, delete count, 'inserted text'], ...] applied in order
+
+Anyone can watch, patches need the Django session cookie of a user allowed to write to the
+write up (publication.roles.can_write).
+
+The server is a threading HTTP server from the standard library (one thread per connection,
+streams block on their viewer queue), so it runs wherever the project runs.
+"""
+
+import json
+import logging
+import socket
+import threading
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections, connections, transaction
+from django.utils import timezone
+from django.utils.six.moves import BaseHTTPServer, http_cookies, queue, socketserver
+
+from publication.roles import can_write
+from write_up.models import BaseDesign, LiveWriting, get_text_hash
+from write_up.search import update_search_vector
+
+logger = logging.getLogger(__name__)
+
+
+class PatchError(Exception):
+    pass
+
+
+class VersionConflict(PatchError):
+    pass
+
+
+def apply_ops(text, ops):
+    for position, delete, insert in ops:
+        if not (0 <= position <= len(text)) or delete < 0 or position + delete > len(text):
+            raise PatchError("Operation out of range")
+        text = text[:position] + insert + text[position + delete:]
+    return text
+
+
+def format_event(event, data):
+    return ("event: %s\ndata: %s\n\n" % (event, json.dumps(data))).encode('utf-8')
+
+
+class LiveSession(object):
+    """ Working copy of one LiveWriting, shared by all its viewers and writers """
+
+    def __init__(self, live_writing):
+        self.write_up = live_writing.write_up
+        self.text_id = live_writing.text_id
+        self.text = live_writing.text.text
+        self.version = 0
+        self.checkpointed_version = 0
+        self.indexed_version = 0
+        self.viewers = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        viewer = queue.Queue(maxsize=getattr(settings, 'LIVE_WRITING_VIEWER_QUEUE', 100))
+        viewer.lagging = False
+        with self.lock:
+            viewer.put_nowait(format_event('snapshot', {'version': self.version, 'text': self.text}))
+            self.viewers.add(viewer)
+        return viewer
+
+    def unsubscribe(self, viewer):
+        with self.lock:
+            self.viewers.discard(viewer)
+
+    def can_write(self, user_id):
+        return user_id is not None and can_write(User(pk=user_id), self.write_up)
+
+    def apply_patch(self, version, ops):
+        with self.lock:
+            if version != self.version:
+                raise VersionConflict("Patch is based on version %s, current is %s" % (version, self.version))
+            self.text = apply_ops(self.text, ops)
+            self.version += 1
+            self.broadcast(format_event('patch', {'version': self.version, 'ops': ops}))
+            return self.version
+
+    def broadcast(self, event):
+        """ caller holds the lock """
+
+        for viewer in list(self.viewers):
+            try:
+                viewer.put_nowait(event)
+            except queue.Full:
+                # a lagging viewer is dropped, on reconnect it starts again from a snapshot
+                self.viewers.discard(viewer)
+                viewer.lagging = True
+
+    @property
+    def dirty(self):
+        return self.version != self.checkpointed_version
+
+
+class LiveChannel(object):
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.session_store = import_module(settings.SESSION_ENGINE).SessionStore
+
+    def get_session(self, write_up_uuid):
+        with self.lock:
+            session = self.sessions.get(write_up_uuid)
+        if session is not None:
+            return session
+        return LiveSession(LiveWriting.objects.select_related('write_up', 'text')
+                           .defer('write_up__search_vector', 'text__search_vector').get(write_up__uuid=write_up_uuid))
+
+    def attach(self, write_up_uuid, session):
+        """
+        session registered for the uuid, caller holds self.lock. A concurrent first request may have
+        registered its own copy meanwhile, and checkpoint may have dropped an idle one.
+        """
+
+        return self.sessions.setdefault(write_up_uuid, session)
+
+    def get_user_id(self, session_key):
+        user_id = self.session_store(session_key).get('_auth_user_id') if session_key else None
+        return int(user_id) if user_id else None
+
+    @staticmethod
+    def save_checkpoint(text_id, text):
+        with transaction.atomic():
+            BaseDesign.objects.filter(pk=text_id).update(text=text, text_hash=get_text_hash(text),
+                                                         update_time=timezone.now())
+
+    def checkpoint(self, final=False):
+        """ saves the changed texts, ended sessions are dropped and their text indexed (all of them if final) """
+
+        with self.lock:
+            sessions = list(self.sessions.items())
+        for write_up_uuid, session in sessions:
+            with session.lock:
+                version, text = session.version, session.text
+            if version != session.checkpointed_version:
+                try:
+                    self.save_checkpoint(session.text_id, text)
+                    session.checkpointed_version = version
+                except Exception:
+                    logger.exception("Checkpoint of live writing %s failed", write_up_uuid)
+            with self.lock, session.lock:
+                ended = final or (not session.viewers and not session.dirty)
+                if ended and not session.dirty:
+                    self.sessions.pop(write_up_uuid, None)
+            if ended and session.indexed_version != session.checkpointed_version:
+                try:
+                    update_search_vector(BaseDesign, [session.text_id])
+                    session.indexed_version = session.checkpointed_version
+                except Exception:
+                    logger.exception("Search vector of live writing %s not updated", write_up_uuid)
+
+    def checkpoint_forever(self):
+        close_old_connections()
+        while not self.stopped.wait(getattr(settings, 'LIVE_WRITING_CHECKPOINT_SECONDS', 10)):
+            self.checkpoint()
+        connections.close_all()
+
+    def patch(self, write_up_uuid, session, handler):
+        if handler.headers.get('Content-Type', '').split(';')[0] != 'application/json':
+            return handler.respond(415, {'error': 'application/json expected'})
+        length = int(handler.headers.get('Content-Length') or 0)
+        if length > getattr(settings, 'LIVE_WRITING_MAX_PATCH_BYTES', 64 * 1024):
+            return handler.respond(413, {'error': 'patch too large'})
+        body = handler.rfile.read(length) if length else b''
+        morsel = http_cookies.SimpleCookie(handler.headers.get('Cookie', '')).get(settings.SESSION_COOKIE_NAME)
+        if not session.can_write(self.get_user_id(morsel.value if morsel else None)):
+            return handler.respond(403, {'error': 'User can not write to this event'})
+        try:
+            data = json.loads(body.decode('utf-8'))
+            with self.lock:  # not dropped by checkpoint between attaching and patching
+                session = self.attach(write_up_uuid, session)
+                version = session.apply_patch(data['version'], data['ops'])
+        except VersionConflict as e:
+            return handler.respond(409, {'error': str(e), 'version': session.version})
+        except (PatchError, ValueError, KeyError, TypeError) as e:
+            return handler.respond(400, {'error': str(e)})
+        handler.respond(200, {'version': version})
+
+    def stream(self, write_up_uuid, session, handler):
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/event-stream')
+        handler.send_header('Cache-Control', 'no-cache')
+        handler.end_headers()
+        handler.wfile.flush()
+        connections.close_all()  # a stream may stay open for hours, it does not need the database
+
+        with self.lock:
+            session = self.attach(write_up_uuid, session)
+            viewer = session.subscribe()
+        keepalive = getattr(settings, 'LIVE_WRITING_KEEPALIVE_SECONDS', 15)
+        try:
+            while not self.stopped.is_set():
+                try:
+                    event = viewer.get(timeout=keepalive)
+                except queue.Empty:
+                    event = b": keepalive\n\n"
+                if viewer.lagging:
+                    return
+                handler.wfile.write(event)
+                handler.wfile.flush()
+        finally:
+            session.unsubscribe(viewer)
+
+    def handle(self, handler, method):
+        close_old_connections()
+        try:
+            parts = handler.path.split('?')[0].strip('/').split('/')
+            if len(parts) != 3 or parts[0] != 'live':
+                return handler.respond(404, {'error': 'not found'})
+            try:
+                session = self.get_session(parts[1])
+            except (LiveWriting.DoesNotExist, ValidationError, ValueError):
+                return handler.respond(404, {'error': 'not found'})
+
+            if method == 'GET' and parts[2] == 'stream':
+                self.stream(parts[1], session, handler)
+            elif method == 'POST' and parts[2] == 'patch':
+                self.patch(parts[1], session, handler)
+            else:
+                handler.respond(405, {'error': 'method not allowed'})
+        except (socket.error, IOError):
+            pass  # client went away
+        except Exception:
+            logger.exception("Live writing request failed")
+        finally:
+            connections.close_all()
+
+    def serve(self, host, port):
+        channel = self
+
+        class Handler(LiveRequestHandler):
+            def do_GET(self):
+                channel.handle(self, 'GET')
+
+            def do_POST(self):
+                channel.handle(self, 'POST')
+
+        server = LiveServer((host, port), Handler)
+        checkpointer = threading.Thread(target=self.checkpoint_forever, name='live-writing-checkpoint')
+        checkpointer.daemon = True
+        checkpointer.start()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stopped.set()
+            server.server_close()
+            checkpointer.join()
+            self.checkpoint(final=True)
+
+
+class LiveServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class LiveRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.0'  # one request per connection, streams end when the connection closes
+
+    def respond(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from write_up.models import WriteUpCollection, BaseDesign
+from write_up.search import update_search_vector
+
+
+class Command(BaseCommand):
+    help = 'Computes the search vectors of existing write ups and texts in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--all', action='store_true', help='Recompute every row, not only missing vectors')
+
+    def handle(self, *args, **options):
+        for model in (WriteUpCollection, BaseDesign):
+            rows = model.objects.all()
+            if not options['all']:
+                rows = rows.filter(search_vector__isnull=True)
+            last, done = 0, 0
+            while True:
+                pks = list(rows.filter(id__gt=last).order_by('id').values_list('id', flat=True)[:options['batch_size']])
+                if not pks:
+                    break
+                with transaction.atomic():
+                    update_search_vector(model, pks)
+                last = pks[-1]
+                done += len(pks)
+                self.stdout.write("%s: %d rows" % (model.__name__, done))
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from essential.utils import atomic_with_retry
+from write_up.models import BaseDesign
+
+
+class Command(BaseCommand):
+    help = 'Records autosaved texts idle for longer than AUTOSAVE_IDLE_WINDOW in revision history'
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'AUTOSAVE_IDLE_WINDOW', 60))
+        pending = BaseDesign.objects.filter(pending_revision=True, update_time__lt=cutoff)
+        committed = 0
+        for pk in pending.values_list('id', flat=True).iterator():
+            committed += self.commit(pk, cutoff)
+        self.stdout.write("%d pending revisions recorded" % committed)
+
+    @atomic_with_retry()
+    def commit(self, pk, cutoff):
+        """ re-checked under the row lock, the text may have been saved again meanwhile """
+
+        if not BaseDesign.objects.select_for_update().filter(pk=pk, pending_revision=True,
+                                                             update_time__lt=cutoff).exists():
+            return 0
+        BaseDesign.objects.record_pending(pk)
+        return 1
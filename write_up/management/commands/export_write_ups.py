@@ -0,0 +1,34 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from write_up.transfer import MODELS, Throughput, export_table, get_file_name, write_manifest
+
+
+class Command(BaseCommand):
+    help = 'Streams write up collections with their units, texts and revisions to gzip JSONL or CSV files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl')
+        parser.add_argument('--uuid', action='append', default=[],
+                            help='Export only this collection, may be repeated. Default is the whole library')
+
+    def handle(self, *args, **options):
+        directory, file_format = options['directory'], options['format']
+        if os.path.exists(os.path.join(directory, 'manifest.json')):
+            raise CommandError("%s already contains an export" % directory)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        where, params = ('w.uuid = ANY(%s::uuid[])', [options['uuid']]) if options['uuid'] else ('TRUE', [])
+
+        throughput = Throughput(self.stdout.write)
+        counts = {}
+        with transaction.atomic():  # one snapshot for all tables
+            for model in MODELS:
+                path = os.path.join(directory, get_file_name(model, file_format))
+                counts[model] = export_table(model, file_format, path, where, params)
+                throughput.step(model._meta.label, counts[model])
+        write_manifest(directory, file_format, counts)
+        throughput.total()
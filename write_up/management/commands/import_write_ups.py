@@ -0,0 +1,41 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from write_up.transfer import (MODELS, Throughput, count_existing_uuids, insert_table, load_table, read_manifest,
+                               resolve_external)
+
+
+class Command(BaseCommand):
+    help = 'Bulk loads an export of export_write_ups with new ids, preserving the UUIDs of the collections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--default-user', type=int,
+                            help='User id for revisions whose user does not exist in this database')
+
+    def handle(self, *args, **options):
+        directory = options['directory']
+        manifest = read_manifest(directory)
+        files = dict((table['model'], table['file']) for table in manifest['tables'])
+
+        throughput = Throughput(self.stdout.write)
+        with transaction.atomic(), connection.cursor() as cursor:
+            for model in MODELS:
+                path = os.path.join(directory, files[model._meta.label_lower])
+                throughput.step('load %s' % model._meta.label, load_table(cursor, model, manifest['format'], path))
+
+            existing = count_existing_uuids(cursor)
+            if existing:
+                raise CommandError("%d write up collections of the export already exist" % existing)
+            try:
+                for model in MODELS:
+                    resolve_external(cursor, model, options['default_user'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+            for model in MODELS:
+                throughput.step('insert %s' % model._meta.label, insert_table(cursor, model))
+        throughput.total()
+        self.stdout.write("Run backfill_search_vectors to index the imported write ups")
@@ -0,0 +1,124 @@
+import json
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.six.moves import http_client
+
+
+def viewer(host, port, write_up_uuid, received, ready, done):
+    """ records the arrival time of every patch version """
+
+    sock = socket.create_connection((host, port))
+    try:
+        sock.sendall(("GET /live/%s/stream HTTP/1.0\r\nHost: %s\r\n\r\n" % (write_up_uuid, host)).encode('latin-1'))
+        stream = sock.makefile('rb')
+        while stream.readline().strip():
+            pass  # response headers
+        sock.settimeout(1)
+        ready.release()
+        event = None
+        while not done.is_set():
+            try:
+                line = stream.readline().decode('utf-8')
+            except socket.timeout:
+                continue
+            if not line:
+                break
+            if line.startswith('event:'):
+                event = line[6:].strip()
+            elif line.startswith('data:') and event == 'patch':
+                received.append((json.loads(line[5:])['version'], time.time()))
+    except socket.error:
+        ready.release()
+    finally:
+        sock.close()
+
+
+def post_patch(host, port, write_up_uuid, session_key, version, ops):
+    connection = http_client.HTTPConnection(host, port)
+    try:
+        connection.request('POST', '/live/%s/patch' % write_up_uuid, json.dumps({'version': version, 'ops': ops}),
+                           {'Content-Type': 'application/json',
+                            'Cookie': '%s=%s' % (settings.SESSION_COOKIE_NAME, session_key)})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read().decode('utf-8'))
+    finally:
+        connection.close()
+
+
+def run_session(host, port, write_up_uuid, session_key, viewers, patches, interval, results):
+    received = [[] for _ in range(viewers)]
+    ready = threading.Semaphore(0)
+    done = threading.Event()
+    threads = [threading.Thread(target=viewer, args=(host, port, write_up_uuid, received[i], ready, done))
+               for i in range(viewers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for _ in range(viewers):
+        ready.acquire()
+
+    sent = {}
+    version = None
+    while len(sent) < patches:
+        status, data = post_patch(host, port, write_up_uuid, session_key,
+                                  version if version is not None else -1, [[0, 0, 'x']])
+        if status == 409:
+            version = data['version']
+            continue
+        if status != 200:
+            done.set()
+            results.append(CommandError("Patch rejected with %s: %s" % (status, data)))
+            return
+        version = data['version']
+        sent[version] = time.time()
+        time.sleep(interval)
+
+    time.sleep(1)
+    done.set()
+    for thread in threads:
+        thread.join()
+
+    latencies = [(at - sent[v]) * 1000 for events in received for v, at in events if v in sent]
+    results.append((latencies, viewers * patches))
+
+
+class Command(BaseCommand):
+    help = 'Load tests a running live writing channel with simulated viewers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('write_ups', nargs='+', help='uuid of the LiveWriting write ups, one session each')
+        parser.add_argument('--session-key', required=True, help='Django session key of a user allowed to write')
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--viewers', type=int, default=300, help='Simulated viewers per session')
+        parser.add_argument('--patches', type=int, default=200, help='Patches sent per session')
+        parser.add_argument('--interval', type=float, default=0.05, help='Seconds between patches')
+
+    def handle(self, *args, **options):
+        started = time.time()
+        results = []
+        sessions = [threading.Thread(target=run_session, args=(
+            options['host'], options['port'], write_up_uuid, options['session_key'], options['viewers'],
+            options['patches'], options['interval'], results)) for write_up_uuid in options['write_ups']]
+        for session in sessions:
+            session.start()
+        for session in sessions:
+            session.join()
+        elapsed = time.time() - started
+
+        for result in results:
+            if isinstance(result, CommandError):
+                raise result
+        latencies = sorted(latency for session_latencies, _ in results for latency in session_latencies)
+        expected = sum(expected for _, expected in results)
+        if not latencies:
+            raise CommandError("No patch reached any viewer")
+        self.stdout.write("%d sessions x %d viewers, %d/%d patch deliveries in %.1fs" % (
+            len(results), options['viewers'], len(latencies), expected, elapsed))
+        self.stdout.write("Broadcast latency: p50 %.1fms, p95 %.1fms, p99 %.1fms, max %.1fms" % (
+            latencies[len(latencies) // 2], latencies[int(0.95 * (len(latencies) - 1))],
+            latencies[int(0.99 * (len(latencies) - 1))], latencies[-1]))
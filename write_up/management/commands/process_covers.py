@@ -0,0 +1,45 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from write_up.covers import (CONTENT_NAME_RE, cover_storage, get_content_hash, get_cover_name, get_pool, get_task,
+                             make_derivatives)
+from write_up.models import WriteUpCollection
+
+
+class Command(BaseCommand):
+    help = 'Moves covers to content addressed names and writes their derived sizes with the cover process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Also covers already marked ready, e.g. after adding COVER_SIZES')
+
+    def handle(self, *args, **options):
+        write_ups = WriteUpCollection.objects.exclude(cover='').exclude(cover__isnull=True)
+        if not options['all']:
+            write_ups = write_ups.filter(cover_ready=False)
+
+        names = {}
+        for pk, name in write_ups.values_list('id', 'cover').iterator():
+            if not CONTENT_NAME_RE.match(name):
+                with cover_storage.open(name) as content:
+                    new_name = cover_storage.save(
+                        get_cover_name(get_content_hash(content), os.path.splitext(name)[1][1:] or 'jpg'), content)
+                WriteUpCollection.objects.filter(pk=pk, cover=name).update(cover=new_name)
+                name = new_name
+            names.setdefault(name, []).append(pk)
+
+        pool = get_pool()
+        results = pool.imap_unordered(run_task, [(name, get_task(name)) for name in names])
+        done = failed = 0
+        for name, success in results:
+            if not success:
+                failed += 1
+                continue
+            done += WriteUpCollection.objects.filter(pk__in=names[name], cover=name).update(cover_ready=True)
+        self.stdout.write("%d write ups ready, %d covers failed" % (done, failed))
+
+
+def run_task(args):
+    name, task = args
+    return name, make_derivatives(*task)
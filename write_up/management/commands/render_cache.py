@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from write_up.models import WriteUpCollection, BaseDesign
+from write_up.rendering import get_metrics, reset_metrics, warm
+
+
+class Command(BaseCommand):
+    help = 'Warms the rendered html cache with the texts of the trending write ups and shows its hit and miss counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--warm', type=int, default=0, metavar='N', help='Render the texts of the top N write ups')
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--reset-metrics', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['warm']:
+            write_ups = list(WriteUpCollection.objects.trending().values_list('id', flat=True)[:options['warm']])
+            texts = BaseDesign.objects.filter(
+                Q(unit__write_up__in=write_ups) | Q(livewriting__write_up__in=write_ups) |
+                Q(groupwritingtext__article__write_up__in=write_ups)).distinct().only('text', 'text_hash')
+            last, rendered, seen = 0, 0, 0
+            while True:
+                batch = list(texts.filter(id__gt=last).order_by('id')[:options['batch_size']])
+                if not batch:
+                    break
+                rendered += warm(batch)
+                seen += len(batch)
+                last = batch[-1].pk
+            self.stdout.write("Warmed %d texts of %d write ups, %d were rendered" % (seen, len(write_ups), rendered))
+
+        metrics = get_metrics()
+        self.stdout.write("hits %(hit)d, misses %(miss)d, renders %(render)d, waits %(wait)d" % metrics)
+        if metrics['hit_ratio'] is not None:
+            self.stdout.write("hit ratio %.1f%%" % (metrics['hit_ratio'] * 100))
+        if options['reset_metrics']:
+            reset_metrics()
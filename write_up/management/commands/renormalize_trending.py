@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from write_up.trending import renormalize
+
+
+class Command(BaseCommand):
+    help = 'Moves the trending epoch to now and scales all trending scores down, run at least daily'
+
+    def handle(self, *args, **options):
+        scale = renormalize()
+        self.stdout.write("Trending scores scaled by %g" % scale)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Serves the real-time LiveWriting channel (write_up.live)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+
+    def handle(self, *args, **options):
+        from write_up.live import LiveChannel
+
+        self.stdout.write("Live writing channel on %s:%s" % (options['host'], options['port']))
+        LiveChannel().serve(options['host'], options['port'])
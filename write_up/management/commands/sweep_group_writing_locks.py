@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from write_up.models import GroupWriting
+
+
+class Command(BaseCommand):
+    help = 'Unlocks Group writing articles whose lease expired and voids their lock sessions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep sweeping every INTERVAL seconds instead of exiting')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            swept = GroupWriting.objects.sweep_expired_locks()
+            if swept:
+                self.stdout.write("%d expired locks released" % swept)
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -1,26 +1,92 @@
 from __future__ import unicode_literals
 
+import hashlib
 import uuid
-import os
-import time
+from datetime import timedelta
 
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction, connection
+from django.db.models import F, Func, Value
+from django.utils import timezone
 
-from publication.models import Publication
+from admin_custom.custom_errors import GroupWritingLockError
+from essential.models import GroupWritingLockHistory
+from essential.utils import atomic_with_retry
+from publication.roles import can_write, get_owned_publication_id
+from write_up.covers import cover_storage, get_content_hash, get_cover_name, schedule_derivatives
+from write_up.search import (TSVectorField, SearchVectorManager, get_config, get_save_fields, to_prefix_query,
+                             update_search_vector)
+from write_up.signals import revision_saved
 
 
 def get_file_path(instance, filename):
-    if instance.collection_type == 'B':
-        path = 'Covers/Book' + time.strftime('/%Y/%m/%d/')
-    elif instance.collection_type == 'M':
-        path = 'Covers/Magazine' + time.strftime('/%Y/%m/%d/')
-    else:
-        return False
+    """ Covers of every collection type are stored under their content hash (see write_up.covers) """
 
     ext = filename.split('.')[-1]
-    filename = "%s.%s" % (instance.uuid, ext)
-    return os.path.join(path, filename)
+    return get_cover_name(get_content_hash(instance.cover.file), ext)
+
+
+SEARCH_SQL = """
+WITH q AS (SELECT to_tsquery(%(config)s::regconfig, %(query)s) AS query),
+texts AS (
+    SELECT b.id, ts_rank_cd(b.search_vector, q.query) AS rank FROM {base_design} b, q
+    WHERE b.search_vector @@ q.query
+),
+hits AS (
+    SELECT w.id, ts_rank_cd(w.search_vector, q.query) AS rank FROM {write_up} w, q
+    WHERE w.search_vector @@ q.query
+    UNION ALL
+    SELECT u.write_up_id, t.rank FROM texts t JOIN {unit} u ON u.text_id = t.id
+    UNION ALL
+    SELECT l.write_up_id, t.rank FROM texts t JOIN {live_writing} l ON l.text_id = t.id
+    UNION ALL
+    SELECT g.write_up_id, t.rank FROM texts t JOIN {group_writing_text} gt ON gt.text_id = t.id
+    JOIN {group_writing} g ON g.id = gt.article_id
+)
+SELECT id, max(rank) AS rank FROM hits GROUP BY id ORDER BY rank DESC, id DESC LIMIT %(limit)s OFFSET %(offset)s
+"""
+
+
+class WriteUpCollectionManager(SearchVectorManager):
+    """
+    Manager for WriteUpCollection model
+
+    search -> one page of write ups matching 'query' in their title, description or any of
+    their texts (Unit, LiveWriting, GroupWritingText), best first:
+    {'write_ups': [<WriteUpCollection>, ...], 'has_next': bool}, each write up has 'search_rank'.
+    The last word of the query is matched as a prefix.
+    """
+
+    def search(self, query, page=1, limit=None):
+        limit = limit or getattr(settings, 'SEARCH_PAGE_SIZE', 20)
+        page = max(page, 1)
+        query = to_prefix_query(query)
+        if not query:
+            return {'write_ups': [], 'has_next': False}
+
+        tables = dict((name, model._meta.db_table) for name, model in (
+            ('write_up', WriteUpCollection), ('base_design', BaseDesign), ('unit', Unit),
+            ('live_writing', LiveWriting), ('group_writing', GroupWriting), ('group_writing_text', GroupWritingText)))
+        with connection.cursor() as cursor:
+            cursor.execute(SEARCH_SQL.format(**tables), {'config': get_config(), 'query': query,
+                                                         'limit': limit + 1, 'offset': (page - 1) * limit})
+            ranks = cursor.fetchall()
+
+        write_ups = self.get_queryset().select_related('user', 'publication').in_bulk([pk for pk, _ in ranks[:limit]])
+        for pk, rank in ranks[:limit]:
+            if pk in write_ups:
+                write_ups[pk].search_rank = rank
+        return {'write_ups': [write_ups[pk] for pk, _ in ranks[:limit] if pk in write_ups],
+                'has_next': len(ranks) > limit}
+
+    def trending(self, collection_type=None):
+        """ Write ups by decayed trending score (see write_up.trending), optionally of one collection_type """
+
+        write_ups = self.get_queryset()
+        if collection_type:
+            write_ups = write_ups.filter(collection_type=collection_type)
+        return write_ups.order_by('-trending_score', '-id')
 
 
 class WriteUpCollection(models.Model):
@@ -35,8 +101,15 @@ class WriteUpCollection(models.Model):
 
     Collection will be composed of units. It can be a book or Magazine. By default for every user
     there will be a write up extending to a collection  marked as 'Independent'.
+
+    up_votes, down_votes -> maintained by VoteWriteUp.objects, never set directly
+    search_vector -> weighted title (A) and description (B), rewritten on every save (see write_up.search)
+    trending_score -> decayed sum of votes, comments and views, maintained by write_up.trending
+    cover_ready -> derived sizes of the cover are written, set by write_up.covers
     """
 
+    SEARCH_WEIGHTS = (('title', 'A'), ('description', 'B'))
+
     user = models.ForeignKey(User, null=True)
     publication = models.ForeignKey('publication.Publication',
                                     null=True)
@@ -50,34 +123,70 @@ class WriteUpCollection(models.Model):
             )
     collection_type = models.CharField(max_length=1, choices=TYPE)
     description = models.TextField()
-    cover = models.ImageField(upload_to=get_file_path, null=True, blank=True)
+    cover = models.ImageField(upload_to=get_file_path, storage=cover_storage, null=True, blank=True)
+    cover_ready = models.BooleanField(default=False)
+    up_votes = models.PositiveIntegerField(default=0)
+    down_votes = models.PositiveIntegerField(default=0)
+    search_vector = TSVectorField()
+    trending_score = models.FloatField(default=0)
     create_time = models.DateTimeField(auto_now_add=True)
     update_time = models.DateTimeField(auto_now=True)
 
+    objects = WriteUpCollectionManager()
+
+    class Meta:
+        index_together = [('trending_score', 'id'), ('collection_type', 'trending_score', 'id')]
+
     def __unicode__(self):
         return self.title
 
     def save(self, *args, **kwargs):
         if not self.validate():
             raise AssertionError
+        new_cover = bool(self.cover) and not self.cover._committed
+        if new_cover:
+            self.cover_ready = False
+        kwargs['update_fields'] = get_save_fields(self, kwargs)
         super(WriteUpCollection, self).save(*args, **kwargs)
+        if new_cover:
+            pk, name = self.pk, self.cover.name
+            transaction.on_commit(lambda: schedule_derivatives(pk, name))
+        if set(kwargs.get('update_fields') or ('title',)) & set(('title', 'description')):
+            update_search_vector(WriteUpCollection, [self.pk])
 
     def validate(self):
-        if self.user and self.publication:
-            if self.publication == Publication.objects.get(creator=self.user):
-                return True
-            return False
-        elif self.user or self.publication:
+        if self.user_id and self.publication_id:
+            return get_owned_publication_id(self.user_id) == self.publication_id
+        elif self.user_id or self.publication_id:
             return True
         return False
 
 
+class TrendingEpoch(models.Model):
+    """
+    Single row (id 1), reference time of all trending scores, moved by 'renormalize_trending'
+    previous_epoch, renormalized_id -> set while a renormalization runs, see write_up.trending
+    """
+
+    epoch = models.DateTimeField()
+    previous_epoch = models.DateTimeField(null=True)
+    renormalized_id = models.IntegerField(null=True)
+
+    def __unicode__(self):
+        return str(self.epoch)
+
+
 class ContributorList(models.Model):
-    """ List of Contributor for each write up """
+    """
+    List of Contributor for each write up
+    earned_XP, earned_money -> settled earnings of the contributor here, see publication.settlement
+    """
 
     contributor = models.ForeignKey(User, related_name='write_up_contributors')
     share_XP = models.PositiveSmallIntegerField(default=0)
     share_money = models.PositiveSmallIntegerField(default=0)
+    earned_XP = models.BigIntegerField(default=0)
+    earned_money = models.BigIntegerField(default=0)
     write_up = models.ForeignKey(WriteUpCollection, null=True)
     create_time = models.DateTimeField(auto_now_add=True)
     update_time = models.DateTimeField(auto_now=True)
@@ -89,34 +198,226 @@ class ContributorList(models.Model):
         return "'%s' of '%s'" % (self.contributor, self.write_up)
 
 
+def get_text_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class BaseDesignManager(SearchVectorManager):
+    """
+    Manager for BaseDesign model
+
+    save_text -> writes the text of an existing BaseDesign and records revisions, returns False
+    if nothing was written.
+
+    Unchanged texts (same hash and title) are not written at all. Autosaves of the same user
+    within AUTOSAVE_IDLE_WINDOW seconds of each other are collapsed into one revision: the text is
+    only marked as 'pending_revision' and is recorded when the burst ends, i.e. when another user
+    saves, the same user saves after the window, the user saves explicitly or the
+    'commit_pending_revisions' command finds it idle. The search vector is rewritten together with
+    the revision, autosaves are not indexed.
+    """
+
+    def is_burst_over(self, last_editor_id, update_time, user):
+        window = timedelta(seconds=getattr(settings, 'AUTOSAVE_IDLE_WINDOW', 60))
+        return last_editor_id != getattr(user, 'pk', None) or update_time < timezone.now() - window
+
+    def record_pending(self, pk):
+        """ records the current text of a BaseDesign with a pending revision, caller holds the row lock """
+
+        base_design = self.get_queryset().get(pk=pk)
+        revision_saved.send(sender=BaseDesign, instance=base_design, user=base_design.last_editor,
+                            text=base_design.text, title=base_design.title)
+        self.get_queryset().filter(pk=pk).update(pending_revision=False)
+        update_search_vector(BaseDesign, [pk])
+
+    @atomic_with_retry()
+    def save_text(self, instance, user, autosave=False):
+        current = self.get_queryset().select_for_update().filter(pk=instance.pk) \
+            .values('text_hash', 'title', 'pending_revision', 'last_editor_id', 'update_time').get()
+        text_hash = get_text_hash(instance.text)
+        if current['text_hash'] == text_hash and current['title'] == instance.title and (
+                autosave or not current['pending_revision']):
+            return False
+
+        burst_over = self.is_burst_over(current['last_editor_id'], current['update_time'], user)
+        if current['pending_revision'] and burst_over:
+            self.record_pending(instance.pk)
+
+        instance.text_hash = text_hash
+        instance.last_editor = user
+        instance.pending_revision = autosave
+        instance.update_time = timezone.now()
+        self.get_queryset().filter(pk=instance.pk).update(
+            text=instance.text, title=instance.title, text_hash=text_hash, last_editor=user,
+            pending_revision=autosave, update_time=instance.update_time)
+        if not autosave:
+            update_search_vector(BaseDesign, [instance.pk])
+            revision_saved.send(sender=BaseDesign, instance=instance, user=user,
+                                text=instance.text, title=instance.title)
+        return True
+
+
 class BaseDesign(models.Model):
     """
     Directly patched to Revision History Model.
     Anything that is saved to this model is revised in a separate model.
-    For revisions - Save using method 'save_with_rev'
+    For revisions - Save using method 'save_with_rev', autosaves with 'save_with_rev(autosave=True)'
+    (see BaseDesignManager.save_text)
+
+    text_hash -> sha1 of text, used to skip writes of unchanged text
+    last_revision_num -> last allocated revision number, incremented under the row lock
+    pending_revision -> current text is an autosave not yet recorded in revision history
+    search_vector -> weighted title (B) and text (C), rewritten when a revision is recorded (not on autosaves)
     """
 
+    SEARCH_WEIGHTS = (('title', 'B'), ('text', 'C'))
+
     title = models.CharField(max_length=250, null=True, blank=True)
     text = models.TextField()
+    text_hash = models.CharField(max_length=40, blank=True)
+    last_editor = models.ForeignKey(User, null=True, blank=True, related_name='+')
+    last_revision_num = models.PositiveIntegerField(default=0)
+    pending_revision = models.BooleanField(default=False, db_index=True)
+    search_vector = TSVectorField()
     create_time = models.DateTimeField(auto_now_add=True)
     update_time = models.DateTimeField(auto_now=True)
 
-    def save_with_rev(self, *args, **kwargs):
-        user = kwargs.pop('user', None)  # TODO: send post save signal with user custom signal
+    objects = BaseDesignManager()
+
+    def save(self, *args, **kwargs):
+        self.text_hash = get_text_hash(self.text)
+        kwargs['update_fields'] = get_save_fields(self, kwargs)
         super(BaseDesign, self).save(*args, **kwargs)
+        if set(kwargs.get('update_fields') or ('text',)) & set(('title', 'text')):
+            update_search_vector(BaseDesign, [self.pk])
+
+    def save_with_rev(self, *args, **kwargs):
+        user = kwargs.pop('user', None)
+        autosave = kwargs.pop('autosave', False)
+        if self.pk is None:
+            with transaction.atomic():
+                self.last_editor = user
+                self.save(*args, **kwargs)
+                revision_saved.send(sender=BaseDesign, instance=self, user=user, text=self.text, title=self.title)
+            return True
+        return BaseDesign.objects.save_text(self, user, autosave)
 
     def __unicode__(self):
         return str(self.id)
 
 
+RENUMBER_UNITS_SQL = """
+UPDATE {unit} u SET position = r.num * %(gap)s
+FROM (SELECT id, row_number() OVER (ORDER BY position, id) AS num FROM {unit} WHERE write_up_id = %(write_up)s) r
+WHERE u.id = r.id
+"""
+
+
+class UnitManager(models.Manager):
+    """
+    Manager for Unit model
+
+    Units of a collection are ordered by (position, id). Positions are POSITION_GAP apart, so a
+    unit is added or moved by writing its own row only. When two neighbours have no gap left the
+    collection is renumbered in one UPDATE. Changes lock the collection row.
+
+    add -> adds a text after the unit 'after', after the last unit if 'after' is not given
+    move -> moves a unit after the unit 'after', to the start if 'after' is None
+    get_page -> one page of units in order, without their text, in format
+    {'units': [{'id': .., 'position': .., 'text_id': .., 'title': .., 'size': <bytes of text>}, ...],
+    'next': '<cursor of the next page>' or None}
+    get_text -> text of a unit, or 'length' characters of it from 'start'. Texts are stored
+    uncompressed out of line (see set_text_storage), so Postgres reads only the part asked for.
+    """
+
+    POSITION_GAP = 1024
+
+    def get_free_position(self, units, after):
+        """ position between the unit 'after' (None -> start) and the next one, None if there is no gap """
+
+        low = 0 if after is None else units.filter(pk=after).values_list('position', flat=True).get()
+        high = units.filter(position__gte=low).exclude(pk=after).order_by('position', 'id') \
+            .values_list('position', flat=True).first()
+        if high is None:
+            return low + self.POSITION_GAP
+        if high - low > 1:
+            return (low + high) // 2
+        return None
+
+    def find_position(self, write_up_id, after, exclude=None):
+        """ locks the collection, renumbers its units if there is no gap after 'after' """
+
+        WriteUpCollection.objects.select_for_update().filter(pk=write_up_id).values_list('id', flat=True).get()
+        units = self.get_queryset().filter(write_up_id=write_up_id).exclude(pk=exclude)
+        position = self.get_free_position(units, after)
+        if position is None:
+            with connection.cursor() as cursor:
+                cursor.execute(RENUMBER_UNITS_SQL.format(unit=Unit._meta.db_table),
+                               {'gap': self.POSITION_GAP, 'write_up': write_up_id})
+            position = self.get_free_position(units, after)
+        return position
+
+    @atomic_with_retry()
+    def add(self, write_up, text, after=None):
+        if after is None:
+            after = self.get_queryset().filter(write_up=write_up).order_by('-position', '-id').first()
+        return self.create(write_up=write_up, text=text,
+                           position=self.find_position(write_up.pk, getattr(after, 'pk', None)))
+
+    @atomic_with_retry()
+    def move(self, unit, after=None):
+        unit.position = self.find_position(unit.write_up_id, getattr(after, 'pk', None), exclude=unit.pk)
+        self.get_queryset().filter(pk=unit.pk).update(position=unit.position)
+
+    def get_page(self, write_up, cursor=None, limit=None):
+        limit = limit or getattr(settings, 'UNIT_PAGE_SIZE', 50)
+        units = self.get_queryset().filter(write_up=write_up)
+        if cursor:
+            position, pk = [int(part) for part in cursor.split('-')]
+            units = units.filter(models.Q(position__gt=position) | models.Q(position=position, id__gt=pk))
+        rows = list(units.order_by('position', 'id').annotate(
+            title=F('text__title'), size=Func(F('text__text'), function='octet_length',
+                                               output_field=models.IntegerField()))
+                    .values('id', 'position', 'text_id', 'title', 'size')[:limit + 1])
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = '%d-%d' % (rows[-1]['position'], rows[-1]['id'])
+        return {'units': rows, 'next': next_cursor}
+
+    def get_text(self, unit_id, start=0, length=None):
+        text = F('text__text')
+        if start or length is not None:
+            args = [text, Value(start + 1)] + ([Value(length)] if length is not None else [])
+            text = Func(*args, function='substr', output_field=models.TextField())
+        return self.get_queryset().filter(pk=unit_id).annotate(part=text).values_list('part', flat=True).get()
+
+
+def set_text_storage(sender, **kwargs):
+    """ post_migrate receiver, texts are kept uncompressed so that substrings are read without the whole text """
+
+    with connection.cursor() as cursor:
+        cursor.execute("ALTER TABLE {table} ALTER COLUMN text SET STORAGE EXTERNAL".format(
+            table=BaseDesign._meta.db_table))
+
+
 class Unit(models.Model):
     """
     Unit acts as an intermediary table between write up collection and base design.
     That is, it stores all written matter against every collection
+
+    position -> order of the unit in its collection, gapped keys maintained by Unit.objects
     """
 
     write_up = models.ForeignKey(WriteUpCollection)
     text = models.ForeignKey(BaseDesign)
+    position = models.BigIntegerField(default=0)
+
+    objects = UnitManager()
+
+    class Meta:
+        index_together = [('write_up', 'position', 'id')]
 
     def __unicode__(self):
         return self.write_up
@@ -125,7 +426,8 @@ class Unit(models.Model):
 class LiveWriting(models.Model):
     """
     No Revision History
-    Save to same BaseDesign object repetitively
+    Save to same BaseDesign object repetitively, edits are streamed through write_up.live which
+    keeps the working copy in memory and only checkpoints it to BaseDesign
     closed group -> if only restricted group of people should be part of the event, then True
     """
 
@@ -140,7 +442,94 @@ class LiveWriting(models.Model):
         return self.write_up
 
 
-class GroupWriting(models.Model):  # TODO: Celery task to unlock objects, calculate X & Y min max
+class GroupWritingManager(models.Manager):
+    """
+    Manager for GroupWriting model, lease based locking of an article.
+
+    acquire_lock -> returns the fencing token of a new lease, raises GroupWritingLockError if the
+    article is locked by someone else or the user may not write to it (publication.roles.can_write)
+    renew_lock -> heartbeat ('X' timer), a single conditional UPDATE without history writes.
+    After GROUP_WRITING_SESSION_SECONDS ('Y' timer) it only succeeds with captcha_verified=True
+    release_lock -> ends the lease of the user
+    check_fence -> to be called in the transaction writing GroupWritingText, locks the article
+    row and raises GroupWritingLockError if 'token' is not the current valid lease
+    sweep_expired_locks -> unlocks every expired article in one statement and voids their sessions
+
+    Every acquire increments 'lock_token', so writes carrying the token of an expired lease are
+    rejected even if the same user holds the lock again.
+    """
+
+    @staticmethod
+    def lease():
+        return timedelta(seconds=getattr(settings, 'GROUP_WRITING_LEASE_SECONDS', 120))
+
+    @staticmethod
+    def session():
+        return timedelta(seconds=getattr(settings, 'GROUP_WRITING_SESSION_SECONDS', 30 * 60))
+
+    @atomic_with_retry()
+    def acquire_lock(self, article, user):
+        if not can_write(user, article.write_up):
+            raise GroupWritingLockError("User can not write to this article")
+
+        now = timezone.now()
+        if not self.get_queryset().filter(models.Q(lock=False) | models.Q(lock_expires__lt=now),
+                                          pk=article.pk, active=True) \
+                .update(lock=True, lock_holder=user, lock_token=F('lock_token') + 1, lock_session_start=now,
+                        lock_heartbeat=now, lock_expires=now + self.lease()):
+            raise GroupWritingLockError("Article is locked")
+
+        token = self.get_queryset().filter(pk=article.pk).values_list('lock_token', flat=True).get()
+        # a previous lease taken over before the sweeper reached it
+        GroupWritingLockHistory.objects.filter(article=article, release_time__isnull=True, token__lt=token) \
+            .update(release_time=now, void=True)
+        GroupWritingLockHistory.objects.create(article=article, lock_request_user=user, token=token,
+                                               lock_start_time=now, lock_last_request=now)
+        return token
+
+    def renew_lock(self, article, user, token, captcha_verified=False):
+        now = timezone.now()
+        lease = self.get_queryset().filter(pk=article.pk, lock=True, lock_holder=user, lock_token=token,
+                                           lock_expires__gte=now)
+        changes = {'lock_heartbeat': now, 'lock_expires': now + self.lease()}
+        if captcha_verified:
+            changes['lock_session_start'] = now
+        else:
+            lease = lease.filter(lock_session_start__gte=now - self.session())
+        if not lease.update(**changes):
+            raise GroupWritingLockError("Lease expired or captcha required")
+
+    @atomic_with_retry()
+    def release_lock(self, article, user, token):
+        now = timezone.now()
+        heartbeat = self.get_queryset().select_for_update().filter(
+            pk=article.pk, lock=True, lock_holder=user, lock_token=token).values_list('lock_heartbeat', flat=True)
+        if not heartbeat:
+            raise GroupWritingLockError("Lease is not held")
+        self.get_queryset().filter(pk=article.pk).update(lock=False, lock_holder=None, lock_expires=None)
+        GroupWritingLockHistory.objects.filter(article=article, token=token) \
+            .update(release_time=now, lock_last_request=heartbeat[0])
+
+    def check_fence(self, article, user, token):
+        if not self.get_queryset().select_for_update().filter(
+                pk=article.pk, lock=True, lock_holder=user, lock_token=token, lock_expires__gte=timezone.now()).exists():
+            raise GroupWritingLockError("Lease is not held")
+
+    @atomic_with_retry()
+    def sweep_expired_locks(self):
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE {history} AS h SET void = true, release_time = g.lock_expires, "
+                "lock_last_request = g.lock_heartbeat FROM {article} AS g "
+                "WHERE h.article_id = g.id AND h.token = g.lock_token AND h.release_time IS NULL "
+                "AND g.lock AND g.lock_expires < %s".format(history=GroupWritingLockHistory._meta.db_table,
+                                                            article=self.model._meta.db_table), [now])
+        return self.get_queryset().filter(lock=True, lock_expires__lt=now) \
+            .update(lock=False, lock_holder=None, lock_expires=None)
+
+
+class GroupWriting(models.Model):
     """
     For Group writing events. Only for users and not Publications.
     Sequentially users can add on to a story/article.
@@ -149,8 +538,11 @@ class GroupWriting(models.Model):  # TODO: Celery task to unlock objects, calcul
     Locking mechanism to avoid concurrent development: While the user is actively extending the
     article, every 'X' min. make an api call to keep the object locked. After 'Y' min ask the user to
     fill captcha to rest 'Y' timer. If either X or Y exceeds, unlock the table back. and make the current session void.
+    X -> GROUP_WRITING_LEASE_SECONDS, Y -> GROUP_WRITING_SESSION_SECONDS, see GroupWritingManager.
+    Expired leases are unlocked by the 'sweep_group_writing_locks' command.
 
     closed group -> if only restricted group of people should be part of the event, then True
+    lock_token -> fencing token, incremented on every acquired lock
     """
 
     write_up = models.OneToOneField(WriteUpCollection)
@@ -158,9 +550,16 @@ class GroupWriting(models.Model):  # TODO: Celery task to unlock objects, calcul
     closed_group_users = models.ManyToManyField(User)
     active = models.BooleanField(default=True)
     lock = models.BooleanField(default=False)
+    lock_holder = models.ForeignKey(User, null=True, blank=True, related_name='+')
+    lock_token = models.BigIntegerField(default=0)
+    lock_session_start = models.DateTimeField(null=True, blank=True)
+    lock_heartbeat = models.DateTimeField(null=True, blank=True)
+    lock_expires = models.DateTimeField(null=True, blank=True, db_index=True)
     create_time = models.DateTimeField(auto_now_add=True)
     update_time = models.DateTimeField(auto_now=True)
 
+    objects = GroupWritingManager()
+
     def __unicode__(self):
         return self.write_up
 
@@ -0,0 +1,214 @@
+"""
+Sanitized HTML of BaseDesign texts, cached by content version.
+
+The TinyMCE HTML of a text is reduced to ALLOWED_TAGS / ALLOWED_ATTRIBUTES and cached under
+its text_hash (and RENDER_VERSION, to be bumped when the sanitizer changes). A saved text gets a
+new hash, so entries never have to be invalidated, stale versions simply expire after
+RENDER_CACHE_TIMEOUT seconds.
+
+On a miss only one process renders a text: it takes a short lock in the cache, others wait up to
+RENDER_LOCK_WAIT seconds for its result before rendering themselves. Hits, misses, renders and
+waits are counted in the cache (get_metrics), the 'render_cache' command warms the texts of the
+trending write ups and shows the counters.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.html import escape
+from django.utils.six.moves.html_parser import HTMLParser
+
+ALLOWED_TAGS = frozenset((
+    'p', 'br', 'hr', 'span', 'div', 'strong', 'b', 'em', 'i', 'u', 's', 'sub', 'sup', 'blockquote', 'pre',
+    'code', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'ul', 'ol', 'li', 'a', 'img', 'table', 'thead', 'tbody',
+    'tr', 'th', 'td',
+))
+VOID_TAGS = frozenset(('br', 'hr', 'img'))
+ALLOWED_ATTRIBUTES = {
+    'a': ('href', 'title'),
+    'img': ('src', 'alt', 'width', 'height'),
+    'td': ('colspan', 'rowspan'),
+    'th': ('colspan', 'rowspan'),
+}
+URL_ATTRIBUTES = ('href', 'src')
+ALLOWED_SCHEMES = ('http', 'https', 'mailto')
+# contents are dropped along with the tag
+DROPPED_TAGS = frozenset(('script', 'style', 'iframe', 'object', 'embed', 'noscript'))
+
+RENDER_KEY = 'render-%s-%s'  # version, text hash -> sanitized html
+LOCK_KEY = 'render-lock-%s-%s'
+METRIC_KEY = 'render-metric-%s'
+METRICS = ('hit', 'miss', 'render', 'wait')
+
+
+def is_allowed_url(url):
+    url = url.strip().lower()
+    scheme = url.split(':', 1)[0] if ':' in url.split('/', 1)[0] else None
+    return scheme is None or scheme in ALLOWED_SCHEMES
+
+
+class Sanitizer(HTMLParser):
+    """ Keeps allowed tags and attributes, escapes text, closes tags left open """
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.out = []
+        self.open = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+        allowed = ALLOWED_ATTRIBUTES.get(tag, ())
+        kept = ''.join(' %s="%s"' % (name, escape(value)) for name, value in attrs
+                       if name in allowed and value is not None and (
+                           name not in URL_ATTRIBUTES or is_allowed_url(value)))
+        if tag == 'a' and 'href' in dict(attrs):
+            kept += ' rel="nofollow noopener"'
+        self.out.append('<%s%s>' % (tag, kept))
+        if tag not in VOID_TAGS:
+            self.open.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and self.open and self.open[-1] == tag:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+            return
+        if self.dropping or tag not in self.open:
+            return
+        while self.open:
+            last = self.open.pop()
+            self.out.append('</%s>' % last)
+            if last == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.out.append(escape(data))
+
+    def handle_entityref(self, name):
+        self.handle_data(self.unescape('&%s;' % name))
+
+    def handle_charref(self, name):
+        self.handle_data(self.unescape('&#%s;' % name))
+
+    def render(self, html):
+        self.feed(html)
+        self.close()
+        self.out.extend('</%s>' % tag for tag in reversed(self.open))
+        return ''.join(self.out)
+
+
+def sanitize(html):
+    return Sanitizer().render(html or '')
+
+
+def count(metric, n=1):
+    key = METRIC_KEY % metric
+    try:
+        cache.incr(key, n)
+    except ValueError:
+        if not cache.add(key, n, None):
+            cache.incr(key, n)
+
+
+def get_metrics():
+    values = cache.get_many([METRIC_KEY % metric for metric in METRICS])
+    metrics = dict((metric, values.get(METRIC_KEY % metric, 0)) for metric in METRICS)
+    lookups = metrics['hit'] + metrics['miss']
+    metrics['hit_ratio'] = float(metrics['hit']) / lookups if lookups else None
+    return metrics
+
+
+def reset_metrics():
+    cache.delete_many([METRIC_KEY % metric for metric in METRICS])
+
+
+def get_version():
+    return getattr(settings, 'RENDER_VERSION', 1)
+
+
+def get_key(text_hash):
+    return RENDER_KEY % (get_version(), text_hash)
+
+
+def get_text_hash(base_design):
+    from write_up.models import get_text_hash  # write_up.models is imported after this module
+
+    return base_design.text_hash or get_text_hash(base_design.text)
+
+
+def store(text_hash, html):
+    cache.set(get_key(text_hash), html, getattr(settings, 'RENDER_CACHE_TIMEOUT', 7 * 24 * 60 * 60))
+
+
+def render_text(text_hash, text):
+    """ sanitized html of a text, rendered by one process at a time per content version """
+
+    key = get_key(text_hash)
+    html = cache.get(key)
+    if html is not None:
+        count('hit')
+        return html
+    count('miss')
+
+    lock = LOCK_KEY % (get_version(), text_hash)
+    wait = getattr(settings, 'RENDER_LOCK_WAIT', 2.0)
+    if not cache.add(lock, 1, int(wait) + 1):
+        count('wait')
+        deadline = time.time() + wait
+        while time.time() < deadline:
+            time.sleep(0.05)
+            html = cache.get(key)
+            if html is not None:
+                return html
+
+    try:
+        html = sanitize(text)
+        count('render')
+        store(text_hash, html)
+    finally:
+        cache.delete(lock)
+    return html
+
+
+def render(base_design):
+    return render_text(get_text_hash(base_design), base_design.text)
+
+
+def render_many(base_designs):
+    """ {base design id: sanitized html}, cached texts are fetched in one round trip """
+
+    hashes = dict((base_design.pk, get_text_hash(base_design)) for base_design in base_designs)
+    cached = cache.get_many([get_key(text_hash) for text_hash in hashes.values()])
+    if cached:
+        count('hit', len(cached))
+    rendered = {}
+    for base_design in base_designs:
+        html = cached.get(get_key(hashes[base_design.pk]))
+        rendered[base_design.pk] = html if html is not None else render_text(hashes[base_design.pk],
+                                                                             base_design.text)
+    return rendered
+
+
+def warm(base_designs):
+    """ renders and stores the texts which are not cached yet, returns their number """
+
+    hashes = dict((get_text_hash(base_design), base_design.text) for base_design in base_designs)
+    cached = cache.get_many([get_key(text_hash) for text_hash in hashes])
+    rendered = 0
+    for text_hash, text in hashes.items():
+        if get_key(text_hash) not in cached:
+            store(text_hash, sanitize(text))
+            rendered += 1
+    if rendered:
+        count('render', rendered)
+    return rendered
@@ -0,0 +1,103 @@
+"""
+Postgres full-text search over write ups.
+
+WriteUpCollection (title, description) and BaseDesign (title, text) each carry a weighted
+'search_vector' which is recomputed for the saved row only, whenever it is written. Both columns
+have a GIN index (created after migrate), WriteUpCollection.objects.search ranks the matches.
+
+The vector of a long text is large and only read by the search query: the default managers
+(SearchVectorManager) defer it and full saves of existing rows leave it out (get_save_fields).
+Querysets joining these models with select_related defer it themselves.
+"""
+
+import re
+
+from django.conf import settings
+from django.db import models, connection
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class TSVectorField(models.Field):
+    """ Postgres tsvector column, only written with update_search_vector """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('null', True)
+        kwargs.setdefault('editable', False)
+        super(TSVectorField, self).__init__(*args, **kwargs)
+
+    def db_type(self, connection):
+        return 'tsvector'
+
+
+class SearchVectorManager(models.Manager):
+    """ Default manager of the searchable models, also used for related objects """
+
+    use_for_related_fields = True
+
+    def get_queryset(self):
+        return super(SearchVectorManager, self).get_queryset().defer('search_vector')
+
+
+def get_save_fields(instance, kwargs):
+    """
+    update_fields of Model.save: the loaded fields without search_vector for a full save of an
+    existing row, as given otherwise
+    """
+
+    if kwargs.get('update_fields') is not None or kwargs.get('force_insert') or instance._state.adding:
+        return kwargs.get('update_fields')
+    deferred = instance.get_deferred_fields()
+    return [f.name for f in instance._meta.concrete_fields
+            if not f.primary_key and not isinstance(f, TSVectorField) and f.attname not in deferred]
+
+
+def get_config():
+    return getattr(settings, 'SEARCH_CONFIG', 'english')
+
+
+def get_vector_sql(model):
+    """
+    SQL expression of the weighted tsvector of a row, model.SEARCH_WEIGHTS is a list of
+    (column, weight). Markup is stripped and long texts are cut at SEARCH_TEXT_MAX_LENGTH.
+    """
+
+    return ' || '.join(
+        "setweight(to_tsvector(%%(config)s::regconfig, left(regexp_replace(coalesce(%s, ''), '<[^>]*>', ' ', 'g'), "
+        "%%(max_length)s)), '%s')" % (connection.ops.quote_name(column), weight)
+        for column, weight in model.SEARCH_WEIGHTS)
+
+
+def update_search_vector(model, pks):
+    pks = list(pks)
+    if not pks:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("UPDATE {table} SET search_vector = {vector} WHERE id = ANY(%(pks)s)".format(
+            table=model._meta.db_table, vector=get_vector_sql(model)),
+            {'config': get_config(), 'max_length': getattr(settings, 'SEARCH_TEXT_MAX_LENGTH', 500000),
+             'pks': pks})
+
+
+def to_prefix_query(text):
+    """
+    'full text sea' -> 'full & text & sea:*', every word must match and the last one is
+    matched as a prefix (search as you type). Only words are kept, so no tsquery syntax can
+    be injected. Returns None when there is nothing to search for.
+    """
+
+    words = WORD_RE.findall(text or '')
+    if not words:
+        return None
+    return ' & '.join(words[:-1] + [words[-1] + ':*'])
+
+
+def create_search_indexes(sender, **kwargs):
+    """ post_migrate receiver, Django 1.9 can not declare GIN indexes """
+
+    from write_up.models import WriteUpCollection, BaseDesign
+
+    with connection.cursor() as cursor:
+        for model in (WriteUpCollection, BaseDesign):
+            cursor.execute("CREATE INDEX IF NOT EXISTS {table}_search_vector ON {table} USING gin (search_vector)"
+                           .format(table=model._meta.db_table))
@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent by BaseDesign.objects.save_text when a text should be recorded in revision history.
+# 'text'/'title' are the revised content, which is not necessarily the current one of 'instance'.
+revision_saved = Signal(providing_args=['instance', 'user', 'text', 'title'])
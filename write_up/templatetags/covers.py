@@ -0,0 +1,19 @@
+from django import template
+
+from write_up.covers import get_cover_url, get_cover_srcset
+
+register = template.Library()
+
+
+@register.simple_tag
+def cover_url(write_up, size='medium', ext=None):
+    """ {% cover_url write_up 'small' %} or {% cover_url write_up 'large' 'jpg' %} """
+
+    return get_cover_url(write_up, size, ext)
+
+
+@register.simple_tag
+def cover_srcset(write_up, ext=None):
+    """ <img srcset="{% cover_srcset write_up 'webp' %}" ...>, empty until the derived sizes exist """
+
+    return get_cover_srcset(write_up, ext)
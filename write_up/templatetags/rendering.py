@@ -0,0 +1,13 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from write_up.rendering import render
+
+register = template.Library()
+
+
+@register.simple_tag
+def rendered_text(base_design):
+    """ {% rendered_text unit.text %} -> sanitized html of the text, from the fragment cache """
+
+    return mark_safe(render(base_design))
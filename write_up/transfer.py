@@ -0,0 +1,230 @@
+"""
+Streaming export and import of write up collections (Postgres only), used by the
+'export_write_ups' and 'import_write_ups' commands.
+
+An export is a directory with a manifest.json and one gzip file per table, in dependency order:
+WriteUpCollection, BaseDesign, Unit, RevisionHistory. CSV files are written by COPY ... TO STDOUT,
+JSONL files (one row_to_json object per line) are read through a server-side cursor, so memory
+stays constant whatever the size of the library. Search vectors are not exported, cover files
+are referenced by name only.
+
+The import COPYs every file into a temporary table, draws a new id for each row from the target
+sequence and inserts each table with one INSERT .. SELECT that remaps the references between the
+exported tables. UUIDs are preserved. References to users and publications are kept when the
+row exists in the target database, otherwise set to NULL (or to a default user where required).
+"""
+
+import gzip
+import json
+import os
+import time
+import uuid
+
+from django.db import connection
+
+from essential.models import RevisionHistory
+from write_up.models import WriteUpCollection, BaseDesign, Unit
+from write_up.search import TSVectorField
+
+# model -> rows of the collections selected by {where} (on alias 'w'), exported rows are aliased 't'
+SOURCES = (
+    (WriteUpCollection, "{write_up} t WHERE t.id IN (SELECT w.id FROM {write_up} w WHERE {where})"),
+    (BaseDesign, "{base_design} t WHERE t.id IN (SELECT u.text_id FROM {unit} u JOIN {write_up} w "
+                 "ON w.id = u.write_up_id WHERE {where})"),
+    (Unit, "{unit} t JOIN {write_up} w ON w.id = t.write_up_id WHERE {where}"),
+    (RevisionHistory, "{revision} t WHERE t.parent_id IN (SELECT u.text_id FROM {unit} u JOIN {write_up} w "
+                      "ON w.id = u.write_up_id WHERE {where})"),
+)
+
+MODELS = [model for model, _ in SOURCES]
+
+# foreign keys between exported tables, remapped to the new ids on import
+INTERNAL_REFERENCES = {
+    Unit: ('write_up', 'text'),
+    RevisionHistory: ('parent',),
+}
+
+# foreign keys to rows which are not exported
+EXTERNAL_REFERENCES = {
+    WriteUpCollection: ('user', 'publication'),
+    BaseDesign: ('last_editor',),
+    RevisionHistory: ('user',),
+}
+
+
+def get_columns(model):
+    return [f.column for f in model._meta.concrete_fields if not isinstance(f, TSVectorField)]
+
+
+def quote_columns(columns, alias=None):
+    prefix = '%s.' % alias if alias else ''
+    return ', '.join(prefix + connection.ops.quote_name(column) for column in columns)
+
+
+def get_file_name(model, file_format):
+    return '%s.%s.gz' % (model._meta.label_lower, file_format)
+
+
+def get_select(model, where):
+    tables = {'write_up': WriteUpCollection._meta.db_table, 'base_design': BaseDesign._meta.db_table,
+              'unit': Unit._meta.db_table, 'revision': RevisionHistory._meta.db_table}
+    source = dict(SOURCES)[model].format(where=where, **tables)
+    return "SELECT %s FROM %s ORDER BY t.id" % (quote_columns(get_columns(model), 't'), source)
+
+
+def export_table(model, file_format, path, where='TRUE', params=(), itersize=2000):
+    """ Streams the rows of one table to a gzip file at 'path', returns the number of rows """
+
+    select = get_select(model, where)
+    with gzip.open(path, 'wb') as out, connection.cursor() as cursor:
+        if file_format == 'csv':
+            sql = cursor.mogrify("COPY (%s) TO STDOUT WITH (FORMAT csv, HEADER)" % select, params)
+            cursor.copy_expert(sql.decode('utf-8') if isinstance(sql, bytes) else sql, out)
+            if cursor.rowcount >= 0:
+                return cursor.rowcount
+            cursor.execute("SELECT count(*) FROM (%s) r" % select, params)
+            return cursor.fetchone()[0]
+
+        # named cursor -> rows are fetched 'itersize' at a time, needs the surrounding transaction
+        named = connection.connection.cursor(name='export_%s' % uuid.uuid4().hex)
+        named.itersize = itersize
+        rows = 0
+        try:
+            named.execute("SELECT row_to_json(r)::text FROM (%s) r" % select, params)
+            for (line,) in named:
+                out.write(line.encode('utf-8') + b'\n')
+                rows += 1
+        finally:
+            named.close()
+        return rows
+
+
+class CopyText(object):
+    """ Readable file over JSONL lines in COPY text format (one column, backslashes escaped) """
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.buffer = b''
+
+    def read(self, size=8192):
+        while len(self.buffer) < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            line = line.rstrip(b'\r\n')
+            if line:
+                self.buffer += line.replace(b'\\', b'\\\\') + b'\n'
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def get_import_table(model):
+    return 'import_%s' % model._meta.db_table
+
+
+def load_table(cursor, model, file_format, path):
+    """ COPYs one export file into a temporary table and draws the new ids, returns the number of rows """
+
+    table = get_import_table(model)
+    columns = quote_columns(get_columns(model))
+    cursor.execute("CREATE TEMPORARY TABLE %s ON COMMIT DROP AS SELECT %s FROM %s WITH NO DATA" % (
+        table, columns, model._meta.db_table))
+    with gzip.open(path, 'rb') as source:
+        if file_format == 'csv':
+            cursor.copy_expert("COPY %s (%s) FROM STDIN WITH (FORMAT csv, HEADER)" % (table, columns), source)
+        else:
+            cursor.execute("CREATE TEMPORARY TABLE import_lines (doc json)")
+            cursor.copy_expert("COPY import_lines (doc) FROM STDIN", CopyText(source))
+            cursor.execute("INSERT INTO %s SELECT (json_populate_record(NULL::%s, doc)).* FROM import_lines" % (
+                table, table))
+            cursor.execute("DROP TABLE import_lines")
+    cursor.execute("ALTER TABLE %s ADD COLUMN new_id integer" % table)
+    cursor.execute("UPDATE %s SET new_id = nextval(pg_get_serial_sequence(%%s, 'id'))" % table,
+                   [model._meta.db_table])
+    cursor.execute("CREATE INDEX ON %s (id)" % table)
+    cursor.execute("ANALYZE %s" % table)
+    cursor.execute("SELECT count(*) FROM %s" % table)
+    return cursor.fetchone()[0]
+
+
+def resolve_external(cursor, model, default_user=None):
+    """
+    Sets references to rows missing in this database to NULL, NOT NULL user references to
+    default_user. Raises ValueError if one is required but not given.
+    """
+
+    table = get_import_table(model)
+    for name in EXTERNAL_REFERENCES.get(model, ()):
+        field = model._meta.get_field(name)
+        missing = "{column} IS NOT NULL AND NOT EXISTS (SELECT 1 FROM {target} r WHERE r.id = {column})".format(
+            column=field.column, target=field.related_model._meta.db_table)
+        if field.null:
+            cursor.execute("UPDATE %s SET %s = NULL WHERE %s" % (table, field.column, missing))
+            continue
+        if default_user is None:
+            cursor.execute("SELECT count(*) FROM %s WHERE %s" % (table, missing))
+            count = cursor.fetchone()[0]
+            if count:
+                raise ValueError("%d %s rows reference missing users, give a default user" % (
+                    count, model.__name__))
+        else:
+            cursor.execute("UPDATE %s SET %s = %%s WHERE %s" % (table, field.column, missing), [default_user])
+
+
+def count_existing_uuids(cursor):
+    cursor.execute("SELECT count(*) FROM %s i JOIN %s w ON w.uuid = i.uuid" % (
+        get_import_table(WriteUpCollection), WriteUpCollection._meta.db_table))
+    return cursor.fetchone()[0]
+
+
+def insert_table(cursor, model):
+    """ Copies the temporary table of the model into its table with the new ids, returns the number of rows """
+
+    references = dict((model._meta.get_field(name).column, model._meta.get_field(name).related_model)
+                      for name in INTERNAL_REFERENCES.get(model, ()))
+    columns = get_columns(model)
+    select, joins = [], []
+    for column in columns:
+        if column == 'id':
+            select.append('i.new_id')
+        elif column in references:
+            alias = 'r_%s' % column
+            joins.append("JOIN %s %s ON %s.id = i.%s" % (get_import_table(references[column]), alias, alias, column))
+            select.append('%s.new_id' % alias)
+        else:
+            select.append('i.%s' % connection.ops.quote_name(column))
+    cursor.execute("INSERT INTO %s (%s) SELECT %s FROM %s i %s" % (
+        model._meta.db_table, quote_columns(columns), ', '.join(select), get_import_table(model), ' '.join(joins)))
+    return cursor.rowcount
+
+
+def write_manifest(directory, file_format, counts):
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump({'format': file_format, 'tables': [
+            {'model': model._meta.label_lower, 'file': get_file_name(model, file_format), 'rows': counts[model],
+             'columns': get_columns(model)} for model in MODELS]}, f, indent=2)
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, 'manifest.json')) as f:
+        return json.load(f)
+
+
+class Throughput(object):
+    """ Writes rows and rows per second of every step and of the whole run """
+
+    def __init__(self, write):
+        self.write = write
+        self.start = self.last = time.time()
+        self.rows = 0
+
+    def step(self, label, rows):
+        now = time.time()
+        self.write("%-30s %10d rows %10.0f rows/s" % (label, rows, rows / max(now - self.last, 1e-6)))
+        self.rows += rows
+        self.last = now
+
+    def total(self):
+        elapsed = time.time() - self.start
+        self.write("%-30s %10d rows %10.0f rows/s (%.1fs)" % (
+            'total', self.rows, self.rows / max(elapsed, 1e-6), elapsed))
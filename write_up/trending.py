@@ -0,0 +1,141 @@
+"""
+Time decayed trending score of write ups.
+
+An event (vote, comment, view) of weight w at time t adds w * 2 ** ((t - epoch) / half life)
+to WriteUpCollection.trending_score. Instead of decaying every score, newer events weigh
+exponentially more, so ordering by the stored score is ordering by the decayed sum.
+The 'renormalize_trending' command moves the epoch forward and scales all scores down before
+they can overflow.
+
+Increments are applied in their own short transaction once the transaction of the event commits
+(a lost race is retried there instead of failing the vote or comment). They read the epoch row
+FOR SHARE, so they serialize with a concurrent renormalization. The row is created after migrate,
+should it be missing events count as if they happened at the epoch until the next renormalization
+creates it.
+
+A renormalization scales the scores in batches of TRENDING_RENORMALIZE_BATCH ids, one transaction
+each. While it runs, renormalized_id of the epoch row marks the last scaled id: rows above it are
+still relative to previous_epoch, increments of those rows use it. An interrupted run is resumed
+by the next one.
+"""
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from essential.utils import atomic_with_retry
+
+INCREMENT_SQL = """
+UPDATE {write_up} w SET trending_score = w.trending_score + e.weight * power(2, extract(epoch FROM %(timestamp)s -
+    CASE WHEN w.id > t.renormalized_id THEN t.previous_epoch ELSE coalesce(t.epoch, now()) END) / %(half_life)s)
+FROM unnest(%(ids)s::integer[], %(weights)s::float8[]) AS e (id, weight)
+    LEFT JOIN (SELECT epoch, previous_epoch, renormalized_id FROM {epoch} WHERE id = 1 FOR SHARE) t ON TRUE
+WHERE w.id = e.id
+"""
+
+RENORMALIZE_SQL = """
+UPDATE {write_up} SET trending_score = CASE WHEN abs(trending_score * %(scale)s) < %(min)s
+    THEN 0 ELSE trending_score * %(scale)s END
+WHERE id > %(start)s AND id <= %(end)s AND trending_score <> 0
+"""
+
+
+def get_half_life():
+    return float(getattr(settings, 'TRENDING_HALF_LIFE', 6 * 60 * 60))
+
+
+def get_weight(event):
+    return getattr(settings, 'TRENDING_WEIGHTS', {}).get(event, 0)
+
+
+@atomic_with_retry()
+def increment(weights, timestamp):
+    from write_up.models import WriteUpCollection, TrendingEpoch  # write_up.models imports engagement
+
+    with connection.cursor() as cursor:
+        cursor.execute(INCREMENT_SQL.format(write_up=WriteUpCollection._meta.db_table,
+                                            epoch=TrendingEpoch._meta.db_table),
+                       {'ids': list(weights.keys()), 'weights': [float(w) for w in weights.values()],
+                        'timestamp': timestamp, 'half_life': get_half_life()})
+
+
+def add_trending(weights, timestamp=None):
+    """
+    weights -> {write up id: summed weight of its events}
+    timestamp -> time of the events, defaults to now. Passing the original time with a
+    negative weight exactly undoes an earlier event (e.g. a removed vote).
+
+    Applied when the current transaction commits, dropped if it rolls back.
+    """
+
+    weights = dict((pk, weight) for pk, weight in weights.items() if weight)
+    if not weights:
+        return
+    timestamp = timestamp or timezone.now()
+    transaction.on_commit(lambda: increment(weights, timestamp))
+
+
+@atomic_with_retry()
+def start_renormalization():
+    """ Moves the epoch to now unless a run is in progress, returns the epoch row """
+
+    from write_up.models import TrendingEpoch
+
+    epoch = TrendingEpoch.objects.select_for_update().filter(pk=1).first()
+    if epoch is None:
+        return TrendingEpoch.objects.create(pk=1, epoch=timezone.now())
+    if epoch.renormalized_id is None:
+        epoch.previous_epoch, epoch.epoch, epoch.renormalized_id = epoch.epoch, timezone.now(), 0
+        epoch.save()
+    return epoch
+
+
+def get_scale(epoch):
+    return 2 ** (-(epoch.epoch - epoch.previous_epoch).total_seconds() / get_half_life())
+
+
+@atomic_with_retry()
+def renormalize_batch(batch_size):
+    """ Scales the scores of the next batch of ids, returns False once the run is finished """
+
+    from write_up.models import WriteUpCollection, TrendingEpoch
+
+    epoch = TrendingEpoch.objects.select_for_update().get(pk=1)
+    if epoch.renormalized_id is None:
+        return False
+
+    start, end = epoch.renormalized_id, epoch.renormalized_id + batch_size
+    with connection.cursor() as cursor:
+        cursor.execute(RENORMALIZE_SQL.format(write_up=WriteUpCollection._meta.db_table),
+                       {'scale': get_scale(epoch), 'min': getattr(settings, 'TRENDING_MIN_SCORE', 1e-3),
+                        'start': start, 'end': end})
+    if WriteUpCollection.objects.filter(pk__gt=end).exists():
+        epoch.renormalized_id = end
+    else:
+        epoch.previous_epoch = epoch.renormalized_id = None
+    epoch.save()
+    return epoch.renormalized_id is not None
+
+
+def renormalize(batch_size=None):
+    """
+    Moves the epoch to now, scores that decayed below TRENDING_MIN_SCORE are reset to 0.
+    Returns the scale of the scores.
+    """
+
+    batch_size = batch_size or getattr(settings, 'TRENDING_RENORMALIZE_BATCH', 10000)
+    epoch = start_renormalization()
+    if epoch.renormalized_id is None:  # first run, nothing to scale
+        return 1.0
+    scale = get_scale(epoch)
+    while renormalize_batch(batch_size):
+        pass
+    return scale
+
+
+def create_epoch(sender, **kwargs):
+    """ post_migrate receiver, creates the epoch row on a fresh database """
+
+    from write_up.models import TrendingEpoch
+
+    TrendingEpoch.objects.get_or_create(pk=1, defaults={'epoch': timezone.now()})